@@ -1,10 +1,20 @@
 
+# Set of characters to scan for. Latin-1 characters are looked up from
+# table, other characters are compared with chars one by one.
+cdef struct _CharSet:
+    Py_UCS4 *chars
+    Py_ssize_t size
+    bint comp_ne
+    unsigned char table[256]
+
 cdef public class GappedBuffer [object GappedBufferObj, type GappedBufferType]:
     cdef public Py_ssize_t bufsize
     cdef public Py_ssize_t numelems 
     cdef public Py_ssize_t gap
     cdef public Py_ssize_t gapsize
-    cdef Py_UCS4 *buf
+    cdef char *buf
+    cdef readonly int kind
+    cdef readonly Py_ssize_t exports
 
 #    cdef inline _conv_slice(self, Py_ssize_t pos) nogil:
 #        if pos < 0:
@@ -12,11 +22,21 @@ cdef public class GappedBuffer [object GappedBufferObj, type GappedBufferType]:
 #        return self.numelems
 
     cdef void _resize_buf(self, Py_ssize_t size)
+    cdef void _widen(self, Py_UCS4 maxchar)
+    cdef int _check_exports(self) except -1
+    cdef inline void _acquire_read(self) noexcept
+    cdef inline void _release_read(self) noexcept
     cdef void _expand_gap(self, Py_ssize_t size)
     cdef void _shrink_gap(self)
     cdef void _move_gap(self, Py_ssize_t index)
 
+    cdef inline Py_UCS4 _getchar(self, Py_ssize_t index) noexcept nogil
+    cdef inline void _setchar(self, Py_ssize_t index,
+            Py_UCS4 c) noexcept nogil
+
     cdef Py_UCS4 _get_max(self, Py_ssize_t begin, Py_ssize_t end) nogil
+    cdef void _copy_same_kind(self, void *dest, Py_ssize_t begin, 
+            Py_ssize_t end) nogil
     cdef void _copy_chars1(self, void *dest, Py_ssize_t begin, 
             Py_ssize_t end) nogil
     cdef void _copy_chars2(self, void *dest, Py_ssize_t begin, 
@@ -28,21 +48,220 @@ cdef public class GappedBuffer [object GappedBufferObj, type GappedBufferType]:
             Py_ssize_t *f, Py_ssize_t *t) except *
 
     cdef _insert(self, Py_ssize_t index, unicode s)
+    cdef void _put_string(self, unicode s)
     cpdef insert(self, Py_ssize_t index, unicode s)
     cpdef append(self, unicode s)
     cdef _delete(self, Py_ssize_t begin, Py_ssize_t end)
     cpdef delete(self, Py_ssize_t begin, Py_ssize_t end)
     cpdef replace(self, Py_ssize_t begin, Py_ssize_t end, unicode s)
+    cpdef apply_edits(self, object edits)
     cpdef get(self, Py_ssize_t begin, Py_ssize_t end)
 
     cdef int _get_slice(self, object obj,
             Py_ssize_t *f, Py_ssize_t *t) except *
+    cdef Py_ssize_t _scan(self, Py_ssize_t begin, Py_ssize_t end,
+            _CharSet *cs, int mode) except -2
+    cdef Py_ssize_t _search(self, unicode needle, Py_ssize_t begin,
+            Py_ssize_t end, bint ignorecase, bint reverse) except -2
     cpdef getints(self, Py_ssize_t begin, Py_ssize_t end)
     cdef _insertints(self, Py_ssize_t index, object s)
+    cdef _insertints_from(self, Py_ssize_t index, Py_buffer *view)
+    cpdef insertints(self, Py_ssize_t index, object s)
+    cpdef appendints(self, object s)
+    cpdef replaceints(self, Py_ssize_t begin, Py_ssize_t end, object s)
+    cdef void _fill(self, Py_ssize_t begin, Py_ssize_t end,
+            Py_UCS4 c) noexcept nogil
+    cpdef setints(self, Py_ssize_t begin, Py_ssize_t end, unsigned long v)
+
+
+
+
+cdef class _BufferSegment:
+    cdef GappedBuffer buf
+    cdef Py_ssize_t begin
+    cdef Py_ssize_t shape[1]
+    cdef Py_ssize_t strides[1]
+
+cdef class LineIndex:
+    cdef Py_ssize_t *lines
+    cdef readonly Py_ssize_t bufsize
+    cdef readonly Py_ssize_t numlines
+    cdef readonly Py_ssize_t gap
+    cdef readonly Py_ssize_t gapsize
+    cdef readonly Py_ssize_t textlen
+
+    cdef void _expand_gap(self, Py_ssize_t size)
+    cdef void _move_gap(self, Py_ssize_t pos) noexcept nogil
+    cdef inline Py_ssize_t _getline(self, Py_ssize_t n) noexcept nogil
+
+    cpdef inserted(self, Py_ssize_t pos, unicode s)
+    cpdef deleted(self, Py_ssize_t begin, Py_ssize_t end)
+    cpdef Py_ssize_t pos_to_line(self, Py_ssize_t pos) except -1
+    cpdef Py_ssize_t line_to_pos(self, Py_ssize_t lineno) except -1
+    cpdef Py_ssize_t gettol(self, Py_ssize_t pos) except -1
+    cpdef Py_ssize_t geteol(self, Py_ssize_t pos) except -1
+
+cdef class StyleRuns:
+    cdef Py_ssize_t *starts
+    cdef unsigned long *values
+    cdef readonly Py_ssize_t bufsize
+    cdef readonly Py_ssize_t numruns
+    cdef readonly Py_ssize_t gap
+    cdef readonly Py_ssize_t gapsize
+    cdef readonly Py_ssize_t textlen
+
+    cdef void _expand_gap(self, Py_ssize_t size)
+    cdef void _move_gap(self, Py_ssize_t n) noexcept nogil
+    cdef inline Py_ssize_t _getstart(self, Py_ssize_t n) noexcept nogil
+    cdef inline Py_ssize_t _getend(self, Py_ssize_t n) noexcept nogil
+    cdef inline unsigned long _getvalue(self, Py_ssize_t n) noexcept nogil
+    cdef Py_ssize_t _count_before(self, Py_ssize_t pos) noexcept nogil
+    cdef void _put(self, Py_ssize_t start, unsigned long value)
+    cdef void _join_gap(self) noexcept nogil
+    cdef Py_ssize_t _remove_before(self, Py_ssize_t end, 
+                                   unsigned long *last) noexcept nogil
+    cdef inline bint _starts_at_gap(self, Py_ssize_t pos) noexcept nogil
+
+    cpdef inserted(self, Py_ssize_t pos, Py_ssize_t size)
+    cpdef deleted(self, Py_ssize_t begin, Py_ssize_t end)
+    cpdef setints(self, Py_ssize_t begin, Py_ssize_t end, unsigned long v)
+    cpdef unsigned long getint(self, Py_ssize_t pos) except? 0
+    cpdef getints(self, Py_ssize_t begin, Py_ssize_t end)
+
+cdef class MatchSpans:
+    cdef Py_ssize_t *starts
+    cdef Py_ssize_t *ends
+    cdef readonly Py_ssize_t bufsize
+    cdef readonly Py_ssize_t numspans
+    cdef readonly Py_ssize_t gap
+    cdef readonly Py_ssize_t gapsize
+    cdef readonly Py_ssize_t textlen
+
+    cdef void _expand_gap(self, Py_ssize_t size)
+    cdef void _move_gap(self, Py_ssize_t n) noexcept nogil
+    cdef inline Py_ssize_t _getstart(self, Py_ssize_t n) noexcept nogil
+    cdef inline Py_ssize_t _getend(self, Py_ssize_t n) noexcept nogil
+    cdef Py_ssize_t _count_before(self, Py_ssize_t pos) noexcept nogil
+    cdef Py_ssize_t _remove_before(self, Py_ssize_t end, 
+                                   Py_ssize_t *first, 
+                                   Py_ssize_t *last) noexcept nogil
+    cdef Py_ssize_t _count_overlapped(self, Py_ssize_t pos) noexcept nogil
+
+    cpdef inserted(self, Py_ssize_t pos, Py_ssize_t size)
+    cpdef deleted(self, Py_ssize_t begin, Py_ssize_t end)
+    cpdef add(self, Py_ssize_t begin, Py_ssize_t end)
+    cpdef Py_ssize_t remove(self, Py_ssize_t begin, Py_ssize_t end) except -1
+
+cdef class MarkIndex:
+    cdef Py_ssize_t *poss
+    cdef Py_ssize_t *keys
+    cdef Py_ssize_t *slots
+    cdef Py_ssize_t numslots
+    cdef list freeids
+    cdef readonly Py_ssize_t bufsize
+    cdef readonly Py_ssize_t nummarks
+    cdef readonly Py_ssize_t gap
+    cdef readonly Py_ssize_t gapsize
+    cdef readonly Py_ssize_t delta
+
+    cdef void _expand_gap(self, Py_ssize_t size)
+    cdef void _expand_slots(self)
+    cdef void _move_gap(self, Py_ssize_t n) noexcept nogil
+    cdef inline Py_ssize_t _getpos(self, Py_ssize_t n) noexcept nogil
+    cdef inline Py_ssize_t _getkey(self, Py_ssize_t n) noexcept nogil
+    cdef Py_ssize_t _count_before(self, Py_ssize_t pos, 
+                                  bint sticky) noexcept nogil
+    cdef Py_ssize_t _getslot(self, Py_ssize_t markid) except -1
+
+    cpdef inserted(self, Py_ssize_t pos, Py_ssize_t size)
+    cpdef deleted(self, Py_ssize_t begin, Py_ssize_t end)
+    cpdef Py_ssize_t add(self, Py_ssize_t pos, bint sticky=*) except -1
+    cpdef remove(self, Py_ssize_t markid)
+    cpdef Py_ssize_t get(self, Py_ssize_t markid) except? -1
+
+# Text of a buffer to be scanned without GIL.
+cdef struct _TextRef:
+    char *buf
+    int kind
+    Py_ssize_t gap
+    Py_ssize_t gapsize
+
+# State of Aho-Corasick automaton.
+cdef struct _MultiState:
+    Py_ssize_t fail
+    Py_ssize_t output
+    Py_ssize_t outlink
+    Py_ssize_t depth
+
+cdef class MultiMatcher:
+    cdef readonly tuple words
+    cdef readonly bint wordboundary
+    cdef readonly bint ignorecase
+    cdef readonly Py_ssize_t maxlen
+    cdef readonly Py_ssize_t numstates
+    cdef Py_ssize_t *edges
+    cdef Py_UCS4 *labels
+    cdef Py_ssize_t *targets
+    cdef _MultiState *states
+    cdef Py_ssize_t roottable[256]
+
+    cdef inline Py_ssize_t _goto(self, Py_ssize_t state, 
+                                 Py_UCS4 c) noexcept nogil
+    cdef inline bint _at_boundary(self, _TextRef *text, Py_ssize_t pos,
+                                  Py_ssize_t end) noexcept nogil
+    cdef Py_ssize_t _scan(self, _TextRef *text, Py_ssize_t begin, 
+                          Py_ssize_t end, Py_ssize_t stop,
+                          Py_ssize_t *found) noexcept nogil
+    cdef _find(self, object string, Py_ssize_t begin, Py_ssize_t end,
+               Py_ssize_t stop)
+    cdef MultiMatch _match(self, object string, Py_ssize_t pos, 
+                           Py_ssize_t endpos, Py_ssize_t stop)
+
+cdef class MultiMatch:
+    cdef readonly object string
+    cdef readonly MultiMatcher re
+    cdef readonly Py_ssize_t pos
+    cdef readonly Py_ssize_t endpos
+    cdef readonly Py_ssize_t index
+    cdef Py_ssize_t begin
+    cdef Py_ssize_t finish
+
+cdef class _RopeNode:
+    cdef _RopeNode left, right
+    cdef unicode chunk
+    cdef Py_ssize_t size
+    cdef unsigned int priority
+
+cdef public class RopeBuffer [object RopeBufferObj, type RopeBufferType]:
+    cdef _RopeNode root
+    cdef readonly Py_ssize_t numelems
+
+    cdef _RopeNode _find(self, Py_ssize_t pos, Py_ssize_t *chunkpos)
+    cdef bint _insert_chunk(self, Py_ssize_t index, unicode s)
+    cdef int _get_slice(self, object obj,
+            Py_ssize_t *f, Py_ssize_t *t) except *
+
+    cpdef insert(self, Py_ssize_t index, unicode s)
+    cpdef append(self, unicode s)
+    cpdef delete(self, Py_ssize_t begin, Py_ssize_t end)
+    cpdef replace(self, Py_ssize_t begin, Py_ssize_t end, unicode s)
+    cpdef apply_edits(self, object edits)
+    cdef Py_ssize_t _search(self, unicode needle, Py_ssize_t begin,
+            Py_ssize_t end, bint ignorecase, bint reverse) except -2
+    cpdef get(self, Py_ssize_t begin, Py_ssize_t end)
+    cpdef getints(self, Py_ssize_t begin, Py_ssize_t end)
     cpdef insertints(self, Py_ssize_t index, object s)
     cpdef appendints(self, object s)
     cpdef replaceints(self, Py_ssize_t begin, Py_ssize_t end, object s)
     cpdef setints(self, Py_ssize_t begin, Py_ssize_t end, unsigned long v)
 
+cdef class PagedBuffer(RopeBuffer):
+    cdef readonly list pagepos
+    cdef object cache
+    cdef public Py_ssize_t cachesize
 
+    cdef _RopeNode _getnode(self, Py_ssize_t n)
 
+    cpdef addpage(self, Py_ssize_t size)
+    cpdef Py_ssize_t pageno(self, Py_ssize_t pos) except -1
+    cpdef getpage(self, Py_ssize_t n)
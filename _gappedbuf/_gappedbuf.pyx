@@ -3,9 +3,16 @@ from libc.string cimport memmove, memcpy
 from cpython cimport unicode, mem, ref
 from cpython.list cimport PyList_New, PyList_SET_ITEM
 from cpython.long cimport PyLong_FromUnsignedLong
+from cpython.buffer cimport (PyBUF_WRITABLE, PyBUF_FORMAT, PyBUF_ND,
+        PyObject_CheckBuffer, PyObject_GetBuffer, PyBuffer_Release)
+from libc.string cimport memset, memchr
 
+import sys, bisect, collections
 cimport rtdef
 
+# Size of windows MultiMatcher.rsearch() scans at a time.
+DEF MULTIMATCH_WINDOW = 4096
+
 cdef extern from "_gappedbufre.h":
     object PyInit__gappedbufre()
 
@@ -15,11 +22,324 @@ def init_gappedbufre():
     import sys
     sys.modules['_gappedbufre'] = PyInit__gappedbufre()
 
+
+cdef inline Py_UCS4 _readchar(char *buf, int kind,
+        Py_ssize_t index) noexcept nogil:
+    if kind == 1:
+        return (<rtdef.Py_UCS1*>buf)[index]
+    elif kind == 2:
+        return (<rtdef.Py_UCS2*>buf)[index]
+    else:
+        return (<Py_UCS4*>buf)[index]
+
+cdef inline void _writechar(char *buf, int kind, Py_ssize_t index,
+        Py_UCS4 c) noexcept nogil:
+    if kind == 1:
+        (<rtdef.Py_UCS1*>buf)[index] = <rtdef.Py_UCS1>c
+    elif kind == 2:
+        (<rtdef.Py_UCS2*>buf)[index] = <rtdef.Py_UCS2>c
+    else:
+        (<Py_UCS4*>buf)[index] = c
+
+cdef inline int _kindof(Py_UCS4 maxchar) noexcept nogil:
+    # narrowest storage width which can hold maxchar (same as PEP 393)
+    if maxchar < 0x100:
+        return 1
+    elif maxchar < 0x10000:
+        return 2
+    else:
+        return 4
+
+cdef inline unsigned long _readint(char *buf, Py_ssize_t itemsize,
+        Py_ssize_t index) noexcept nogil:
+    if itemsize == 1:
+        return (<unsigned char*>buf)[index]
+    elif itemsize == 2:
+        return (<unsigned short*>buf)[index]
+    elif itemsize == 4:
+        return (<unsigned int*>buf)[index]
+    else:
+        return <unsigned long>(<unsigned long long*>buf)[index]
+
+cdef inline void _writeint(char *buf, Py_ssize_t itemsize, Py_ssize_t index,
+        unsigned long v) noexcept nogil:
+    if itemsize == 1:
+        (<unsigned char*>buf)[index] = <unsigned char>v
+    elif itemsize == 2:
+        (<unsigned short*>buf)[index] = <unsigned short>v
+    elif itemsize == 4:
+        (<unsigned int*>buf)[index] = <unsigned int>v
+    else:
+        (<unsigned long long*>buf)[index] = v
+
+cdef int _get_intbuffer(object obj, Py_buffer *view, int flags) except -1:
+    # Get contiguous buffer of unsigned integers such as array('I').
+    cdef bytes fmt
+
+    PyObject_GetBuffer(obj, view, flags | PyBUF_FORMAT | PyBUF_ND)
+    fmt = view.format.lstrip(b'@=')
+    if (view.ndim != 1 or fmt not in (b'B', b'H', b'I', b'L', b'Q') or 
+            view.itemsize not in (1, 2, 4, 8)):
+        PyBuffer_Release(view)
+        raise TypeError('buffer of unsigned integers required')
+    return 0
+
+
+cdef int _init_charset(_CharSet *cs, object values, bint comp_ne) except -1:
+    # values is an iterable of ints. Values out of range of Py_UCS4
+    # never appear in buffer, so they are ignored.
+    cdef list nums = [v for v in values if 0 <= v <= 0xffffffff]
+    cdef Py_ssize_t i
+    cdef Py_UCS4 c
+
+    cs.size = len(nums)
+    cs.comp_ne = comp_ne
+    cs.chars = <Py_UCS4*>mem.PyMem_Malloc(max(1, cs.size) * sizeof(Py_UCS4))
+    if not cs.chars:
+        raise MemoryError()
+
+    memset(cs.table, comp_ne, 256)
+    for i from 0 <= i < cs.size:
+        c = nums[i]
+        cs.chars[i] = c
+        if c < 256:
+            cs.table[c] = not comp_ne
+    return 0
+
+cdef inline void _free_charset(_CharSet *cs):
+    mem.PyMem_Free(cs.chars)
+    cs.chars = NULL
+
+cdef inline bint _charset_match(_CharSet *cs, Py_UCS4 c) noexcept nogil:
+    cdef Py_ssize_t i
+
+    if c < 256:
+        return cs.table[c]
+    for i from 0 <= i < cs.size:
+        if cs.chars[i] == c:
+            return not cs.comp_ne
+    return cs.comp_ne
+
+cdef inline bint _charset_single(_CharSet *cs, int kind) noexcept nogil:
+    # True if scanning for a character which can be stored in kind.
+    return (cs.size == 1 and not cs.comp_ne and 
+            _kindof(cs.chars[0]) <= kind)
+
+cdef Py_ssize_t _memrchr(unsigned char *s, unsigned char c, 
+                         Py_ssize_t n) noexcept nogil:
+    # Find last c in s[:n], a word at a time.
+    cdef size_t ones = (<size_t>-1) // 0xff
+    cdef size_t highs = ones * 0x80
+    cdef size_t pattern = ones * c
+    cdef size_t w
+
+    while n and (<size_t>(s+n)) % sizeof(size_t):
+        n -= 1
+        if s[n] == c:
+            return n
+
+    while n >= <Py_ssize_t>sizeof(size_t):
+        w = (<size_t*>(s+n-sizeof(size_t)))[0] ^ pattern
+        if (w - ones) & ~w & highs:
+            # the word contains c
+            break
+        n -= sizeof(size_t)
+
+    while n:
+        n -= 1
+        if s[n] == c:
+            return n
+    return -1
+
+cdef Py_ssize_t _scan_forward(char *buf, int kind, Py_ssize_t begin,
+        Py_ssize_t end, _CharSet *cs) noexcept nogil:
+    # Returns index of first character in cs, or -1.
+    cdef Py_ssize_t p
+    cdef Py_UCS4 c
+    cdef void *found
+
+    if _charset_single(cs, kind):
+        c = cs.chars[0]
+        if kind == 1:
+            found = memchr(buf+begin, <int>c, end-begin)
+            if found:
+                return <char*>found - buf
+        elif kind == 2:
+            for p from begin <= p < end:
+                if (<rtdef.Py_UCS2*>buf)[p] == c:
+                    return p
+        else:
+            for p from begin <= p < end:
+                if (<Py_UCS4*>buf)[p] == c:
+                    return p
+        return -1
+
+    if kind == 1:
+        for p from begin <= p < end:
+            if cs.table[(<rtdef.Py_UCS1*>buf)[p]]:
+                return p
+    else:
+        for p from begin <= p < end:
+            if _charset_match(cs, _readchar(buf, kind, p)):
+                return p
+    return -1
+
+cdef Py_ssize_t _scan_backward(char *buf, int kind, Py_ssize_t begin,
+        Py_ssize_t end, _CharSet *cs) noexcept nogil:
+    # Returns index of last character in cs, or -1.
+    cdef Py_ssize_t p
+    cdef Py_UCS4 c
+
+    if _charset_single(cs, kind):
+        c = cs.chars[0]
+        if kind == 1:
+            p = _memrchr(<unsigned char*>buf+begin, <unsigned char>c, 
+                         end-begin)
+            if p != -1:
+                return begin + p
+        elif kind == 2:
+            for p from end > p >= begin:
+                if (<rtdef.Py_UCS2*>buf)[p] == c:
+                    return p
+        else:
+            for p from end > p >= begin:
+                if (<Py_UCS4*>buf)[p] == c:
+                    return p
+        return -1
+
+    if kind == 1:
+        for p from end > p >= begin:
+            if cs.table[(<rtdef.Py_UCS1*>buf)[p]]:
+                return p
+    else:
+        for p from end > p >= begin:
+            if _charset_match(cs, _readchar(buf, kind, p)):
+                return p
+    return -1
+
+cdef Py_ssize_t _scan_count(char *buf, int kind, Py_ssize_t begin,
+        Py_ssize_t end, _CharSet *cs) noexcept nogil:
+    # Returns number of characters in cs.
+    cdef Py_ssize_t p, n = 0
+    cdef Py_UCS4 c
+
+    if _charset_single(cs, kind):
+        c = cs.chars[0]
+        if kind == 1:
+            for p from begin <= p < end:
+                n += (<rtdef.Py_UCS1*>buf)[p] == c
+        elif kind == 2:
+            for p from begin <= p < end:
+                n += (<rtdef.Py_UCS2*>buf)[p] == c
+        else:
+            for p from begin <= p < end:
+                n += (<Py_UCS4*>buf)[p] == c
+    elif kind == 1:
+        for p from begin <= p < end:
+            n += cs.table[(<rtdef.Py_UCS1*>buf)[p]]
+    else:
+        for p from begin <= p < end:
+            n += _charset_match(cs, _readchar(buf, kind, p))
+    return n
+
+cdef inline Py_UCS4 _textchar(char *buf, int kind, Py_ssize_t gap,
+        Py_ssize_t gapsize, Py_ssize_t i, bint ignorecase) noexcept nogil:
+    # Read i'th character of text with a gap.
+    cdef Py_UCS4 c
+
+    if i >= gap:
+        i += gapsize
+    c = _readchar(buf, kind, i)
+    if ignorecase:
+        return rtdef.Py_UNICODE_TOLOWER(c)
+    return c
+
+cdef Py_ssize_t _search_forward(char *buf, int kind, Py_ssize_t gap,
+        Py_ssize_t gapsize, Py_UCS4 *pat, Py_ssize_t m, Py_ssize_t begin, 
+        Py_ssize_t end, bint ignorecase) noexcept nogil:
+    # Find first pat in text with Boyer-Moore-Horspool algorithm. Shift
+    # table is indexed by low 8 bits of characters.
+    cdef Py_ssize_t shift[256]
+    cdef Py_ssize_t i, j
+    cdef Py_UCS4 c
+
+    for i from 0 <= i < 256:
+        shift[i] = m
+    for j from 0 <= j < m-1:
+        shift[<unsigned int>pat[j] & 0xff] = m-1-j
+
+    i = begin
+    while i + m <= end:
+        c = _textchar(buf, kind, gap, gapsize, i+m-1, ignorecase)
+        if c == pat[m-1]:
+            j = m-2
+            while j >= 0 and _textchar(buf, kind, gap, gapsize, i+j, 
+                                       ignorecase) == pat[j]:
+                j -= 1
+            if j < 0:
+                return i
+        i += shift[<unsigned int>c & 0xff]
+    return -1
+
+cdef Py_ssize_t _search_backward(char *buf, int kind, Py_ssize_t gap,
+        Py_ssize_t gapsize, Py_UCS4 *pat, Py_ssize_t m, Py_ssize_t begin, 
+        Py_ssize_t end, bint ignorecase) noexcept nogil:
+    # Find last pat in text. Mirror of _search_forward.
+    cdef Py_ssize_t shift[256]
+    cdef Py_ssize_t i, j
+    cdef Py_UCS4 c
+
+    for i from 0 <= i < 256:
+        shift[i] = m
+    for j from m > j >= 1:
+        shift[<unsigned int>pat[j] & 0xff] = j
+
+    i = end - m
+    while i >= begin:
+        c = _textchar(buf, kind, gap, gapsize, i, ignorecase)
+        if c == pat[0]:
+            j = 1
+            while j < m and _textchar(buf, kind, gap, gapsize, i+j, 
+                                      ignorecase) == pat[j]:
+                j += 1
+            if j == m:
+                return i
+        i -= shift[<unsigned int>c & 0xff]
+    return -1
+
+cdef Py_UCS4 *_search_pattern(unicode needle, bint ignorecase) except NULL:
+    # Returns copy of needle to search. Should be freed with PyMem_Free.
+    cdef Py_UCS4 *pat = rtdef.PyUnicode_AsUCS4Copy(needle)
+    cdef Py_ssize_t i
+
+    if ignorecase:
+        for i from 0 <= i < len(needle):
+            pat[i] = rtdef.Py_UNICODE_TOLOWER(pat[i])
+    return pat
+
+cdef Py_ssize_t _search_str(unicode text, Py_UCS4 *pat, Py_ssize_t m,
+        bint ignorecase, bint reverse, Py_ssize_t begin=0,
+        Py_ssize_t end=-1):
+    # Find pat in text from begin to end (end of text if -1).
+    cdef char *data = <char*>rtdef.PyUnicode_DATA(text)
+    cdef int kind = rtdef.PyUnicode_KIND(text)
+
+    if end == -1:
+        end = len(text)
+    if reverse:
+        return _search_backward(data, kind, len(text), 0, pat, m, begin, end,
+                                ignorecase)
+    return _search_forward(data, kind, len(text), 0, pat, m, begin, end,
+                           ignorecase)
+
 cdef class GappedBuffer:
     def __cinit__(self):
         DEF BUFSIZE = 4096
 
-        self.buf = <Py_UCS4*>malloc(BUFSIZE * sizeof(Py_UCS4))
+        # Start with 1 byte per character. Buffer is widened when a
+        # character which doesn't fit is stored.
+        self.kind = 1
+        self.buf = <char*>malloc(BUFSIZE * self.kind)
         if not self.buf:
             raise MemoryError()
 
@@ -32,16 +352,74 @@ cdef class GappedBuffer:
         if self.buf:
             free(self.buf)
             self.buf = NULL
+
+    def __sizeof__(self):
+        return object.__sizeof__(self) + self.bufsize * self.kind
+
+    cdef int _check_exports(self) except -1:
+        if self.exports:
+            raise BufferError(
+                'Existing exports of data: object cannot be modified')
+        return 0
+
+    cdef inline void _acquire_read(self) noexcept:
+        # Lock the buffer for reading raw memory without GIL. Buffer is
+        # locked as if exported, so that modification raises BufferError.
+        self.exports += 1
+
+    cdef inline void _release_read(self) noexcept:
+        self.exports -= 1
+
+    def segments(self, Py_ssize_t begin=0, Py_ssize_t end=-1):
+        """Returns tuple of two read-only memoryviews of characters from
+        begin to end. First memoryview contains characters before the
+        gap and second contains characters after the gap. Size of an item
+        is same as kind of the buffer.
+
+        The buffer cannot be modified until the memoryviews are released.
+        """
+
+        if end == -1:
+            end = self.numelems
+
+        if not (0 <= begin <= end <= self.numelems):
+            raise ValueError('Invalid range')
+
+        before = _BufferSegment(self, begin, max(begin, min(end, self.gap)))
+        after = _BufferSegment(self, max(begin, self.gap)+self.gapsize,
+                               max(end, self.gap)+self.gapsize)
+        return memoryview(before), memoryview(after)
     
     cdef void _resize_buf(self, Py_ssize_t size):
-        cdef Py_UCS4 *buf = <Py_UCS4*>realloc(
-                self.buf, size * sizeof(Py_UCS4))
+        cdef char *buf = <char*>realloc(self.buf, size * self.kind)
 
         if not buf:
             raise MemoryError()
         self.buf = buf
         self.bufsize = size
 
+    cdef void _widen(self, Py_UCS4 maxchar):
+        cdef int newkind = _kindof(maxchar)
+        cdef int oldkind = self.kind
+        cdef Py_ssize_t p, tail
+
+        if newkind <= oldkind:
+            return
+
+        cdef char *buf = <char*>realloc(self.buf, self.bufsize * newkind)
+        if not buf:
+            raise MemoryError()
+        self.buf = buf
+        self.kind = newkind
+
+        # Convert in place. Start from end of buffer since wider
+        # characters never overwrite unconverted narrower characters.
+        tail = self.gap + self.gapsize
+        for p from self.bufsize > p >= tail:
+            _writechar(buf, newkind, p, _readchar(buf, oldkind, p))
+        for p from self.gap > p >= 0:
+            _writechar(buf, newkind, p, _readchar(buf, oldkind, p))
+
     cdef void _expand_gap(self, Py_ssize_t size):
         if size <= self.gapsize:
             return
@@ -49,8 +427,9 @@ cdef class GappedBuffer:
 
         if self.gap < self.numelems:
             # resize gap
-            memmove(self.buf+self.gap+size, self.buf+self.gap+self.gapsize,
-                    (self.numelems-self.gap) * sizeof(Py_UCS4))
+            memmove(self.buf+(self.gap+size)*self.kind,
+                    self.buf+(self.gap+self.gapsize)*self.kind,
+                    (self.numelems-self.gap) * self.kind)
     
         self.gapsize = size
 
@@ -58,9 +437,9 @@ cdef class GappedBuffer:
         DEF MAX_GAPSIZE = 4096
         if self.numelems + MAX_GAPSIZE > self.bufsize:
             return
-        memmove(self.buf+self.gap+MAX_GAPSIZE,
-                self.buf+self.gap+self.gapsize,
-                (self.numelems-self.gap) * sizeof(Py_UCS4))
+        memmove(self.buf+(self.gap+MAX_GAPSIZE)*self.kind,
+                self.buf+(self.gap+self.gapsize)*self.kind,
+                (self.numelems-self.gap) * self.kind)
 
         self.gapsize = MAX_GAPSIZE
         self._resize_buf(self.numelems+MAX_GAPSIZE)
@@ -71,27 +450,50 @@ cdef class GappedBuffer:
             return
         if self.gapsize:
             if index < self.gap:
-                memmove(self.buf+index+self.gapsize, self.buf+index,
-                        (self.gap - index)*sizeof(Py_UCS4))
+                memmove(self.buf+(index+self.gapsize)*self.kind,
+                        self.buf+index*self.kind,
+                        (self.gap - index)*self.kind)
             else:
-                memmove(self.buf+self.gap, self.buf+self.gap+self.gapsize,
-                        (index - self.gap)*sizeof(Py_UCS4))
+                memmove(self.buf+self.gap*self.kind,
+                        self.buf+(self.gap+self.gapsize)*self.kind,
+                        (index - self.gap)*self.kind)
         self.gap = index
     
     cdef _insert(self, Py_ssize_t index, unicode s):
         cdef Py_ssize_t size = len(s)
+
         if not (0 <= index <= self.numelems):
             raise ValueError('Invalid index value')
 
         if size:
+            self._check_exports()
+            if rtdef.PyUnicode_KIND(s) > self.kind:
+                self._widen(rtdef.PyUnicode_MAX_CHAR_VALUE(s))
+
             self._move_gap(index)
             if self.gapsize < size:
                 self._expand_gap(max(1024, size*2))
-            rtdef.PyUnicode_AsUCS4(s, self.buf+index, size, False)
-            
-            self.numelems += size
-            self.gap += size
-            self.gapsize -= size
+
+            self._put_string(s)
+
+    cdef void _put_string(self, unicode s):
+        # Copy s to the gap. Gap should be large enough and buffer should
+        # be wide enough to store s.
+        cdef Py_ssize_t size = len(s)
+        cdef int skind = rtdef.PyUnicode_KIND(s)
+        cdef void *sdata = rtdef.PyUnicode_DATA(s)
+        cdef Py_ssize_t i
+
+        if skind == self.kind:
+            memcpy(self.buf+self.gap*self.kind, sdata, size*self.kind)
+        else:
+            for i from 0 <= i < size:
+                _writechar(self.buf, self.kind, self.gap+i,
+                           _readchar(<char*>sdata, skind, i))
+        
+        self.numelems += size
+        self.gap += size
+        self.gapsize -= size
 
     cpdef insert(self, Py_ssize_t index, unicode s):
         self._insert(index, s)
@@ -107,6 +509,7 @@ cdef class GappedBuffer:
         if not size:
             return
 
+        self._check_exports()
         self._move_gap(begin)
         self.gapsize += size
         self.numelems -= size
@@ -119,6 +522,50 @@ cdef class GappedBuffer:
         self._delete(begin, end)
         self._insert(begin, s)
 
+    cpdef apply_edits(self, object edits):
+        """Apply sequence of (begin, end, text) in a pass. Edits should be
+        sorted by position and should not overlap each other. Positions
+        are offsets before edits are applied."""
+
+        cdef Py_ssize_t begin, end, last = 0, inslen = 0, delta = 0
+        cdef Py_UCS4 maxchar = 0
+        cdef unicode s
+
+        edits = list(edits)
+        for begin, end, s in edits:
+            if not (last <= begin <= end <= self.numelems):
+                raise ValueError('Invalid range')
+            last = end
+            inslen += len(s)
+            maxchar = max(maxchar, rtdef.PyUnicode_MAX_CHAR_VALUE(s))
+
+        if not edits:
+            return
+
+        self._check_exports()
+        self._widen(maxchar)
+        if self.gapsize < inslen:
+            self._expand_gap(max(1024, inslen*2))
+
+        # Gap moves forward only, so characters between edits are moved
+        # at most once.
+        for begin, end, s in edits:
+            self._move_gap(begin+delta)
+            self.gapsize += end-begin
+            self.numelems -= end-begin
+            self._put_string(s)
+            delta += len(s) - (end-begin)
+
+        self._shrink_gap()
+
+    cdef inline Py_UCS4 _getchar(self, Py_ssize_t index) noexcept nogil:
+        # Get character at index. index should not point to the gap.
+        return _readchar(self.buf, self.kind, index)
+
+    cdef inline void _setchar(self, Py_ssize_t index,
+            Py_UCS4 c) noexcept nogil:
+        _writechar(self.buf, self.kind, index, c)
+
     cdef Py_UCS4 _get_max(self, Py_ssize_t begin, Py_ssize_t end) nogil:
         cdef Py_UCS4 maxchar = 0
         cdef Py_ssize_t b, e
@@ -127,28 +574,49 @@ cdef class GappedBuffer:
 
         cdef Py_ssize_t p
         for p from begin <= p < e:
-            maxchar = max(maxchar, self.buf[p])
+            maxchar = max(maxchar, self._getchar(p))
         b = max(begin, self.gap) 
         for p from b <= p < end:
-            maxchar = max(maxchar, self.buf[p+self.gapsize])
+            maxchar = max(maxchar, self._getchar(p+self.gapsize))
         return maxchar
 
+    cdef void _copy_same_kind(self, void *dest, Py_ssize_t begin, 
+            Py_ssize_t end) nogil:
+        cdef Py_ssize_t n = end - begin
+        cdef Py_ssize_t former
+        cdef Py_ssize_t kind = self.kind
+
+        if self.gap < begin:
+            memcpy(dest, self.buf+(begin+self.gapsize)*kind, n*kind)
+        elif end <= self.gap:
+            memcpy(dest, self.buf+begin*kind, n*kind)
+        else:
+            former = self.gap - begin
+            memcpy(dest, self.buf+begin*kind, former*kind)
+            memcpy(<char*>dest+former*kind,
+                    self.buf+(self.gap+self.gapsize)*kind, 
+                    (n-former)*kind)
+
     cdef void _copy_chars1(self, void *dest, Py_ssize_t begin, 
             Py_ssize_t end) nogil:
         cdef rtdef.Py_UCS1 *buf = <rtdef.Py_UCS1 *>dest
         cdef Py_ssize_t b, e
 
+        if self.kind == 1:
+            self._copy_same_kind(dest, begin, end)
+            return
+
         # copy before gap
         e = min(end, self.gap)
         cdef Py_ssize_t p
         for p from begin <= p < e:
-            buf[0] = self.buf[p]
+            buf[0] = self._getchar(p)
             buf += 1
 
         # copy after gap
         b = max(begin, self.gap) + self.gapsize
         for p from b <= p < end+self.gapsize:
-            buf[0] = self.buf[p]
+            buf[0] = self._getchar(p)
             buf += 1
         
     cdef void _copy_chars2(self, void *dest, Py_ssize_t begin, 
@@ -156,52 +624,57 @@ cdef class GappedBuffer:
         cdef rtdef.Py_UCS2 *buf = <rtdef.Py_UCS2 *>dest
         cdef Py_ssize_t b, e
 
+        if self.kind == 2:
+            self._copy_same_kind(dest, begin, end)
+            return
+
         # copy before gap
         e = min(end, self.gap)
         cdef Py_ssize_t p
         for p from begin <= p < e:
-            buf[0] = self.buf[p]
+            buf[0] = self._getchar(p)
             buf += 1
 
         # copy after gap
         b = max(begin, self.gap) + self.gapsize
         for p from b <= p < end+self.gapsize:
-            buf[0] = self.buf[p]
+            buf[0] = self._getchar(p)
             buf += 1
 
     cdef void _copy_chars4(self, void *dest, Py_ssize_t begin, 
             Py_ssize_t end) nogil:
-        cdef Py_ssize_t n = end - begin
-        cdef Py_ssize_t former
-
-        if self.gap < begin:
-            memcpy(dest, self.buf+begin+self.gapsize, n*sizeof(Py_UCS4))
-        elif end <= self.gap:
-            memcpy(dest, self.buf+begin, n*sizeof(Py_UCS4))
-        else:
-            former = self.gap - begin
-            memcpy(dest, self.buf+begin, former*sizeof(Py_UCS4))
-            memcpy(dest+former*sizeof(Py_UCS4), self.buf+self.gap+self.gapsize, 
-                    (n-former)*sizeof(Py_UCS4))
+        # Characters in the string never be wider than the buffer,
+        # so buffer should be 4 bytes wide.
+        self._copy_same_kind(dest, begin, end)
 
     cpdef get(self, Py_ssize_t begin, Py_ssize_t end):
         if not (0 <= begin <= end <= self.numelems):
             raise IndexError('index out of range')
 
         cdef Py_ssize_t n = end - begin
-        cdef Py_UCS4 maxchar = self._get_max(begin, end)
-        cdef unicode ret = rtdef.PyUnicode_New(n, maxchar)
-        cdef void *buf = rtdef.PyUnicode_DATA(ret)
-        cdef nbytes = rtdef.PyUnicode_KIND(ret)
-
-        if nbytes == 1:
-            self._copy_chars1(buf, begin, end)
-        elif nbytes == 2:
-            self._copy_chars2(buf, begin, end)
-        elif nbytes == 4:
-            self._copy_chars4(buf, begin, end)
-        else:
-            raise RuntimeError()
+        cdef Py_UCS4 maxchar
+        cdef unicode ret
+        cdef void *buf
+        cdef int nbytes
+
+        self._acquire_read()
+        try:
+            with nogil:
+                maxchar = self._get_max(begin, end)
+
+            ret = rtdef.PyUnicode_New(n, maxchar)
+            buf = rtdef.PyUnicode_DATA(ret)
+            nbytes = rtdef.PyUnicode_KIND(ret)
+
+            with nogil:
+                if nbytes == 1:
+                    self._copy_chars1(buf, begin, end)
+                elif nbytes == 2:
+                    self._copy_chars2(buf, begin, end)
+                else:
+                    self._copy_chars4(buf, begin, end)
+        finally:
+            self._release_read()
 
         return ret
     
@@ -232,10 +705,12 @@ cdef class GappedBuffer:
         if self._get_slice(item, &start, &stop):
             return self.get(start, stop)
         else:
-            return self.buf[start+(0 if start < self.gap else self.gapsize)]
+            return self._getchar(
+                start+(0 if start < self.gap else self.gapsize))
 
     def __setitem__(self, object item, unicode value):
         cdef Py_ssize_t start, stop
+        cdef Py_UCS4 c
         
         if self._get_slice(item, &start, &stop):
             self.replace(start, stop, value)
@@ -243,8 +718,11 @@ cdef class GappedBuffer:
             if len(value) != 1:
                 raise ValueError('Invalid string length.')
             
+            c = <Py_UCS4>value
+            self._check_exports()
+            self._widen(c)
             start = start+(0 if start < self.gap else self.gapsize)
-            self.buf[start] = <Py_UCS4>value
+            self._setchar(start, c)
 
     def __delitem__(self, object item):
         cdef Py_ssize_t start, stop
@@ -254,61 +732,119 @@ cdef class GappedBuffer:
         else: 
             self.delete(start, start+1)
 
-    def findchr(self, unicode c, Py_ssize_t begin, Py_ssize_t end):
-        cdef Py_UCS4 *chars
-        cdef Py_ssize_t size, b, e, p
+    cdef Py_ssize_t _scan(self, Py_ssize_t begin, Py_ssize_t end,
+            _CharSet *cs, int mode) except -2:
+        # Scan characters from begin to end without GIL. mode is 0 to find
+        # first character in cs, 1 to find last character, and 2 to count.
+        # Buffer is locked as if exported while scanning.
+        cdef Py_ssize_t b, e, ret = -1
 
         if not (0 <= begin <= end <= self.numelems):
             raise ValueError('Invalid range')
-        
-        chars = rtdef.PyUnicode_AsUCS4Copy(c)
+
+        e = min(end, self.gap)
+        b = max(begin, self.gap)
+
+        self._acquire_read()
         try:
-            size = len(c)
-            # search before gap
-            e = min(end, self.gap)
-            for p from begin <= p < e:
-                for q from 0 <= q < size:
-                    if self.buf[p] == chars[q]:
-                        return p
-
-            # search after gap
-            b = max(begin, self.gap) + self.gapsize
-            for p from b <= p < end+self.gapsize:
-                for q from 0 <= q < size:
-                    if self.buf[p] == chars[q]:
-                        return p-self.gapsize
+            with nogil:
+                if mode == 0:
+                    if begin < e:
+                        ret = _scan_forward(self.buf, self.kind, begin, e, cs)
+                    if ret == -1 and b < end:
+                        ret = _scan_forward(self.buf, self.kind, 
+                                b+self.gapsize, end+self.gapsize, cs)
+                        if ret != -1:
+                            ret -= self.gapsize
+                elif mode == 1:
+                    if b < end:
+                        ret = _scan_backward(self.buf, self.kind,
+                                b+self.gapsize, end+self.gapsize, cs)
+                        if ret != -1:
+                            ret -= self.gapsize
+                    if ret == -1 and begin < e:
+                        ret = _scan_backward(self.buf, self.kind, 
+                                             begin, e, cs)
+                else:
+                    ret = 0
+                    if begin < e:
+                        ret += _scan_count(self.buf, self.kind, begin, e, cs)
+                    if b < end:
+                        ret += _scan_count(self.buf, self.kind,
+                                b+self.gapsize, end+self.gapsize, cs)
         finally:
-            mem.PyMem_Free(chars)
+            self._release_read()
 
-        return -1
+        return ret
+
+    def findchr(self, unicode c, Py_ssize_t begin, Py_ssize_t end):
+        """Returns position of first character in c, or -1"""
+
+        cdef _CharSet cs
+        _init_charset(&cs, map(ord, c), False)
+        try:
+            return self._scan(begin, end, &cs, 0)
+        finally:
+            _free_charset(&cs)
 
     def rfindchr(self, unicode c, Py_ssize_t begin, Py_ssize_t end):
-        cdef Py_UCS4 *chars
-        cdef Py_ssize_t size, b, e, p
+        """Returns position of last character in c, or -1"""
+
+        cdef _CharSet cs
+        _init_charset(&cs, map(ord, c), False)
+        try:
+            return self._scan(begin, end, &cs, 1)
+        finally:
+            _free_charset(&cs)
+
+    def find(self, unicode needle, Py_ssize_t begin, Py_ssize_t end,
+             bint ignorecase=False):
+        """Returns position of first needle from begin to end, or -1"""
+
+        return self._search(needle, begin, end, ignorecase, False)
+
+    def rfind(self, unicode needle, Py_ssize_t begin, Py_ssize_t end,
+              bint ignorecase=False):
+        """Returns position of last needle from begin to end, or -1"""
+
+        return self._search(needle, begin, end, ignorecase, True)
+
+    cdef Py_ssize_t _search(self, unicode needle, Py_ssize_t begin,
+            Py_ssize_t end, bint ignorecase, bint reverse) except -2:
+        cdef Py_ssize_t m = len(needle)
+        cdef Py_ssize_t ret
+        cdef Py_UCS4 *pat
 
         if not (0 <= begin <= end <= self.numelems):
             raise ValueError('Invalid range')
-        
-        chars = rtdef.PyUnicode_AsUCS4Copy(c)
+
+        if not m:
+            return end if reverse else begin
+
+        pat = _search_pattern(needle, ignorecase)
+        self._acquire_read()
         try:
-            size = len(c)
-            # search after gap
-            b = max(begin, self.gap) + self.gapsize
-            for p from (end+self.gapsize) > p >= b:
-                for q from 0 <= q < size:
-                    if self.buf[p] == chars[q]:
-                        return p-self.gapsize
-
-            # search before gap
-            e = min(end, self.gap)
-            for p from e > p >= begin:
-                for q from 0 <= q < size:
-                    if self.buf[p] == chars[q]:
-                        return p
+            with nogil:
+                if reverse:
+                    ret = _search_backward(self.buf, self.kind, self.gap,
+                            self.gapsize, pat, m, begin, end, ignorecase)
+                else:
+                    ret = _search_forward(self.buf, self.kind, self.gap,
+                            self.gapsize, pat, m, begin, end, ignorecase)
         finally:
-            mem.PyMem_Free(chars)
+            self._release_read()
+            mem.PyMem_Free(pat)
+        return ret
 
-        return -1
+    def count(self, unicode chars, Py_ssize_t begin, Py_ssize_t end):
+        """Returns number of characters in chars from begin to end"""
+
+        cdef _CharSet cs
+        _init_charset(&cs, map(ord, chars), False)
+        try:
+            return self._scan(begin, end, &cs, 2)
+        finally:
+            _free_charset(&cs)
     
     cpdef getints(self, Py_ssize_t begin, Py_ssize_t end):
 
@@ -324,7 +860,7 @@ cdef class GappedBuffer:
         # read before gap
         e = min(end, self.gap)
         for p from begin <= p < e:
-            v = <unsigned long>self.buf[p]
+            v = <unsigned long>self._getchar(p)
             PyList_SET_ITEM(ret, n, v)
             ref.Py_INCREF(v)
             n += 1
@@ -332,7 +868,7 @@ cdef class GappedBuffer:
         # read after gap
         b = max(begin, self.gap) + self.gapsize
         for p from b <= p < end+self.gapsize:
-            v = <unsigned long>self.buf[p]
+            v = <unsigned long>self._getchar(p)
             PyList_SET_ITEM(ret, n, v)
             ref.Py_INCREF(v)
             n += 1
@@ -340,23 +876,67 @@ cdef class GappedBuffer:
         return ret
 
     cdef _insertints(self, Py_ssize_t index, object s):
+        cdef Py_UCS4 c
+        cdef Py_buffer view
+        cdef Py_ssize_t size
 
-        cdef Py_ssize_t size = len(s)
         if not (0 <= index <= self.numelems):
             raise ValueError('Invalid index value')
 
+        if PyObject_CheckBuffer(s):
+            _get_intbuffer(s, &view, 0)
+            try:
+                self._insertints_from(index, &view)
+            finally:
+                PyBuffer_Release(&view)
+            return
+
+        size = len(s)
         if size:
+            self._check_exports()
             self._move_gap(index)
             if self.gapsize < size:
                 self._expand_gap(max(1024, size*2))
 
             for value in s:
-                self.buf[self.gap] = value
+                c = <unsigned long>value
+                if _kindof(c) > self.kind:
+                    self._widen(c)
+                self._setchar(self.gap, c)
                 self.gap += 1
 
             self.numelems += size
             self.gapsize -= size
 
+    cdef _insertints_from(self, Py_ssize_t index, Py_buffer *view):
+        cdef Py_ssize_t size = view.shape[0]
+        cdef Py_ssize_t i
+        cdef Py_UCS4 maxchar = 0
+
+        if not size:
+            return
+
+        self._check_exports()
+        for i from 0 <= i < size:
+            maxchar = max(maxchar, 
+                          <Py_UCS4>_readint(<char*>view.buf, view.itemsize, i))
+        self._widen(maxchar)
+
+        self._move_gap(index)
+        if self.gapsize < size:
+            self._expand_gap(max(1024, size*2))
+
+        if view.itemsize == self.kind:
+            memcpy(self.buf+index*self.kind, view.buf, size*self.kind)
+        else:
+            for i from 0 <= i < size:
+                self._setchar(index+i, 
+                        _readint(<char*>view.buf, view.itemsize, i))
+
+        self.numelems += size
+        self.gap += size
+        self.gapsize -= size
+
     cpdef insertints(self, Py_ssize_t index, object s):
         
         self._insertints(index, s)
@@ -368,119 +948,2167 @@ cdef class GappedBuffer:
         self._delete(begin, end)
         self._insertints(begin, s)
 
+    cdef void _fill(self, Py_ssize_t begin, Py_ssize_t end,
+            Py_UCS4 c) noexcept nogil:
+        # Fill buffer from begin to end with c. Range should not overlap
+        # the gap.
+        cdef Py_ssize_t p
+
+        if self.kind == 1:
+            memset(self.buf+begin, <int>c, end-begin)
+        elif self.kind == 2:
+            for p from begin <= p < end:
+                (<rtdef.Py_UCS2*>self.buf)[p] = <rtdef.Py_UCS2>c
+        else:
+            for p from begin <= p < end:
+                (<Py_UCS4*>self.buf)[p] = c
+
     cpdef setints(self, Py_ssize_t begin, Py_ssize_t end, unsigned long v):
-        cdef Py_ssize_t b, e, p
+        cdef Py_ssize_t b, e
 
         if not (0 <= begin <= end <= self.numelems):
             raise ValueError('Invalid range')
 
-        n = 0
+        if begin == end:
+            return
+
+        self._check_exports()
+        self._widen(<Py_UCS4>v)
+
         # replace before gap
         e = min(end, self.gap)
-        for p from begin <= p < e:
-            self.buf[p] = v
+        if begin < e:
+            self._fill(begin, e, v)
 
         # replace after gap
-        b = max(begin, self.gap) + self.gapsize
-        for p from b <= p < end+self.gapsize:
-            self.buf[p] = v
+        b = max(begin, self.gap)
+        if b < end:
+            self._fill(b+self.gapsize, end+self.gapsize, v)
 
-    def findint(self, object nums, Py_ssize_t begin, Py_ssize_t end,
-                int comp_ne):
-        cdef unsigned long *longs
-        cdef Py_ssize_t size, b, e, p
+    def setints_from(self, Py_ssize_t begin, object src):
+        """Overwrite values from begin with contents of src. src is an
+        object supports buffer protocol of unsigned integers, such as
+        array('I')."""
+
+        cdef Py_buffer view
+        cdef Py_ssize_t size, i, p
+        cdef Py_UCS4 maxchar = 0
+
+        _get_intbuffer(src, &view, 0)
+        try:
+            size = view.shape[0]
+            if not (0 <= begin <= begin+size <= self.numelems):
+                raise ValueError('Invalid range')
+
+            if not size:
+                return
+
+            self._check_exports()
+            for i from 0 <= i < size:
+                maxchar = max(maxchar, <Py_UCS4>_readint(
+                                    <char*>view.buf, view.itemsize, i))
+            self._widen(maxchar)
+
+            for i from 0 <= i < size:
+                p = begin + i
+                if p >= self.gap:
+                    p += self.gapsize
+                self._setchar(p, _readint(<char*>view.buf, view.itemsize, i))
+        finally:
+            PyBuffer_Release(&view)
+
+    def getints_into(self, Py_ssize_t begin, Py_ssize_t end, object dest):
+        """Store values from begin to end into dest. dest is a writable
+        object supports buffer protocol of unsigned integers, such as
+        array('I'). Returns number of values stored."""
+
+        cdef Py_buffer view
+        cdef Py_ssize_t i, p, b, e
 
         if not (0 <= begin <= end <= self.numelems):
             raise ValueError('Invalid range')
 
-        size = len(nums)
-        longs = <unsigned long *>mem.PyMem_Malloc(
-                                    size * sizeof(unsigned long))
-        if not longs:
-            raise MemoryError()
-
+        _get_intbuffer(dest, &view, PyBUF_WRITABLE)
         try:
-            for i from 0 <= i < size:
-                longs[i] = nums[i]
-
-            # search before gap
-            e = min(end, self.gap)
-            for p from begin <= p < e:
-                if not comp_ne:
-                    for q from 0 <= q < size:
-                        if self.buf[p] == longs[q]:
-                            return p
-                else:
-                    for q from 0 <= q < size:
-                        if self.buf[p] == longs[q]:
-                            break
-                    else:
-                        return p
-
-            # search after gap
-            b = max(begin, self.gap) + self.gapsize
-            for p from b <= p < end+self.gapsize:
-                if not comp_ne:
-                    for q from 0 <= q < size:
-                        if self.buf[p] == longs[q]:
-                            return p-self.gapsize
-                else:
-                    for q from 0 <= q < size:
-                        if self.buf[p] == longs[q]:
-                            break
-                    else:
-                        return p-self.gapsize
+            if view.shape[0] < end-begin:
+                raise ValueError('Buffer too small')
+
+            if view.itemsize == self.kind:
+                self._copy_same_kind(view.buf, begin, end)
+            else:
+                i = 0
+                e = min(end, self.gap)
+                for p from begin <= p < e:
+                    _writeint(<char*>view.buf, view.itemsize, i,
+                              self._getchar(p))
+                    i += 1
+                b = max(begin, self.gap) + self.gapsize
+                for p from b <= p < end+self.gapsize:
+                    _writeint(<char*>view.buf, view.itemsize, i,
+                              self._getchar(p))
+                    i += 1
         finally:
-            mem.PyMem_Free(longs)
+            PyBuffer_Release(&view)
 
-        return -1
+        return end-begin
+
+    def findint(self, object nums, Py_ssize_t begin, Py_ssize_t end,
+                int comp_ne):
+        """Returns position of first value in nums, or first value not in
+        nums if comp_ne is true. Returns -1 if not found."""
+
+        cdef _CharSet cs
+        _init_charset(&cs, nums, comp_ne)
+        try:
+            return self._scan(begin, end, &cs, 0)
+        finally:
+            _free_charset(&cs)
 
     def rfindint(self, object nums, Py_ssize_t begin, Py_ssize_t end,
                  int comp_ne):
+        """Returns position of last value in nums, or last value not in
+        nums if comp_ne is true. Returns -1 if not found."""
 
-        cdef unsigned long *longs
-        cdef Py_ssize_t size, b, e, p
+        cdef _CharSet cs
+        _init_charset(&cs, nums, comp_ne)
+        try:
+            return self._scan(begin, end, &cs, 1)
+        finally:
+            _free_charset(&cs)
 
-        if not (0 <= begin <= end <= self.numelems):
+
+cdef class _BufferSegment:
+    # Exports contiguous part of GappedBuffer with buffer protocol.
+
+    def __cinit__(self, GappedBuffer buf, Py_ssize_t begin, Py_ssize_t end):
+        self.buf = buf
+        self.begin = begin
+        self.shape[0] = end - begin
+        self.strides[0] = buf.kind
+
+    def __getbuffer__(self, Py_buffer *view, int flags):
+        if flags & PyBUF_WRITABLE:
+            raise BufferError('Object is not writable.')
+
+        view.buf = self.buf.buf + self.begin*self.buf.kind
+        view.obj = self
+        view.len = self.shape[0] * self.buf.kind
+        view.readonly = 1
+        view.itemsize = self.buf.kind
+        if self.buf.kind == 1:
+            view.format = b'B'
+        elif self.buf.kind == 2:
+            view.format = b'H'
+        else:
+            view.format = b'I'
+        view.ndim = 1
+        view.shape = self.shape
+        view.strides = self.strides
+        view.suboffsets = NULL
+        view.internal = NULL
+
+        self.buf.exports += 1
+
+    def __releasebuffer__(self, Py_buffer *view):
+        self.buf.exports -= 1
+
+
+cdef class LineIndex:
+    """Positions of newline characters in the text.
+
+    Positions are stored in an array with a gap at the position last
+    edited. Positions before the gap are offsets from the top of the text
+    and positions after the gap are offsets from the end of the text, so
+    an edit only touches newlines between the last edited position and
+    the current one.
+    """
+
+    def __cinit__(self):
+        DEF BUFSIZE = 256
+
+        self.lines = <Py_ssize_t*>malloc(BUFSIZE * sizeof(Py_ssize_t))
+        if not self.lines:
+            raise MemoryError()
+
+        self.bufsize = BUFSIZE
+        self.numlines = 0
+        self.gap = 0
+        self.gapsize = BUFSIZE
+        self.textlen = 0
+
+    def __dealloc__(self):
+        if self.lines:
+            free(self.lines)
+            self.lines = NULL
+
+    cdef void _expand_gap(self, Py_ssize_t size):
+        cdef Py_ssize_t newsize
+        cdef Py_ssize_t *lines
+
+        if size <= self.gapsize:
+            return
+
+        newsize = self.numlines + size
+        lines = <Py_ssize_t*>realloc(self.lines, newsize*sizeof(Py_ssize_t))
+        if not lines:
+            raise MemoryError()
+
+        memmove(lines+self.gap+size, lines+self.gap+self.gapsize,
+                (self.numlines-self.gap) * sizeof(Py_ssize_t))
+
+        self.lines = lines
+        self.bufsize = newsize
+        self.gapsize = size
+
+    cdef void _move_gap(self, Py_ssize_t pos) noexcept nogil:
+        # Move gap to place newlines before pos before the gap.
+        cdef Py_ssize_t after
+
+        while self.gap and self.lines[self.gap-1] >= pos:
+            self.gap -= 1
+            self.lines[self.gap+self.gapsize] = (self.lines[self.gap] 
+                                                 - self.textlen)
+
+        after = self.gap + self.gapsize
+        while (after < self.bufsize and 
+                    self.lines[after] + self.textlen < pos):
+            self.lines[self.gap] = self.lines[after] + self.textlen
+            self.gap += 1
+            after += 1
+
+    cdef inline Py_ssize_t _getline(self, Py_ssize_t n) noexcept nogil:
+        # Returns position of n'th newline.
+        if n < self.gap:
+            return self.lines[n]
+        return self.lines[n+self.gapsize] + self.textlen
+
+    cpdef inserted(self, Py_ssize_t pos, unicode s):
+        """Update index after s is inserted at pos"""
+
+        cdef Py_ssize_t size = len(s)
+        cdef Py_ssize_t i
+        cdef int kind
+        cdef char *data
+
+        if not (0 <= pos <= self.textlen):
+            raise ValueError('Invalid index value')
+
+        self._move_gap(pos)
+        kind = rtdef.PyUnicode_KIND(s)
+        data = <char*>rtdef.PyUnicode_DATA(s)
+        for i from 0 <= i < size:
+            if _readchar(data, kind, i) == u'\n':
+                if not self.gapsize:
+                    self._expand_gap(max(256, self.numlines))
+                self.lines[self.gap] = pos+i
+                self.gap += 1
+                self.gapsize -= 1
+                self.numlines += 1
+
+        self.textlen += size
+
+    cpdef deleted(self, Py_ssize_t begin, Py_ssize_t end):
+        """Update index after characters from begin to end are deleted"""
+
+        cdef Py_ssize_t after
+
+        if not (0 <= begin <= end <= self.textlen):
             raise ValueError('Invalid range')
 
-        size = len(nums)
-        longs = <unsigned long *>mem.PyMem_Malloc(
-                                    size * sizeof(unsigned long))
-        if not longs:
+        self._move_gap(begin)
+        after = self.gap + self.gapsize
+        while after < self.bufsize and self.lines[after]+self.textlen < end:
+            self.gapsize += 1
+            self.numlines -= 1
+            after += 1
+
+        self.textlen -= end - begin
+
+    def __len__(self):
+        return self.numlines
+
+    def linecount(self):
+        """Returns number of lines"""
+
+        return self.numlines + 1
+
+    cpdef Py_ssize_t pos_to_line(self, Py_ssize_t pos) except -1:
+        """Returns line number at pos. Line number starts from 0."""
+
+        cdef Py_ssize_t lo, hi, mid
+
+        if not (0 <= pos <= self.textlen):
+            raise ValueError('Invalid index value')
+
+        # Count newlines before pos
+        lo = 0
+        hi = self.numlines
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._getline(mid) < pos:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    cpdef Py_ssize_t line_to_pos(self, Py_ssize_t lineno) except -1:
+        """Returns position of top of line"""
+
+        if not (0 <= lineno <= self.numlines):
+            raise IndexError('line number out of range')
+
+        if lineno == 0:
+            return 0
+        return self._getline(lineno-1) + 1
+
+    cpdef Py_ssize_t gettol(self, Py_ssize_t pos) except -1:
+        """Returns top of line at pos"""
+
+        return self.line_to_pos(self.pos_to_line(pos))
+
+    cpdef Py_ssize_t geteol(self, Py_ssize_t pos) except -1:
+        """Returns end of line at pos. Position of end of line is next to
+        the newline character, or end of the text."""
+
+        cdef Py_ssize_t lineno = self.pos_to_line(pos)
+        if lineno == self.numlines:
+            return self.textlen
+        return self._getline(lineno) + 1
+
+
+cdef class StyleRuns:
+    """Run length encoded integers, used to store token id of each
+    character in the text.
+
+    Each run is a pair of the start position and the value, and the run
+    continues to the start of the next run. Runs are stored in arrays with
+    a gap as LineIndex does: starts before the gap are offsets from the
+    top of the text and starts after the gap are offsets from the end of
+    the text.
+    """
+
+    def __cinit__(self):
+        DEF BUFSIZE = 64
+
+        self.starts = <Py_ssize_t*>malloc(BUFSIZE * sizeof(Py_ssize_t))
+        self.values = <unsigned long*>malloc(
+                                BUFSIZE * sizeof(unsigned long))
+        if not self.starts or not self.values:
             raise MemoryError()
-        try:
-            for i from 0 <= i < size:
-                longs[i] = nums[i]
-
-            # search after gap
-            b = max(begin, self.gap) + self.gapsize
-            for p from (end+self.gapsize) > p >= b:
-                if not comp_ne:
-                    for q from 0 <= q < size:
-                        if self.buf[p] == longs[q]:
-                            return p-self.gapsize
-                else:
-                    for q from 0 <= q < size:
-                        if self.buf[p] == longs[q]:
-                            break
-                    else:
-                        return p-self.gapsize
-
-            # search before gap
-            e = min(end, self.gap)
-            for p from e > p >= begin:
-                if not comp_ne:
-                    for q from 0 <= q < size:
-                        if self.buf[p] == longs[q]:
-                            return p
-                else:
-                    for q from 0 <= q < size:
-                        if self.buf[p] == longs[q]:
-                            break
-                    else:
-                        return p
-        finally:
-            mem.PyMem_Free(longs)
 
-        return -1
+        self.bufsize = BUFSIZE
+        self.numruns = 0
+        self.gap = 0
+        self.gapsize = BUFSIZE
+        self.textlen = 0
+
+    def __dealloc__(self):
+        if self.starts:
+            free(self.starts)
+            self.starts = NULL
+        if self.values:
+            free(self.values)
+            self.values = NULL
+
+    def __sizeof__(self):
+        return (object.__sizeof__(self) + 
+                self.bufsize * (sizeof(Py_ssize_t) + sizeof(unsigned long)))
+
+    cdef void _expand_gap(self, Py_ssize_t size):
+        cdef Py_ssize_t newsize, after
+        cdef Py_ssize_t *starts
+        cdef unsigned long *values
+
+        if size <= self.gapsize:
+            return
+
+        newsize = self.numruns + size
+        after = self.numruns - self.gap
+        starts = <Py_ssize_t*>realloc(self.starts, 
+                                      newsize*sizeof(Py_ssize_t))
+        if not starts:
+            raise MemoryError()
+        self.starts = starts
+
+        values = <unsigned long*>realloc(self.values, 
+                                         newsize*sizeof(unsigned long))
+        if not values:
+            raise MemoryError()
+        self.values = values
+
+        memmove(starts+self.gap+size, starts+self.gap+self.gapsize,
+                after * sizeof(Py_ssize_t))
+        memmove(values+self.gap+size, values+self.gap+self.gapsize,
+                after * sizeof(unsigned long))
+
+        self.bufsize = newsize
+        self.gapsize = size
+
+    cdef void _move_gap(self, Py_ssize_t n) noexcept nogil:
+        # Move gap to place n runs before the gap.
+        while self.gap > n:
+            self.gap -= 1
+            self.starts[self.gap+self.gapsize] = (self.starts[self.gap] 
+                                                  - self.textlen)
+            self.values[self.gap+self.gapsize] = self.values[self.gap]
+
+        while self.gap < n:
+            self.starts[self.gap] = (self.starts[self.gap+self.gapsize] 
+                                     + self.textlen)
+            self.values[self.gap] = self.values[self.gap+self.gapsize]
+            self.gap += 1
+
+    cdef inline Py_ssize_t _getstart(self, Py_ssize_t n) noexcept nogil:
+        # Returns start position of n'th run.
+        if n < self.gap:
+            return self.starts[n]
+        return self.starts[n+self.gapsize] + self.textlen
+
+    cdef inline Py_ssize_t _getend(self, Py_ssize_t n) noexcept nogil:
+        # Returns end position of n'th run.
+        if n+1 < self.numruns:
+            return self._getstart(n+1)
+        return self.textlen
+
+    cdef inline unsigned long _getvalue(self, Py_ssize_t n) noexcept nogil:
+        if n < self.gap:
+            return self.values[n]
+        return self.values[n+self.gapsize]
+
+    cdef Py_ssize_t _count_before(self, Py_ssize_t pos) noexcept nogil:
+        # Returns number of runs started before pos.
+        cdef Py_ssize_t lo, hi, mid
+
+        lo = 0
+        hi = self.numruns
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._getstart(mid) < pos:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    cdef void _put(self, Py_ssize_t start, unsigned long value):
+        # Add a run at the gap unless preceding run has same value.
+        if self.gap and self.values[self.gap-1] == value:
+            return
+
+        if not self.gapsize:
+            self._expand_gap(max(64, self.numruns))
+
+        self.starts[self.gap] = start
+        self.values[self.gap] = value
+        self.gap += 1
+        self.gapsize -= 1
+        self.numruns += 1
+
+    cdef void _join_gap(self) noexcept nogil:
+        # Join runs around the gap if they have same value.
+        if (self.gap and self.gap < self.numruns and 
+                self.values[self.gap-1] == 
+                    self.values[self.gap+self.gapsize]):
+            self.gapsize += 1
+            self.numruns -= 1
+
+    cdef Py_ssize_t _remove_before(self, Py_ssize_t end, 
+                                   unsigned long *last) noexcept nogil:
+        # Remove runs after the gap started before end. Value of the last
+        # run removed is stored to last.
+        cdef Py_ssize_t after = self.gap + self.gapsize
+        cdef Py_ssize_t removed = 0
+
+        while (after < self.bufsize and 
+                    self.starts[after] + self.textlen < end):
+            last[0] = self.values[after]
+            self.gapsize += 1
+            self.numruns -= 1
+            after += 1
+            removed += 1
+        return removed
+
+    cdef inline bint _starts_at_gap(self, Py_ssize_t pos) noexcept nogil:
+        # True if a run after the gap starts at pos.
+        return self.gap < self.numruns and self._getstart(self.gap) == pos
+
+    cpdef inserted(self, Py_ssize_t pos, Py_ssize_t size):
+        """Update runs after size characters are inserted at pos.
+        Inserted characters have the value of the preceding character,
+        or 0 at the top of the text."""
+
+        if not (0 <= pos <= self.textlen):
+            raise ValueError('Invalid index value')
+
+        if size <= 0:
+            return
+
+        if pos == 0:
+            self._move_gap(0)
+            self._put(0, 0)
+            self.textlen += size
+            self._join_gap()
+        else:
+            self._move_gap(self._count_before(pos))
+            self.textlen += size
+
+    cpdef deleted(self, Py_ssize_t begin, Py_ssize_t end):
+        """Update runs after characters from begin to end are deleted"""
+
+        cdef unsigned long last = 0
+        cdef Py_ssize_t removed
+
+        if not (0 <= begin <= end <= self.textlen):
+            raise ValueError('Invalid range')
+
+        if begin == end:
+            return
+
+        self._move_gap(self._count_before(begin))
+        removed = self._remove_before(end, &last)
+        self.textlen -= end - begin
+
+        if (removed and begin < self.textlen and 
+                not self._starts_at_gap(begin)):
+            self._put(begin, last)
+        self._join_gap()
+
+    cpdef setints(self, Py_ssize_t begin, Py_ssize_t end, unsigned long v):
+        """Set value of characters from begin to end to v"""
+
+        cdef unsigned long last = 0
+
+        if not (0 <= begin <= end <= self.textlen):
+            raise ValueError('Invalid range')
+
+        if begin == end:
+            return
+
+        self._move_gap(self._count_before(begin))
+        if self.gap:
+            last = self.values[self.gap-1]
+        self._remove_before(end, &last)
+
+        self._put(begin, v)
+        if end < self.textlen and not self._starts_at_gap(end):
+            self._put(end, last)
+        self._join_gap()
+
+    def __len__(self):
+        return self.textlen
+
+    cpdef unsigned long getint(self, Py_ssize_t pos) except? 0:
+        """Returns value at pos"""
+
+        if not (0 <= pos < self.textlen):
+            raise IndexError('index out of range')
+
+        return self._getvalue(self._count_before(pos+1)-1)
+
+    cpdef getints(self, Py_ssize_t begin, Py_ssize_t end):
+        """Returns list of values from begin to end"""
+
+        cdef Py_ssize_t n, p, e, i
+        cdef list ret
+        cdef object v
+
+        if not (0 <= begin <= end <= self.textlen):
+            raise ValueError('Invalid range')
+
+        ret = PyList_New(end-begin)
+        if begin == end:
+            return ret
+
+        n = self._count_before(begin+1)-1
+        i = 0
+        p = begin
+        while p < end:
+            e = min(self._getend(n), end)
+            v = PyLong_FromUnsignedLong(self._getvalue(n))
+            while p < e:
+                PyList_SET_ITEM(ret, i, v)
+                ref.Py_INCREF(v)
+                i += 1
+                p += 1
+            n += 1
+
+        return ret
+
+    def getints_into(self, Py_ssize_t begin, Py_ssize_t end, object dest):
+        """Store values from begin to end into dest. dest is a writable
+        object supports buffer protocol of unsigned integers, such as
+        array('I'). Returns number of values stored."""
+
+        cdef Py_buffer view
+        cdef Py_ssize_t n, p, e
+        cdef unsigned long v
+
+        if not (0 <= begin <= end <= self.textlen):
+            raise ValueError('Invalid range')
+
+        _get_intbuffer(dest, &view, PyBUF_WRITABLE)
+        try:
+            if view.shape[0] < end-begin:
+                raise ValueError('Buffer too small')
+
+            if begin != end:
+                n = self._count_before(begin+1)-1
+                p = begin
+                while p < end:
+                    e = min(self._getend(n), end)
+                    v = self._getvalue(n)
+                    while p < e:
+                        _writeint(<char*>view.buf, view.itemsize, p-begin, v)
+                        p += 1
+                    n += 1
+        finally:
+            PyBuffer_Release(&view)
+
+        return end-begin
+
+    def iter_runs(self, Py_ssize_t begin, Py_ssize_t end):
+        """Yields tuple of (begin, end, value) of each runs from begin to
+        end"""
+
+        cdef Py_ssize_t n, p, e
+
+        if not (0 <= begin <= end <= self.textlen):
+            raise ValueError('Invalid range')
+
+        if begin == end:
+            return
+
+        n = self._count_before(begin+1)-1
+        p = begin
+        while p < end:
+            e = min(self._getend(n), end)
+            yield (p, e, self._getvalue(n))
+            p = e
+            n += 1
+
+    def findint(self, object nums, Py_ssize_t begin, Py_ssize_t end,
+                int comp_ne):
+        cdef Py_ssize_t n, p
+
+        if not (0 <= begin <= end <= self.textlen):
+            raise ValueError('Invalid range')
+
+        if begin == end:
+            return -1
+
+        nums = frozenset(nums)
+        n = self._count_before(begin+1)-1
+        p = begin
+        while p < end:
+            if (self._getvalue(n) in nums) != comp_ne:
+                return p
+            p = self._getend(n)
+            n += 1
+        return -1
+
+    def rfindint(self, object nums, Py_ssize_t begin, Py_ssize_t end,
+                 int comp_ne):
+        cdef Py_ssize_t n, p
+
+        if not (0 <= begin <= end <= self.textlen):
+            raise ValueError('Invalid range')
+
+        if begin == end:
+            return -1
+
+        nums = frozenset(nums)
+        n = self._count_before(end)-1
+        p = end
+        while p > begin:
+            if (self._getvalue(n) in nums) != comp_ne:
+                return p-1
+            p = self._getstart(n)
+            n -= 1
+        return -1
+
+
+cdef class MatchSpans:
+    """Sorted, non-overlapping spans of matches in the text.
+
+    Start and end positions of spans are stored in arrays with a gap as
+    LineIndex does: spans before the gap are offsets from the top of the
+    text and spans after the gap are offsets from the end of the text, so
+    spans need not be rewritten on each edit.
+    """
+
+    def __cinit__(self):
+        DEF BUFSIZE = 64
+
+        self.starts = <Py_ssize_t*>malloc(BUFSIZE * sizeof(Py_ssize_t))
+        self.ends = <Py_ssize_t*>malloc(BUFSIZE * sizeof(Py_ssize_t))
+        if not self.starts or not self.ends:
+            raise MemoryError()
+
+        self.bufsize = BUFSIZE
+        self.numspans = 0
+        self.gap = 0
+        self.gapsize = BUFSIZE
+        self.textlen = 0
+
+    def __dealloc__(self):
+        if self.starts:
+            free(self.starts)
+            self.starts = NULL
+        if self.ends:
+            free(self.ends)
+            self.ends = NULL
+
+    def __sizeof__(self):
+        return (object.__sizeof__(self) + 
+                self.bufsize * sizeof(Py_ssize_t) * 2)
+
+    cdef void _expand_gap(self, Py_ssize_t size):
+        cdef Py_ssize_t newsize, after
+        cdef Py_ssize_t *starts
+        cdef Py_ssize_t *ends
+
+        if size <= self.gapsize:
+            return
+
+        newsize = self.numspans + size
+        after = self.numspans - self.gap
+        starts = <Py_ssize_t*>realloc(self.starts, 
+                                      newsize*sizeof(Py_ssize_t))
+        if not starts:
+            raise MemoryError()
+        self.starts = starts
+
+        ends = <Py_ssize_t*>realloc(self.ends, newsize*sizeof(Py_ssize_t))
+        if not ends:
+            raise MemoryError()
+        self.ends = ends
+
+        memmove(starts+self.gap+size, starts+self.gap+self.gapsize,
+                after * sizeof(Py_ssize_t))
+        memmove(ends+self.gap+size, ends+self.gap+self.gapsize,
+                after * sizeof(Py_ssize_t))
+
+        self.bufsize = newsize
+        self.gapsize = size
+
+    cdef void _move_gap(self, Py_ssize_t n) noexcept nogil:
+        # Move gap to place n spans before the gap.
+        while self.gap > n:
+            self.gap -= 1
+            self.starts[self.gap+self.gapsize] = (self.starts[self.gap] 
+                                                  - self.textlen)
+            self.ends[self.gap+self.gapsize] = (self.ends[self.gap] 
+                                                - self.textlen)
+
+        while self.gap < n:
+            self.starts[self.gap] = (self.starts[self.gap+self.gapsize] 
+                                     + self.textlen)
+            self.ends[self.gap] = (self.ends[self.gap+self.gapsize] 
+                                   + self.textlen)
+            self.gap += 1
+
+    cdef inline Py_ssize_t _getstart(self, Py_ssize_t n) noexcept nogil:
+        # Returns start position of n'th span.
+        if n < self.gap:
+            return self.starts[n]
+        return self.starts[n+self.gapsize] + self.textlen
+
+    cdef inline Py_ssize_t _getend(self, Py_ssize_t n) noexcept nogil:
+        # Returns end position of n'th span.
+        if n < self.gap:
+            return self.ends[n]
+        return self.ends[n+self.gapsize] + self.textlen
+
+    cdef Py_ssize_t _count_before(self, Py_ssize_t pos) noexcept nogil:
+        # Returns number of spans started before pos.
+        cdef Py_ssize_t lo, hi, mid
+
+        lo = 0
+        hi = self.numspans
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._getstart(mid) < pos:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    cdef Py_ssize_t _remove_before(self, Py_ssize_t end, 
+                                   Py_ssize_t *first, 
+                                   Py_ssize_t *last) noexcept nogil:
+        # Remove spans after the gap started before end. Start of the 
+        # first span and end of the last span removed are stored to first
+        # and last.
+        cdef Py_ssize_t after = self.gap + self.gapsize
+        cdef Py_ssize_t removed = 0
+
+        while (after < self.bufsize and 
+                    self.starts[after] + self.textlen < end):
+            if not removed:
+                first[0] = self.starts[after] + self.textlen
+            last[0] = self.ends[after] + self.textlen
+            self.gapsize += 1
+            self.numspans -= 1
+            after += 1
+            removed += 1
+        return removed
+
+    cdef Py_ssize_t _count_overlapped(self, Py_ssize_t pos) noexcept nogil:
+        # Returns number of spans started before pos, excluding a span 
+        # which contains pos.
+        cdef Py_ssize_t n = self._count_before(pos)
+        if n and self._getend(n-1) > pos:
+            n -= 1
+        return n
+
+    cpdef inserted(self, Py_ssize_t pos, Py_ssize_t size):
+        """Update spans after size characters are inserted at pos. A span
+        which contains pos is removed."""
+
+        cdef Py_ssize_t first, last
+
+        if not (0 <= pos <= self.textlen):
+            raise ValueError('Invalid index value')
+
+        self._move_gap(self._count_overlapped(pos))
+        self._remove_before(pos, &first, &last)
+        self.textlen += size
+
+    cpdef deleted(self, Py_ssize_t begin, Py_ssize_t end):
+        """Update spans after characters from begin to end are deleted.
+        Spans overlap or adjacent to the range are removed. Returns tuple
+        of start of the first span and end of the last span removed, or
+        None if no span was removed."""
+
+        cdef Py_ssize_t n, first, last, removed
+
+        if not (0 <= begin <= end <= self.textlen):
+            raise ValueError('Invalid range')
+
+        n = self._count_before(begin)
+        if n and self._getend(n-1) >= begin:
+            n -= 1
+        self._move_gap(n)
+        removed = self._remove_before(end+1, &first, &last)
+        self.textlen -= end - begin
+
+        if removed:
+            return (first, last)
+
+    cpdef add(self, Py_ssize_t begin, Py_ssize_t end):
+        """Add a span from begin to end"""
+
+        cdef Py_ssize_t n
+
+        if not (0 <= begin <= end <= self.textlen):
+            raise ValueError('Invalid range')
+
+        n = self._count_before(begin)
+        if ((n and self._getend(n-1) > begin) or 
+                (n < self.numspans and self._getstart(n) < end)):
+            raise ValueError('Span overlaps existing span')
+
+        self._move_gap(n)
+        if not self.gapsize:
+            self._expand_gap(max(64, self.numspans))
+
+        self.starts[self.gap] = begin
+        self.ends[self.gap] = end
+        self.gap += 1
+        self.gapsize -= 1
+        self.numspans += 1
+
+    cpdef Py_ssize_t remove(self, Py_ssize_t begin, Py_ssize_t end) except -1:
+        """Remove spans overlap the range from begin to end. Returns 
+        number of spans removed."""
+
+        cdef Py_ssize_t first, last
+
+        if not (0 <= begin <= end <= self.textlen):
+            raise ValueError('Invalid range')
+
+        self._move_gap(self._count_overlapped(begin))
+        return self._remove_before(end, &first, &last)
+
+    def __len__(self):
+        return self.numspans
+
+    def index(self, Py_ssize_t pos):
+        """Returns number of spans started before pos"""
+
+        return self._count_before(pos)
+
+    def next(self, Py_ssize_t pos):
+        """Returns tuple of (begin, end) of the first span starts at or
+        after pos, or None if not found"""
+
+        cdef Py_ssize_t n = self._count_before(pos)
+        if n < self.numspans:
+            return (self._getstart(n), self._getend(n))
+
+    def prev(self, Py_ssize_t pos):
+        """Returns tuple of (begin, end) of the last span ends at or
+        before pos, or None if not found"""
+
+        cdef Py_ssize_t n = self._count_before(pos+1)
+        while n and self._getend(n-1) > pos:
+            n -= 1
+        if n:
+            return (self._getstart(n-1), self._getend(n-1))
+
+    def iter_spans(self, Py_ssize_t begin, Py_ssize_t end):
+        """Yields tuple of (begin, end) of each spans overlap the range
+        from begin to end"""
+
+        cdef Py_ssize_t n
+
+        if not (0 <= begin <= end <= self.textlen):
+            raise ValueError('Invalid range')
+
+        n = self._count_overlapped(begin)
+        while n < self.numspans and self._getstart(n) < end:
+            yield (self._getstart(n), self._getend(n))
+            n += 1
+
+cdef class MarkIndex:
+    """Positions of marks sorted by position.
+
+    Positions are stored in an array with a gap as MatchSpans does:
+    positions before the gap are offsets from the top of the text and
+    positions after the gap are offsets from delta, total size of
+    characters inserted and deleted so far. An edit moves the gap to the
+    edited position instead of rewriting each mark after it.
+
+    Each mark is identified by an id returned by add(). A mark at the
+    position of an insertion is moved only if the mark is sticky.
+    """
+
+    def __cinit__(self):
+        DEF BUFSIZE = 64
+
+        self.poss = <Py_ssize_t*>malloc(BUFSIZE * sizeof(Py_ssize_t))
+        self.keys = <Py_ssize_t*>malloc(BUFSIZE * sizeof(Py_ssize_t))
+        self.slots = <Py_ssize_t*>malloc(BUFSIZE * sizeof(Py_ssize_t))
+        if not self.poss or not self.keys or not self.slots:
+            raise MemoryError()
+
+        self.bufsize = BUFSIZE
+        self.numslots = BUFSIZE
+        self.freeids = list(range(BUFSIZE-1, -1, -1))
+        self.nummarks = 0
+        self.gap = 0
+        self.gapsize = BUFSIZE
+        self.delta = 0
+
+    def __dealloc__(self):
+        if self.poss:
+            free(self.poss)
+            self.poss = NULL
+        if self.keys:
+            free(self.keys)
+            self.keys = NULL
+        if self.slots:
+            free(self.slots)
+            self.slots = NULL
+
+    def __sizeof__(self):
+        return (object.__sizeof__(self) + 
+                self.bufsize * sizeof(Py_ssize_t) * 2 +
+                self.numslots * sizeof(Py_ssize_t))
+
+    cdef void _expand_gap(self, Py_ssize_t size):
+        cdef Py_ssize_t newsize, after, i
+        cdef Py_ssize_t *poss
+        cdef Py_ssize_t *keys
+
+        if size <= self.gapsize:
+            return
+
+        newsize = self.nummarks + size
+        after = self.nummarks - self.gap
+        poss = <Py_ssize_t*>realloc(self.poss, newsize*sizeof(Py_ssize_t))
+        if not poss:
+            raise MemoryError()
+        self.poss = poss
+
+        keys = <Py_ssize_t*>realloc(self.keys, newsize*sizeof(Py_ssize_t))
+        if not keys:
+            raise MemoryError()
+        self.keys = keys
+
+        memmove(poss+self.gap+size, poss+self.gap+self.gapsize,
+                after * sizeof(Py_ssize_t))
+        memmove(keys+self.gap+size, keys+self.gap+self.gapsize,
+                after * sizeof(Py_ssize_t))
+
+        self.bufsize = newsize
+        self.gapsize = size
+        for i in range(self.gap+size, newsize):
+            self.slots[keys[i] >> 1] = i
+
+    cdef void _expand_slots(self):
+        cdef Py_ssize_t newsize = self.numslots * 2
+        cdef Py_ssize_t *slots
+
+        slots = <Py_ssize_t*>realloc(self.slots, 
+                                     newsize*sizeof(Py_ssize_t))
+        if not slots:
+            raise MemoryError()
+        self.slots = slots
+
+        self.freeids.extend(range(newsize-1, self.numslots-1, -1))
+        self.numslots = newsize
+
+    cdef void _move_gap(self, Py_ssize_t n) noexcept nogil:
+        # Move gap to place n marks before the gap.
+        cdef Py_ssize_t after
+
+        while self.gap > n:
+            self.gap -= 1
+            after = self.gap + self.gapsize
+            self.poss[after] = self.poss[self.gap] - self.delta
+            self.keys[after] = self.keys[self.gap]
+            self.slots[self.keys[after] >> 1] = after
+
+        while self.gap < n:
+            after = self.gap + self.gapsize
+            self.poss[self.gap] = self.poss[after] + self.delta
+            self.keys[self.gap] = self.keys[after]
+            self.slots[self.keys[self.gap] >> 1] = self.gap
+            self.gap += 1
+
+    cdef inline Py_ssize_t _getpos(self, Py_ssize_t n) noexcept nogil:
+        # Returns position of n'th mark.
+        if n < self.gap:
+            return self.poss[n]
+        return self.poss[n+self.gapsize] + self.delta
+
+    cdef inline Py_ssize_t _getkey(self, Py_ssize_t n) noexcept nogil:
+        # Returns id*2+sticky of n'th mark.
+        if n < self.gap:
+            return self.keys[n]
+        return self.keys[n+self.gapsize]
+
+    cdef Py_ssize_t _count_before(self, Py_ssize_t pos, 
+                                  bint sticky) noexcept nogil:
+        # Returns number of marks placed before pos. Marks at pos are
+        # counted if sticky is True and they are not sticky.
+        cdef Py_ssize_t lo, hi, mid, p
+
+        lo = 0
+        hi = self.nummarks
+        while lo < hi:
+            mid = (lo + hi) // 2
+            p = self._getpos(mid)
+            if p < pos or (p == pos and sticky and 
+                           not (self._getkey(mid) & 1)):
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    cdef Py_ssize_t _getslot(self, Py_ssize_t markid) except -1:
+        if not (0 <= markid < self.numslots) or self.slots[markid] < 0:
+            raise KeyError(markid)
+        return self.slots[markid]
+
+    cpdef inserted(self, Py_ssize_t pos, Py_ssize_t size):
+        """Update marks after size characters are inserted at pos"""
+
+        self._move_gap(self._count_before(pos, True))
+        self.delta += size
+
+    cpdef deleted(self, Py_ssize_t begin, Py_ssize_t end):
+        """Update marks after characters from begin to end are deleted.
+        Marks in the range are moved to begin."""
+
+        cdef Py_ssize_t after, lo, hi, key
+
+        if begin > end:
+            raise ValueError('Invalid range')
+
+        self._move_gap(self._count_before(begin+1, False))
+        self.delta -= end - begin
+
+        # marks in the deleted range are placed before the gap.
+        lo = self.gap
+        while self.gap < self.nummarks and self._getpos(self.gap) <= begin:
+            after = self.gap + self.gapsize
+            self.poss[self.gap] = begin
+            self.keys[self.gap] = self.keys[after]
+            self.slots[self.keys[self.gap] >> 1] = self.gap
+            self.gap += 1
+
+        if lo == self.gap:
+            return
+
+        # sticky marks at begin should follow other marks at begin.
+        while lo and self.poss[lo-1] == begin:
+            lo -= 1
+        hi = self.gap - 1
+        while True:
+            while lo < hi and not (self.keys[lo] & 1):
+                lo += 1
+            while lo < hi and self.keys[hi] & 1:
+                hi -= 1
+            if lo >= hi:
+                break
+            key = self.keys[lo]
+            self.keys[lo] = self.keys[hi]
+            self.keys[hi] = key
+            self.slots[self.keys[lo] >> 1] = lo
+            self.slots[key >> 1] = hi
+
+    cpdef Py_ssize_t add(self, Py_ssize_t pos, bint sticky=False) except -1:
+        """Add a mark at pos. Returns id of the mark."""
+
+        cdef Py_ssize_t markid
+
+        if not self.freeids:
+            self._expand_slots()
+        markid = self.freeids.pop()
+
+        self._move_gap(self._count_before(pos, sticky))
+        if not self.gapsize:
+            self._expand_gap(max(64, self.nummarks))
+
+        self.poss[self.gap] = pos
+        self.keys[self.gap] = markid * 2 + sticky
+        self.slots[markid] = self.gap
+        self.gap += 1
+        self.gapsize -= 1
+        self.nummarks += 1
+        return markid
+
+    cpdef remove(self, Py_ssize_t markid):
+        """Remove a mark"""
+
+        cdef Py_ssize_t slot = self._getslot(markid)
+
+        if slot < self.gap:
+            self._move_gap(slot+1)
+        else:
+            self._move_gap(slot-self.gapsize+1)
+
+        self.gap -= 1
+        self.gapsize += 1
+        self.nummarks -= 1
+        self.slots[markid] = -1
+        self.freeids.append(markid)
+
+    cpdef Py_ssize_t get(self, Py_ssize_t markid) except? -1:
+        """Returns position of a mark"""
+
+        cdef Py_ssize_t slot = self._getslot(markid)
+
+        if slot < self.gap:
+            return self.poss[slot]
+        return self.poss[slot] + self.delta
+
+    def __len__(self):
+        return self.nummarks
+
+    def iter_marks(self, Py_ssize_t begin, Py_ssize_t end):
+        """Yields tuple of (pos, id) of each marks from begin to end,
+        inclusive, in order of position"""
+
+        cdef Py_ssize_t n = self._count_before(begin, False)
+        while n < self.nummarks and self._getpos(n) <= end:
+            yield (self._getpos(n), self._getkey(n) >> 1)
+            n += 1
+
+cdef inline bint _isword(Py_UCS4 c) noexcept nogil:
+    # Same as \w of the regex engine.
+    return rtdef.Py_UNICODE_ISALNUM(c) or c == u'_'
+
+cdef class MultiMatcher:
+    """Finds any of words in the text in a single pass with the
+    Aho-Corasick automaton. Time spent does not depend on the number of
+    words.
+
+    MultiMatcher has same search(), match(), rsearch() and finditer()
+    methods as compiled regular expressions of gappedbuf.re. At each
+    position, the longest word is matched. If wordboundary is True, words
+    should be surrounded by word boundaries as \\b of regular expression.
+    maxsteps argument is accepted for compatibility and ignored, since the
+    automaton never backtracks.
+    """
+
+    def __cinit__(self, words, bint wordboundary=False, 
+                  bint ignorecase=False):
+        cdef list trie = [{}], outputs = [-1], depths = [0]
+        cdef Py_ssize_t n, i, state, nstates, nedges
+        cdef long c
+
+        self.words = tuple(words)
+        self.wordboundary = wordboundary
+        self.ignorecase = ignorecase
+        self.maxlen = 0
+
+        # build trie of words
+        for n, word in enumerate(self.words):
+            if not word:
+                continue
+            self.maxlen = max(self.maxlen, len(word))
+            state = 0
+            for ch in word:
+                c = ord(ch)
+                if ignorecase:
+                    c = rtdef.Py_UNICODE_TOLOWER(c)
+                if c not in trie[state]:
+                    trie[state][c] = len(trie)
+                    trie.append({})
+                    outputs.append(-1)
+                    depths.append(depths[state]+1)
+                state = trie[state][c]
+            if outputs[state] == -1:
+                outputs[state] = n
+
+        # failure links and links to the next state with output on the
+        # chain of failure links
+        nstates = len(trie)
+        fails = [0] * nstates
+        outlinks = [-1] * nstates
+        queue = list(trie[0].values())
+        for state in queue:
+            for c, i in trie[state].items():
+                n = fails[state]
+                while n and c not in trie[n]:
+                    n = fails[n]
+                if state:
+                    fails[i] = trie[n].get(c, 0)
+                n = fails[i]
+                outlinks[i] = n if outputs[n] != -1 else outlinks[n]
+                queue.append(i)
+
+        nedges = nstates - 1
+        self.numstates = nstates
+        self.edges = <Py_ssize_t*>mem.PyMem_Malloc(
+                (nstates+1) * sizeof(Py_ssize_t))
+        self.labels = <Py_UCS4*>mem.PyMem_Malloc(
+                max(1, nedges) * sizeof(Py_UCS4))
+        self.targets = <Py_ssize_t*>mem.PyMem_Malloc(
+                max(1, nedges) * sizeof(Py_ssize_t))
+        self.states = <_MultiState*>mem.PyMem_Malloc(
+                nstates * sizeof(_MultiState))
+        if (not self.edges or not self.labels or not self.targets or 
+                not self.states):
+            raise MemoryError()
+
+        # edges of each state are sorted by character to be looked up 
+        # with binary search.
+        nedges = 0
+        for state in range(nstates):
+            self.edges[state] = nedges
+            for c, i in sorted(trie[state].items()):
+                self.labels[nedges] = c
+                self.targets[nedges] = i
+                nedges += 1
+            self.states[state].fail = fails[state]
+            self.states[state].output = outputs[state]
+            self.states[state].outlink = outlinks[state]
+            self.states[state].depth = depths[state]
+        self.edges[nstates] = nedges
+
+        for i in range(256):
+            self.roottable[i] = trie[0].get(i, 0)
+
+    def __dealloc__(self):
+        mem.PyMem_Free(self.edges)
+        mem.PyMem_Free(self.labels)
+        mem.PyMem_Free(self.targets)
+        mem.PyMem_Free(self.states)
+
+    def __sizeof__(self):
+        return (object.__sizeof__(self) + 
+                (self.numstates+1) * sizeof(Py_ssize_t) +
+                self.edges[self.numstates] * 
+                    (sizeof(Py_UCS4) + sizeof(Py_ssize_t)) +
+                self.numstates * sizeof(_MultiState))
+
+    cdef inline Py_ssize_t _goto(self, Py_ssize_t state, 
+                                 Py_UCS4 c) noexcept nogil:
+        # Returns next state of the automaton.
+        cdef Py_ssize_t lo, hi, mid
+
+        while state:
+            lo = self.edges[state]
+            hi = self.edges[state+1]
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if self.labels[mid] < c:
+                    lo = mid + 1
+                elif self.labels[mid] > c:
+                    hi = mid
+                else:
+                    return self.targets[mid]
+            state = self.states[state].fail
+
+        if c < 256:
+            return self.roottable[c]
+        lo = self.edges[0]
+        hi = self.edges[1]
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.labels[mid] < c:
+                lo = mid + 1
+            elif self.labels[mid] > c:
+                hi = mid
+            else:
+                return self.targets[mid]
+        return 0
+
+    cdef inline bint _at_boundary(self, _TextRef *text, Py_ssize_t pos,
+                                  Py_ssize_t end) noexcept nogil:
+        # True if pos is at a word boundary. Text after end is not visible
+        # as the regex engine does.
+        cdef bint before = False, after = False
+        if pos > 0:
+            before = _isword(_textchar(text.buf, text.kind, text.gap,
+                                       text.gapsize, pos-1, False))
+        if pos < end:
+            after = _isword(_textchar(text.buf, text.kind, text.gap,
+                                      text.gapsize, pos, False))
+        return before != after
+
+    cdef Py_ssize_t _scan(self, _TextRef *text, Py_ssize_t begin, 
+                          Py_ssize_t end, Py_ssize_t stop,
+                          Py_ssize_t *found) noexcept nogil:
+        # Find the leftmost longest word from begin to end which starts at
+        # or before stop. Returns start position of the word or -1. End
+        # position and index of the word are stored to found[0] and 
+        # found[1].
+        cdef Py_ssize_t i, f, state = 0, s, beststart = -1, bestend = -1
+        cdef Py_UCS4 c
+
+        i = begin
+        while i < end:
+            # words found later cannot start at or before beststart.
+            if i + 1 - self.maxlen > (beststart if beststart != -1 
+                                      else stop):
+                break
+
+            c = _textchar(text.buf, text.kind, text.gap, text.gapsize, 
+                          i, self.ignorecase)
+            state = self._goto(state, c)
+            i += 1
+
+            # words end at i, from the longest one.
+            s = state if self.states[state].output != -1 else \
+                    self.states[state].outlink
+            while s != -1:
+                f = i - self.states[s].depth
+                if f > stop or (beststart != -1 and f > beststart):
+                    break
+                if (not self.wordboundary or 
+                        (self._at_boundary(text, f, end) and
+                         self._at_boundary(text, i, end))):
+                    if beststart == -1 or f < beststart or i > bestend:
+                        beststart = f
+                        bestend = i
+                        found[1] = self.states[s].output
+                    break
+                s = self.states[s].outlink
+
+        found[0] = bestend
+        return beststart
+
+    cdef _find(self, object string, Py_ssize_t begin, Py_ssize_t end,
+               Py_ssize_t stop):
+        # Returns tuple of (start, end, index) of the word found, or None.
+        cdef _TextRef text
+        cdef GappedBuffer buf
+        cdef Py_ssize_t f, offset
+        cdef Py_ssize_t found[2]
+        cdef unicode s
+
+        if not self.maxlen:
+            return None
+
+        if isinstance(string, GappedBuffer):
+            buf = string
+            text.buf = buf.buf
+            text.kind = buf.kind
+            text.gap = buf.gap
+            text.gapsize = buf.gapsize
+            buf._acquire_read()
+            try:
+                with nogil:
+                    f = self._scan(&text, begin, end, stop, found)
+            finally:
+                buf._release_read()
+
+        else:
+            # other buffers such as RopeBuffer are scanned on a copy of
+            # the range. A character before the range is copied to test
+            # word boundary.
+            offset = max(0, begin-1)
+            if isinstance(string, unicode):
+                s = string[offset:end]
+            else:
+                s = string.get(offset, end)
+            text.buf = <char*>rtdef.PyUnicode_DATA(s)
+            text.kind = rtdef.PyUnicode_KIND(s)
+            text.gap = len(s)
+            text.gapsize = 0
+            f = self._scan(&text, begin-offset, end-offset, stop-offset,
+                           found)
+            if f != -1:
+                f += offset
+                found[0] += offset
+
+        if f != -1:
+            return (f, found[0], found[1])
+
+    cdef MultiMatch _match(self, object string, Py_ssize_t pos, 
+                           Py_ssize_t endpos, Py_ssize_t stop):
+        cdef Py_ssize_t size = len(string)
+        cdef MultiMatch m
+
+        pos = min(max(0, pos), size)
+        endpos = min(max(0, endpos), size)
+        if pos > endpos:
+            return None
+
+        hit = self._find(string, pos, endpos, min(stop, endpos))
+        if hit:
+            m = MultiMatch.__new__(MultiMatch)
+            m.string = string
+            m.re = self
+            m.pos = pos
+            m.endpos = endpos
+            m.begin, m.finish, m.index = hit
+            return m
+
+    def search(self, object string, Py_ssize_t pos=0, 
+               Py_ssize_t endpos=sys.maxsize, maxsteps=0):
+        """Returns MultiMatch of the first word found from pos to endpos,
+        or None"""
+
+        return self._match(string, pos, endpos, endpos)
+
+    def match(self, object string, Py_ssize_t pos=0, 
+              Py_ssize_t endpos=sys.maxsize, maxsteps=0):
+        """Returns MultiMatch of the word starts at pos, or None"""
+
+        return self._match(string, pos, endpos, max(0, pos))
+
+    def finditer(self, object string, Py_ssize_t pos=0, 
+                 Py_ssize_t endpos=sys.maxsize, maxsteps=0):
+        """Yields MultiMatch of each non-overlapping word from pos to
+        endpos"""
+
+        while True:
+            m = self._match(string, pos, endpos, endpos)
+            if not m:
+                return
+            yield m
+            pos = m.finish
+
+    def rsearch(self, object string, Py_ssize_t endpos=sys.maxsize, 
+                Py_ssize_t pos=0, maxsteps=0):
+        """Returns MultiMatch of the last word finditer() from pos finds
+        before endpos, or None. Text is scanned forward in windows from
+        the one just before endpos, as rsearch() of compiled regular
+        expressions does. Each window starts at syncpos(), so the result
+        doesn't depend on where the windows fall. Text after endpos is
+        still visible to test word boundary."""
+
+        cdef Py_ssize_t window, lo, hi, p, size = len(string)
+        cdef MultiMatch m, last
+
+        endpos = min(max(0, endpos), size)
+        pos = min(max(0, pos), size)
+        window = max(MULTIMATCH_WINDOW, self.maxlen*2)
+        hi = endpos
+        while True:
+            lo = self.syncpos(string, max(pos, hi-window), pos)
+            last = None
+            p = lo
+            while p <= hi:
+                m = self._match(string, p, size, hi)
+                if not m or m.finish > endpos:
+                    break
+                last = m
+                p = m.finish
+
+            if last or lo == pos:
+                return last
+            # no word runs across lo, so words before lo end at or 
+            # before it.
+            hi = lo
+
+    def syncpos(self, object string, Py_ssize_t index, Py_ssize_t pos=0):
+        """Returns the last position from pos to index which no word
+        runs across, or pos. finditer() started there finds the same
+        words after it as finditer() started at pos."""
+
+        cdef Py_ssize_t b, straddle, size = len(string)
+
+        pos = min(max(0, pos), size)
+        index = min(index, size)
+        while index > pos:
+            # words are not longer than maxlen, so only words start in 
+            # maxlen characters before index can run across it.
+            straddle = -1
+            b = max(pos, index-self.maxlen+1)
+            while b < index:
+                hit = self._find(string, b, min(size, index+self.maxlen+1),
+                                 index-1)
+                if not hit:
+                    break
+                if hit[1] > index:
+                    straddle = hit[0]
+                    break
+                b = hit[0] + 1
+
+            if straddle == -1:
+                return index
+            index = straddle
+        return pos
+
+
+cdef class MultiMatch:
+    """Match object returned by MultiMatcher. index is the index of the
+    word found in MultiMatcher.words."""
+
+    def start(self, group=0):
+        return self.begin
+
+    def end(self, group=0):
+        return self.finish
+
+    def span(self, group=0):
+        return (self.begin, self.finish)
+
+    def group(self, group=0):
+        return self.string[self.begin:self.finish]
+
+    def __repr__(self):
+        return '<MultiMatch object; span=({}, {}), match={!r}>'.format(
+            self.begin, self.finish, self.group())
+
+
+DEF ROPE_CHUNKSIZE = 4096
+
+cdef unsigned int _rope_seed = 2463534242u
+
+cdef unsigned int _rope_random() noexcept nogil:
+    # xorshift32. Used as priority of treap nodes.
+    global _rope_seed
+    _rope_seed ^= _rope_seed << 13
+    _rope_seed ^= _rope_seed >> 17
+    _rope_seed ^= _rope_seed << 5
+    return _rope_seed
+
+cdef class _RopeNode:
+    # Node of treap. Each node holds a chunk of text and total length of
+    # the text in the subtree.
+
+    def __cinit__(self, unicode chunk):
+        self.chunk = chunk
+        self.size = len(chunk)
+        self.priority = _rope_random()
+
+cdef inline Py_ssize_t _nodesize(_RopeNode node):
+    return node.size if node is not None else 0
+
+cdef inline void _update_node(_RopeNode node):
+    node.size = (_nodesize(node.left) + len(node.chunk) + 
+                 _nodesize(node.right))
+
+cdef _RopeNode _merge_nodes(_RopeNode a, _RopeNode b):
+    if a is None:
+        return b
+    if b is None:
+        return a
+
+    if a.priority > b.priority:
+        a.right = _merge_nodes(a.right, b)
+        _update_node(a)
+        return a
+    else:
+        b.left = _merge_nodes(a, b.left)
+        _update_node(b)
+        return b
+
+cdef tuple _split_nodes(_RopeNode node, Py_ssize_t pos):
+    # Split tree into a tree of first pos characters and the rest.
+    cdef _RopeNode a, b, rest
+    cdef Py_ssize_t chunkpos, chunklen
+
+    if node is None:
+        return (None, None)
+
+    chunkpos = _nodesize(node.left)
+    chunklen = len(node.chunk)
+    if pos <= chunkpos:
+        a, b = _split_nodes(node.left, pos)
+        node.left = b
+        _update_node(node)
+        return (a, node)
+    elif pos >= chunkpos + chunklen:
+        a, b = _split_nodes(node.right, pos-chunkpos-chunklen)
+        node.right = a
+        _update_node(node)
+        return (node, b)
+    else:
+        # split chunk of this node
+        pos -= chunkpos
+        rest = _RopeNode(node.chunk[pos:])
+        b = _merge_nodes(rest, node.right)
+        node.chunk = node.chunk[:pos]
+        node.right = None
+        _update_node(node)
+        return (node, b)
+
+cdef _RopeNode _build_nodes(unicode s):
+    cdef _RopeNode ret = None
+    cdef Py_ssize_t p
+
+    for p from 0 <= p < len(s) by ROPE_CHUNKSIZE:
+        ret = _merge_nodes(ret, _RopeNode(s[p:p+ROPE_CHUNKSIZE]))
+    return ret
+
+
+cdef class RopeBuffer:
+    """Text buffer stored in a balanced tree of text chunks.
+
+    RopeBuffer has same interface as GappedBuffer. Unlike GappedBuffer,
+    cost of an edit doesn't depend on distance from the previous edit.
+    """
+
+    def __cinit__(self):
+        self.root = None
+        self.numelems = 0
+
+    cdef _RopeNode _find(self, Py_ssize_t pos, Py_ssize_t *chunkpos):
+        # Returns node which contains pos.
+        cdef _RopeNode node = self.root
+        cdef Py_ssize_t base = 0, p
+
+        while node is not None:
+            p = base + _nodesize(node.left)
+            if pos < p:
+                node = node.left
+            elif pos < p + len(node.chunk):
+                chunkpos[0] = p
+                return node
+            else:
+                base = p + len(node.chunk)
+                node = node.right
+        return None
+
+    cdef bint _insert_chunk(self, Py_ssize_t index, unicode s):
+        # Insert s into an existing chunk if the chunk doesn't become
+        # too large.
+        cdef _RopeNode node = self.root
+        cdef Py_ssize_t base = 0, p
+        cdef list path = []
+
+        while node is not None:
+            path.append(node)
+            p = base + _nodesize(node.left)
+            if index <= p:
+                node = node.left
+            elif index <= p + len(node.chunk):
+                if len(node.chunk) + len(s) > ROPE_CHUNKSIZE:
+                    return False
+                p = index - p
+                node.chunk = node.chunk[:p] + s + node.chunk[p:]
+                for node in path:
+                    node.size += len(s)
+                return True
+            else:
+                base = p + len(node.chunk)
+                node = node.right
+        return False
+
+    cpdef insert(self, Py_ssize_t index, unicode s):
+        cdef _RopeNode a, b
+
+        if not (0 <= index <= self.numelems):
+            raise ValueError('Invalid index value')
+
+        if not s:
+            return
+
+        if not self._insert_chunk(index, s):
+            a, b = _split_nodes(self.root, index)
+            self.root = _merge_nodes(_merge_nodes(a, _build_nodes(s)), b)
+        self.numelems += len(s)
+
+    cpdef append(self, unicode s):
+        self.insert(self.numelems, s)
+
+    cpdef delete(self, Py_ssize_t begin, Py_ssize_t end):
+        cdef _RopeNode a, b, c
+
+        if not (0 <= begin <= end <= self.numelems):
+            raise ValueError('Invalid range')
+
+        if begin == end:
+            return
+
+        a, b = _split_nodes(self.root, begin)
+        b, c = _split_nodes(b, end-begin)
+        self.root = _merge_nodes(a, c)
+        self.numelems -= end-begin
+
+    cpdef replace(self, Py_ssize_t begin, Py_ssize_t end, unicode s):
+        RopeBuffer.delete(self, begin, end)
+        RopeBuffer.insert(self, begin, s)
+
+    cpdef apply_edits(self, object edits):
+        """Apply sequence of (begin, end, text). Edits should be sorted by
+        position and should not overlap each other. Positions are offsets
+        before edits are applied."""
+
+        cdef Py_ssize_t begin, end, last = 0
+
+        edits = list(edits)
+        for begin, end, s in edits:
+            if not (last <= begin <= end <= self.numelems):
+                raise ValueError('Invalid range')
+            last = end
+
+        # apply from the last edit not to shift positions of the rest
+        for begin, end, s in reversed(edits):
+            RopeBuffer.replace(self, begin, end, s)
+
+    def iterchunks(self, Py_ssize_t begin, Py_ssize_t end):
+        """Yields tuple of (pos, chunk) of chunks from begin to end"""
+
+        cdef _RopeNode node = self.root
+        cdef Py_ssize_t base = 0, p
+        cdef list stack = []
+
+        # find chunk at begin
+        while node is not None:
+            p = base + _nodesize(node.left)
+            if begin < p:
+                stack.append((node, p))
+                node = node.left
+            elif begin < p + len(node.chunk):
+                stack.append((node, p))
+                break
+            else:
+                base = p + len(node.chunk)
+                node = node.right
+
+        while stack:
+            node, p = stack.pop()
+            if p >= end:
+                return
+            yield p, node.chunk
+
+            # push left most path of right tree
+            base = p + len(node.chunk)
+            node = node.right
+            while node is not None:
+                stack.append((node, base + _nodesize(node.left)))
+                node = node.left
+
+    def riterchunks(self, Py_ssize_t begin, Py_ssize_t end):
+        """Yields tuple of (pos, chunk) of chunks from end to begin"""
+
+        cdef _RopeNode node = self.root
+        cdef Py_ssize_t base = 0, p
+        cdef list stack = []
+
+        # find chunk at end-1
+        while node is not None:
+            p = base + _nodesize(node.left)
+            if end <= p:
+                node = node.left
+            elif end <= p + len(node.chunk):
+                stack.append((node, p))
+                break
+            else:
+                stack.append((node, p))
+                base = p + len(node.chunk)
+                node = node.right
+
+        while stack:
+            node, p = stack.pop()
+            if p + len(node.chunk) <= begin:
+                return
+            yield p, node.chunk
+
+            # push right most path of left tree
+            node = node.left
+            base = p - _nodesize(node)
+            while node is not None:
+                stack.append((node, base + _nodesize(node.left)))
+                base += _nodesize(node.left) + len(node.chunk)
+                node = node.right
+
+    cpdef get(self, Py_ssize_t begin, Py_ssize_t end):
+        if not (0 <= begin <= end <= self.numelems):
+            raise IndexError('index out of range')
+
+        return ''.join([chunk[max(0, begin-p):end-p]
+                        for p, chunk in self.iterchunks(begin, end)])
+
+    def __len__(self):
+        return self.numelems
+
+    def __sizeof__(self):
+        return (object.__sizeof__(self) + sum(
+            sys.getsizeof(chunk) for p, chunk in
+                self.iterchunks(0, self.numelems)))
+
+    cdef int _get_slice(self, object obj, 
+            Py_ssize_t *f, Py_ssize_t *t) except *:
+        cdef Py_ssize_t step, slicelength
+
+        if rtdef.PySlice_Check(obj):
+            rtdef.PySlice_GetIndicesEx(obj, self.numelems, f, t, 
+                     &step, &slicelength)
+            if step != 1:
+                raise ValueError('step is not supported')
+            return 1
+        else: 
+            f[0] = obj
+            if f[0] < 0:
+                f[0] += self.numelems
+            if not (0 <= f[0] < self.numelems):
+                raise IndexError('index out of range')
+            return 0
+
+    def __getitem__(self, object item):
+        cdef Py_ssize_t start, stop, p
+        cdef _RopeNode node
+        
+        if self._get_slice(item, &start, &stop):
+            return self.get(start, stop)
+        else:
+            node = self._find(start, &p)
+            return node.chunk[start-p]
+
+    def __setitem__(self, object item, unicode value):
+        cdef Py_ssize_t start, stop
+        
+        if self._get_slice(item, &start, &stop):
+            self.replace(start, stop, value)
+        else:
+            if len(value) != 1:
+                raise ValueError('Invalid string length.')
+            self.replace(start, start+1, value)
+
+    def __delitem__(self, object item):
+        cdef Py_ssize_t start, stop
+        
+        if self._get_slice(item, &start, &stop):
+            self.delete(start, stop)
+        else: 
+            self.delete(start, start+1)
+
+    def findchr(self, unicode c, Py_ssize_t begin, Py_ssize_t end):
+        cdef Py_ssize_t p, b, e, found, f
+
+        if not (0 <= begin <= end <= self.numelems):
+            raise ValueError('Invalid range')
+
+        for p, chunk in self.iterchunks(begin, end):
+            b = max(0, begin-p)
+            e = min(len(chunk), end-p)
+            found = -1
+            for ch in c:
+                f = chunk.find(ch, b, e)
+                if f != -1:
+                    found = f
+                    e = f
+            if found != -1:
+                return p+found
+        return -1
+
+    def rfindchr(self, unicode c, Py_ssize_t begin, Py_ssize_t end):
+        cdef Py_ssize_t p, b, e, found, f
+
+        if not (0 <= begin <= end <= self.numelems):
+            raise ValueError('Invalid range')
+
+        for p, chunk in self.riterchunks(begin, end):
+            b = max(0, begin-p)
+            e = min(len(chunk), end-p)
+            found = -1
+            for ch in c:
+                f = chunk.rfind(ch, b, e)
+                if f != -1:
+                    found = f
+                    b = f+1
+            if found != -1:
+                return p+found
+        return -1
+
+    def count(self, unicode chars, Py_ssize_t begin, Py_ssize_t end):
+        """Returns number of characters in chars from begin to end"""
+
+        cdef Py_ssize_t p, n = 0
+
+        if not (0 <= begin <= end <= self.numelems):
+            raise ValueError('Invalid range')
+
+        for p, chunk in self.iterchunks(begin, end):
+            chunk = chunk[max(0, begin-p):end-p]
+            for ch in set(chars):
+                n += chunk.count(ch)
+        return n
+
+    def find(self, unicode needle, Py_ssize_t begin, Py_ssize_t end,
+             bint ignorecase=False):
+        """Returns position of first needle from begin to end, or -1"""
+
+        return self._search(needle, begin, end, ignorecase, False)
+
+    def rfind(self, unicode needle, Py_ssize_t begin, Py_ssize_t end,
+              bint ignorecase=False):
+        """Returns position of last needle from begin to end, or -1"""
+
+        return self._search(needle, begin, end, ignorecase, True)
+
+    cdef Py_ssize_t _search(self, unicode needle, Py_ssize_t begin,
+            Py_ssize_t end, bint ignorecase, bint reverse) except -2:
+        # Search chunks one by one. Matches across the boundary of chunks
+        # are searched in a copy of m-1 characters on either side of it.
+        cdef Py_ssize_t m = len(needle)
+        cdef Py_ssize_t p, b, e, ret = -1
+        cdef Py_UCS4 *pat
+        cdef unicode chunk, carry = u'', joint
+
+        if not (0 <= begin <= end <= self.numelems):
+            raise ValueError('Invalid range')
+
+        if not m:
+            return end if reverse else begin
+
+        pat = _search_pattern(needle, ignorecase)
+        try:
+            if reverse:
+                for p, chunk in self.riterchunks(begin, end):
+                    b = max(0, begin-p)
+                    e = min(len(chunk), end-p)
+                    if carry:
+                        joint = chunk[max(b, e-m+1):e] + carry
+                        ret = _search_str(joint, pat, m, ignorecase, True)
+                        if ret != -1:
+                            return p + max(b, e-m+1) + ret
+                    ret = _search_str(chunk, pat, m, ignorecase, True, b, e)
+                    if ret != -1:
+                        return p + ret
+                    if m > 1:
+                        carry = (chunk[b:min(e, b+m-1)] + carry)[:m-1]
+            else:
+                for p, chunk in self.iterchunks(begin, end):
+                    b = max(0, begin-p)
+                    e = min(len(chunk), end-p)
+                    if carry:
+                        joint = carry + chunk[b:min(e, b+m-1)]
+                        ret = _search_str(joint, pat, m, ignorecase, False)
+                        if ret != -1:
+                            return p + b - len(carry) + ret
+                    ret = _search_str(chunk, pat, m, ignorecase, False, b, e)
+                    if ret != -1:
+                        return p + ret
+                    if m > 1:
+                        carry = (carry + chunk[max(b, e-m+1):e])[-(m-1):]
+        finally:
+            mem.PyMem_Free(pat)
+        return -1
+
+    cpdef getints(self, Py_ssize_t begin, Py_ssize_t end):
+        if not (0 <= begin <= end <= self.numelems):
+            raise ValueError('Invalid range')
+
+        return [ord(c) for c in self.get(begin, end)]
+
+    cpdef insertints(self, Py_ssize_t index, object s):
+        RopeBuffer.insert(self, index, ''.join([chr(c) for c in s]))
+
+    cpdef appendints(self, object s):
+        self.insertints(self.numelems, s)
+
+    cpdef replaceints(self, Py_ssize_t begin, Py_ssize_t end, object s):
+        RopeBuffer.delete(self, begin, end)
+        RopeBuffer.insertints(self, begin, s)
+
+    cpdef setints(self, Py_ssize_t begin, Py_ssize_t end, unsigned long v):
+        if not (0 <= begin <= end <= self.numelems):
+            raise ValueError('Invalid range')
+
+        if begin != end:
+            RopeBuffer.replace(self, begin, end, chr(v)*(end-begin))
+
+    def findint(self, object nums, Py_ssize_t begin, Py_ssize_t end,
+                int comp_ne):
+        cdef Py_ssize_t p, i
+
+        if not (0 <= begin <= end <= self.numelems):
+            raise ValueError('Invalid range')
+
+        chars = set(chr(n) for n in nums)
+        for p, chunk in self.iterchunks(begin, end):
+            for i from max(0, begin-p) <= i < min(len(chunk), end-p):
+                if (chunk[i] in chars) != comp_ne:
+                    return p+i
+        return -1
+
+    def rfindint(self, object nums, Py_ssize_t begin, Py_ssize_t end,
+                 int comp_ne):
+        cdef Py_ssize_t p, i
+
+        if not (0 <= begin <= end <= self.numelems):
+            raise ValueError('Invalid range')
+
+        chars = set(chr(n) for n in nums)
+        for p, chunk in self.riterchunks(begin, end):
+            for i from min(len(chunk), end-p) > i >= max(0, begin-p):
+                if (chunk[i] in chars) != comp_ne:
+                    return p+i
+        return -1
+
+
+cdef class PagedBuffer(RopeBuffer):
+    """Read-only RopeBuffer which loads text page by page when read.
+
+    Subclasses implement loadpage() to return text of a page, and call
+    addpage() to append pages to the end of the text. Loaded pages are
+    kept in a LRU cache of cachesize pages, so memory used doesn't
+    depend on length of the text. The regex engine reads pages as chunks
+    of the rope.
+    """
+
+    def __cinit__(self):
+        self.pagepos = [0]
+        self.cache = collections.OrderedDict()
+        self.cachesize = 64
+
+    def loadpage(self, Py_ssize_t n):
+        """Returns text of n'th page"""
+
+        raise NotImplementedError()
+
+    cdef _RopeNode _getnode(self, Py_ssize_t n):
+        cdef _RopeNode node = self.cache.get(n)
+        cdef unicode chunk
+
+        if node is not None:
+            self.cache.move_to_end(n)
+            return node
+
+        chunk = self.loadpage(n)
+        if len(chunk) != self.pagepos[n+1] - self.pagepos[n]:
+            raise ValueError('Invalid length of page')
+
+        node = _RopeNode(chunk)
+        self.cache[n] = node
+        while len(self.cache) > max(1, self.cachesize):
+            self.cache.popitem(last=False)
+        return node
+
+    cdef _RopeNode _find(self, Py_ssize_t pos, Py_ssize_t *chunkpos):
+        cdef Py_ssize_t n
+
+        if not (0 <= pos < self.numelems):
+            return None
+
+        n = self.pageno(pos)
+        chunkpos[0] = self.pagepos[n]
+        return self._getnode(n)
+
+    cpdef addpage(self, Py_ssize_t size):
+        """Append a page of size characters to the end of the text"""
+
+        if size < 0:
+            raise ValueError('Invalid page size')
+
+        self.numelems += size
+        self.pagepos.append(self.numelems)
+
+    cpdef Py_ssize_t pageno(self, Py_ssize_t pos) except -1:
+        """Returns index of the page which contains pos"""
+
+        if not (0 <= pos < self.numelems):
+            raise IndexError('index out of range')
+
+        return bisect.bisect_right(self.pagepos, pos) - 1
+
+    cpdef getpage(self, Py_ssize_t n):
+        """Returns text of n'th page"""
+
+        if not (0 <= n < len(self.pagepos) - 1):
+            raise IndexError('page index out of range')
+
+        return self._getnode(n).chunk
+
+    def iterchunks(self, Py_ssize_t begin, Py_ssize_t end):
+        """Yields tuple of (pos, chunk) of pages from begin to end"""
+
+        cdef Py_ssize_t n, numpages = len(self.pagepos) - 1
+
+        if not (0 <= begin < self.numelems):
+            return
+
+        n = self.pageno(begin)
+        while n < numpages and self.pagepos[n] < end:
+            if self.pagepos[n] != self.pagepos[n+1]:
+                yield self.pagepos[n], self._getnode(n).chunk
+            n += 1
+
+    def riterchunks(self, Py_ssize_t begin, Py_ssize_t end):
+        """Yields tuple of (pos, chunk) of pages from end to begin"""
+
+        cdef Py_ssize_t n
+
+        if not (0 < end <= self.numelems):
+            return
+
+        n = self.pageno(end-1)
+        while n >= 0 and self.pagepos[n+1] > begin:
+            if self.pagepos[n] != self.pagepos[n+1]:
+                yield self.pagepos[n], self._getnode(n).chunk
+            n -= 1
+
+    def __sizeof__(self):
+        cdef _RopeNode node
+        cdef Py_ssize_t size = object.__sizeof__(self)
+
+        for node in self.cache.values():
+            size += sys.getsizeof(node.chunk)
+        return size
+
+    cpdef insert(self, Py_ssize_t index, unicode s):
+        raise BufferError('Buffer is read-only')
+
+    cpdef delete(self, Py_ssize_t begin, Py_ssize_t end):
+        raise BufferError('Buffer is read-only')
+
+    cpdef replace(self, Py_ssize_t begin, Py_ssize_t end, unicode s):
+        raise BufferError('Buffer is read-only')
+
+    cpdef apply_edits(self, object edits):
+        raise BufferError('Buffer is read-only')
+
+    cpdef insertints(self, Py_ssize_t index, object s):
+        raise BufferError('Buffer is read-only')
+
+    cpdef replaceints(self, Py_ssize_t begin, Py_ssize_t end, object s):
+        raise BufferError('Buffer is read-only')
+
+    cpdef setints(self, Py_ssize_t begin, Py_ssize_t end, unsigned long v):
+        raise BufferError('Buffer is read-only')
+
+
+cdef public int rope_getchunk(object rope, Py_ssize_t index, void **data,
+        int *kind, Py_ssize_t *begin, Py_ssize_t *end) except -1:
+    # Called by _gappedbufre to get chunk of text at index.
+    cdef Py_ssize_t p
+    cdef _RopeNode node = (<RopeBuffer>rope)._find(index, &p)
+    if node is None:
+        raise IndexError('index out of range')
+
+    data[0] = rtdef.PyUnicode_DATA(node.chunk)
+    kind[0] = rtdef.PyUnicode_KIND(node.chunk)
+    begin[0] = p
+    end[0] = p + len(node.chunk)
+    return 0
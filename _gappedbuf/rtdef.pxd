@@ -9,6 +9,9 @@ cdef extern from "Python.h":
     object PyUnicode_New(Py_ssize_t size, Py_UCS4 maxchar)
     void* PyUnicode_DATA(object o) except NULL
     int PyUnicode_KIND(object o) except 0
+    Py_UCS4 PyUnicode_MAX_CHAR_VALUE(object o)
+    Py_UCS4 Py_UNICODE_TOLOWER(Py_UCS4 ch) nogil
+    bint Py_UNICODE_ISALNUM(Py_UCS4 ch) nogil
 
     int PySlice_GetIndicesEx(object slice, Py_ssize_t length,
             Py_ssize_t *start, Py_ssize_t *stop, Py_ssize_t *step, 
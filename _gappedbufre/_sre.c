@@ -97,6 +97,11 @@ static char copyright[] =
 #define SRE_ERROR_RECURSION_LIMIT -3 /* runaway recursion */
 #define SRE_ERROR_MEMORY -9 /* out of memory */
 #define SRE_ERROR_INTERRUPTED -10 /* signal handler raised exception */
+#define SRE_ERROR_STEPLIMIT -11 /* too many steps to match */
+#define SRE_ERROR_READ -12 /* reading the rope raised exception */
+
+/* raised when a match takes more steps than maxsteps */
+static PyObject* StepLimitError;
 
 #if defined(VERBOSE)
 #define TRACE(v) printf v
@@ -231,7 +236,7 @@ static void
 data_stack_dealloc(SRE_STATE* state)
 {
     if (state->data_stack) {
-        PyMem_FREE(state->data_stack);
+        PyMem_RawFree(state->data_stack);
         state->data_stack = NULL;
     }
     state->data_stack_size = state->data_stack_base = 0;
@@ -247,7 +252,7 @@ data_stack_grow(SRE_STATE* state, Py_ssize_t size)
         void* stack;
         cursize = minsize+minsize/4+1024;
         TRACE(("allocate/grow stack %d\n", cursize));
-        stack = PyMem_REALLOC(state->data_stack, cursize);
+        stack = PyMem_RawRealloc(state->data_stack, cursize);
         if (!stack) {
             data_stack_dealloc(state);
             return SRE_ERROR_MEMORY;
@@ -291,10 +296,130 @@ data_stack_grow(SRE_STATE* state, Py_ssize_t size)
    ((state->charsize==1) ? ((Py_UCS1*)buf)[index] : \
     (state->charsize==2) ? ((Py_UCS2*)buf)[index] : \
     ((Py_UCS4*)buf)[index])
+/* read a character at raw (gap adjusted) index of the gapped buffer */
+#define SRE_GAPPEDBUF_READ(string, i) \
+    ((string->kind==1) ? (Py_UCS4)((Py_UCS1*)string->buf)[i] : \
+     (string->kind==2) ? (Py_UCS4)((Py_UCS2*)string->buf)[i] : \
+     ((Py_UCS4*)string->buf)[i])
+#define SRE_GAPPEDBUF_CHARGET(gappedbuf, i) \
+     SRE_GAPPEDBUF_READ(gappedbuf, \
+      (i) + ((i) < gappedbuf->gap ? 0 : gappedbuf->gapsize))
+#define SRE_DIRECT_CHARGET(state, i) \
+    ((state->directkind==1) ? (Py_UCS4)((Py_UCS1*)state->direct)[i] : \
+     (state->directkind==2) ? (Py_UCS4)((Py_UCS2*)state->direct)[i] : \
+     ((Py_UCS4*)state->direct)[i])
 #define SRE_CHARGET(state, p, index) \
-     ((Py_UCS4)state->string->buf[ \
-      (Py_ssize_t)p+index + \
-      (((Py_ssize_t)p+index) < state->string->gap ? 0 : state->string->gapsize)])
+     (state->direct ? \
+      SRE_DIRECT_CHARGET(state, (Py_ssize_t)p+index) : \
+      state->gappedbuf ? \
+      SRE_GAPPEDBUF_CHARGET(state->gappedbuf, (Py_ssize_t)p+index) : \
+      sre_rope_charget(state, (Py_ssize_t)p+index))
+
+/* number of characters scanned at a time by rsearch() */
+#define SRE_RSEARCH_WINDOW (64*1024)
+
+/* characters below this are tested once by syncpos() and rsearch() */
+#define SRE_SYNC_CACHE 128
+
+LOCAL(Py_UCS4)
+sre_rope_charget(SRE_STATE* state, Py_ssize_t i);
+
+LOCAL(Py_ssize_t)
+sre_find_char(char* data, int kind, Py_ssize_t i, Py_ssize_t n,
+              SRE_CODE chr)
+{
+    /* returns index of first chr in data from i to n, or n */
+    void* found;
+
+    if (i >= n)
+        return n;
+    if (kind == 1) {
+        if (chr > 0xff)
+            return n;
+        found = memchr(data + i, (int)chr, n - i);
+        return found ? (char*)found - data : n;
+    }
+    else if (kind == 2) {
+        Py_UCS2* s = (Py_UCS2*)data;
+        while (i < n && s[i] != chr)
+            i++;
+        return i;
+    }
+    else {
+        Py_UCS4* s = (Py_UCS4*)data;
+        while (i < n && s[i] != chr)
+            i++;
+        return i;
+    }
+}
+
+LOCAL(char*)
+sre_find_literal(SRE_STATE* state, char* ptr, char* end, SRE_CODE chr)
+{
+    /* returns position of first chr from ptr to end, or end */
+    Py_ssize_t i = (Py_ssize_t)ptr;
+    Py_ssize_t n = (Py_ssize_t)end;
+    Py_ssize_t gap, found;
+    struct GappedBufferObj* gappedbuf = state->gappedbuf;
+
+    if (state->direct)
+        return (char*)sre_find_char(state->direct, state->directkind,
+                                    i, n, chr);
+
+    if (gappedbuf) {
+        /* scan characters before the gap, then characters after it */
+        gap = gappedbuf->gap;
+        if (i < gap) {
+            found = sre_find_char(gappedbuf->buf, gappedbuf->kind, i,
+                                  n < gap ? n : gap, chr);
+            if (found < gap)
+                return (char*)found;
+            i = gap;
+        }
+        return (char*)sre_find_char(
+            gappedbuf->buf + gappedbuf->gapsize * gappedbuf->kind,
+            gappedbuf->kind, i, n, chr);
+    }
+
+    while (i < n && (SRE_CODE) SRE_CHARGET(state, 0, i) != chr)
+        i++;
+    return (char*)i;
+}
+
+LOCAL(Py_UCS4)
+sre_rope_charget(SRE_STATE* state, Py_ssize_t i)
+{
+    /* read a character from the rope. The chunk read last is cached.
+       If reading fails, the exception is kept and readerror is set, so
+       that sre_run() returns SRE_ERROR_READ */
+    if (i < state->chunkbegin || i >= state->chunkend) {
+        if (state->readerror)
+            return 0;
+        if (rope_getchunk(state->string, i, &state->chunk, &state->chunkkind,
+                          &state->chunkbegin, &state->chunkend) == -1) {
+            state->readerror = 1;
+            state->chunkbegin = state->chunkend = 0;
+            return 0;
+        }
+    }
+    i -= state->chunkbegin;
+    return (state->chunkkind==1) ? ((Py_UCS1*)state->chunk)[i] :
+           (state->chunkkind==2) ? ((Py_UCS2*)state->chunk)[i] :
+           ((Py_UCS4*)state->chunk)[i];
+}
+
+LOCAL(int)
+sre_check_signals(SRE_STATE* state)
+{
+    /* check signals. GIL is taken back if released while matching */
+    int ret;
+    if (!state->threadstate)
+        return PyErr_CheckSignals();
+    PyEval_RestoreThread(state->threadstate);
+    ret = PyErr_CheckSignals();
+    state->threadstate = PyEval_SaveThread();
+    return ret;
+}
 
 #define SRE_AT sre_uat
 #define SRE_COUNT sre_ucount
@@ -646,6 +771,11 @@ SRE_INFO(SRE_STATE* state, SRE_CODE* pattern)
         state->lastindex = ctx->lastindex; \
     } while (0)
 
+/* forget the groups of a failed attempt before matching at the next
+   position */
+#define RESET_CAPTURE_GROUP() \
+    do { state->lastmark = state->lastindex = -1; } while (0)
+
 #define RETURN_ERROR(i) do { return i; } while(0)
 #define RETURN_FAILURE do { ret = 0; goto exit; } while(0)
 #define RETURN_SUCCESS do { ret = 1; goto exit; } while(0)
@@ -753,6 +883,11 @@ do { \
 #define JUMP_BRANCH          11
 #define JUMP_ASSERT          12
 #define JUMP_ASSERT_NOT      13
+#define JUMP_POSS_REPEAT_1   14
+#define JUMP_POSS_REPEAT_2   15
+#define JUMP_ATOMIC_GROUP    16
+#define JUMP_POSS_REPEAT_3   17
+#define JUMP_ATOMIC_GROUP_2  18
 
 #define DO_JUMP(jumpvalue, jumplabel, nextpattern) \
     DATA_ALLOC(SRE_MATCH_CONTEXT, nextctx); \
@@ -788,7 +923,8 @@ SRE_MATCH(SRE_STATE* state, SRE_CODE* pattern)
     Py_ssize_t alloc_pos, ctx_pos = -1;
     Py_ssize_t i, ret = 0;
     Py_ssize_t jump;
-    unsigned int sigcount=0;
+    /* steps tried at this position, compared with state->maxsteps */
+    Py_ssize_t sigcount=0;
 
     SRE_MATCH_CONTEXT* ctx;
     SRE_MATCH_CONTEXT* nextctx;
@@ -818,8 +954,10 @@ entrance:
 
     for (;;) {
         ++sigcount;
-        if ((0 == (sigcount & 0xfff)) && PyErr_CheckSignals())
+        if ((0 == (sigcount & 0xfff)) && sre_check_signals(state))
             RETURN_ERROR(SRE_ERROR_INTERRUPTED);
+        if (state->maxsteps && sigcount > state->maxsteps)
+            RETURN_ERROR(SRE_ERROR_STEPLIMIT);
 
         switch (*ctx->pattern++) {
 
@@ -1141,6 +1279,139 @@ entrance:
             }
             RETURN_FAILURE;
 
+        case SRE_OP_POSSESSIVE_REPEAT_ONE:
+            /* match repeated sequence (maximizing regexp) without
+               backtracking */
+            /* <POSSESSIVE_REPEAT_ONE> <skip> <1=min> <2=max> item
+               <SUCCESS> tail */
+            TRACE(("|%p|%p|POSSESSIVE_REPEAT_ONE %d %d\n", ctx->pattern,
+                   ctx->ptr, ctx->pattern[1], ctx->pattern[2]));
+
+            if (ctx->ptr + state->charsize * ctx->pattern[1] > end)
+                RETURN_FAILURE; /* cannot match */
+
+            state->ptr = ctx->ptr;
+
+            ret = SRE_COUNT(state, ctx->pattern+3, ctx->pattern[2]);
+            RETURN_ON_ERROR(ret);
+            DATA_LOOKUP_AT(SRE_MATCH_CONTEXT, ctx, ctx_pos);
+            ctx->count = ret;
+            if (ctx->count < (Py_ssize_t) ctx->pattern[1])
+                RETURN_FAILURE;
+
+            /* continue with the tail, never giving back any item */
+            ctx->ptr += state->charsize * ctx->count;
+            ctx->pattern += ctx->pattern[0];
+            break;
+
+        case SRE_OP_POSSESSIVE_REPEAT:
+            /* match repeated subpattern without backtracking into it */
+            /* <POSSESSIVE_REPEAT> <skip> <1=min> <2=max> pattern
+               <SUCCESS> tail */
+            TRACE(("|%p|%p|POSSESSIVE_REPEAT %d %d\n", ctx->pattern,
+                   ctx->ptr, ctx->pattern[1], ctx->pattern[2]));
+
+            /* install a dummy repeat context, so that marks are saved
+               while matching the subpattern as in other repeats */
+            ctx->u.rep = (SRE_REPEAT*) PyMem_RawMalloc(sizeof(*ctx->u.rep));
+            if (!ctx->u.rep)
+                RETURN_ERROR(SRE_ERROR_MEMORY);
+            ctx->u.rep->count = -1;
+            ctx->u.rep->pattern = NULL;
+            ctx->u.rep->prev = state->repeat;
+            ctx->u.rep->last_ptr = NULL;
+            state->repeat = ctx->u.rep;
+
+            /* save the marks to restore if the tail fails. the loops
+               below reuse ctx->lastmark, so keep it on the stack */
+            LASTMARK_SAVE();
+            MARK_PUSH(ctx->lastmark);
+            DATA_PUSH(&ctx->lastmark);
+            DATA_PUSH(&ctx->lastindex);
+
+            state->ptr = ctx->ptr;
+            ctx->count = 0;
+
+            /* items required */
+            while (ctx->count < (Py_ssize_t) ctx->pattern[1]) {
+                DO_JUMP(JUMP_POSS_REPEAT_1, jump_poss_repeat_1,
+                        ctx->pattern+3);
+                if (!ret) {
+                    state->repeat = ctx->u.rep->prev;
+                    PyMem_RawFree(ctx->u.rep);
+                    goto poss_repeat_fail;
+                }
+                RETURN_ON_ERROR(ret);
+                ctx->count++;
+            }
+
+            /* match as many items as possible. an item matched an
+               empty string will match forever, so stop there */
+            while (ctx->count < (Py_ssize_t) ctx->pattern[2] ||
+                   ctx->pattern[2] == SRE_MAXREPEAT) {
+                LASTMARK_SAVE();
+                MARK_PUSH(ctx->lastmark);
+                ctx->ptr = state->ptr;
+                DO_JUMP(JUMP_POSS_REPEAT_2, jump_poss_repeat_2,
+                        ctx->pattern+3);
+                if (!ret) {
+                    MARK_POP(ctx->lastmark);
+                    LASTMARK_RESTORE();
+                    state->ptr = ctx->ptr;
+                    break;
+                }
+                MARK_POP_DISCARD(ctx->lastmark);
+                RETURN_ON_ERROR(ret);
+                ctx->count++;
+                if (state->ptr == ctx->ptr)
+                    break;
+            }
+
+            state->repeat = ctx->u.rep->prev;
+            PyMem_RawFree(ctx->u.rep);
+
+            /* match the tail after <SUCCESS> */
+            DO_JUMP(JUMP_POSS_REPEAT_3, jump_poss_repeat_3,
+                    ctx->pattern+ctx->pattern[0]+1);
+            if (ret) {
+                DATA_POP(&ctx->lastindex);
+                DATA_POP(&ctx->lastmark);
+                MARK_POP_DISCARD(ctx->lastmark);
+                RETURN_ON_ERROR(ret);
+                RETURN_SUCCESS;
+            }
+        poss_repeat_fail:
+            DATA_POP(&ctx->lastindex);
+            DATA_POP(&ctx->lastmark);
+            MARK_POP(ctx->lastmark);
+            LASTMARK_RESTORE();
+            state->ptr = ctx->ptr;
+            RETURN_FAILURE;
+
+        case SRE_OP_ATOMIC_GROUP:
+            /* match subpattern, and don't backtrack into it */
+            /* <ATOMIC_GROUP> <skip> pattern <SUCCESS> tail */
+            TRACE(("|%p|%p|ATOMIC_GROUP\n", ctx->pattern, ctx->ptr));
+            LASTMARK_SAVE();
+            MARK_PUSH(ctx->lastmark);
+            state->ptr = ctx->ptr;
+            DO_JUMP(JUMP_ATOMIC_GROUP, jump_atomic_group, ctx->pattern+1);
+            if (ret) {
+                RETURN_ON_ERROR(ret);
+                /* match the tail, restoring the marks if it fails */
+                DO_JUMP(JUMP_ATOMIC_GROUP_2, jump_atomic_group_2,
+                        ctx->pattern+ctx->pattern[0]);
+                if (ret) {
+                    MARK_POP_DISCARD(ctx->lastmark);
+                    RETURN_ON_ERROR(ret);
+                    RETURN_SUCCESS;
+                }
+            }
+            MARK_POP(ctx->lastmark);
+            LASTMARK_RESTORE();
+            state->ptr = ctx->ptr;
+            RETURN_FAILURE;
+
         case SRE_OP_REPEAT:
             /* create repeat context.  all the hard work is done
                by the UNTIL operator (MAX_UNTIL, MIN_UNTIL) */
@@ -1149,11 +1420,9 @@ entrance:
                    ctx->pattern[1], ctx->pattern[2]));
 
             /* install new repeat context */
-            ctx->u.rep = (SRE_REPEAT*) PyObject_MALLOC(sizeof(*ctx->u.rep));
-            if (!ctx->u.rep) {
-                PyErr_NoMemory();
-                RETURN_FAILURE;
-            }
+            ctx->u.rep = (SRE_REPEAT*) PyMem_RawMalloc(sizeof(*ctx->u.rep));
+            if (!ctx->u.rep)
+                RETURN_ERROR(SRE_ERROR_MEMORY);
             ctx->u.rep->count = -1;
             ctx->u.rep->pattern = ctx->pattern;
             ctx->u.rep->prev = state->repeat;
@@ -1163,7 +1432,7 @@ entrance:
             state->ptr = ctx->ptr;
             DO_JUMP(JUMP_REPEAT, jump_repeat, ctx->pattern+ctx->pattern[0]);
             state->repeat = ctx->u.rep->prev;
-            PyObject_FREE(ctx->u.rep);
+            PyMem_RawFree(ctx->u.rep);
 
             if (ret) {
                 RETURN_ON_ERROR(ret);
@@ -1465,6 +1734,21 @@ exit:
         case JUMP_ASSERT_NOT:
             TRACE(("|%p|%p|JUMP_ASSERT_NOT\n", ctx->pattern, ctx->ptr));
             goto jump_assert_not;
+        case JUMP_POSS_REPEAT_1:
+            TRACE(("|%p|%p|JUMP_POSS_REPEAT_1\n", ctx->pattern, ctx->ptr));
+            goto jump_poss_repeat_1;
+        case JUMP_POSS_REPEAT_2:
+            TRACE(("|%p|%p|JUMP_POSS_REPEAT_2\n", ctx->pattern, ctx->ptr));
+            goto jump_poss_repeat_2;
+        case JUMP_ATOMIC_GROUP:
+            TRACE(("|%p|%p|JUMP_ATOMIC_GROUP\n", ctx->pattern, ctx->ptr));
+            goto jump_atomic_group;
+        case JUMP_POSS_REPEAT_3:
+            TRACE(("|%p|%p|JUMP_POSS_REPEAT_3\n", ctx->pattern, ctx->ptr));
+            goto jump_poss_repeat_3;
+        case JUMP_ATOMIC_GROUP_2:
+            TRACE(("|%p|%p|JUMP_ATOMIC_GROUP_2\n", ctx->pattern, ctx->ptr));
+            goto jump_atomic_group_2;
         case JUMP_NONE:
             TRACE(("|%p|%p|RETURN %d\n", ctx->pattern, ctx->ptr, ret));
             break;
@@ -1478,6 +1762,9 @@ SRE_SEARCH(SRE_STATE* state, SRE_CODE* pattern)
 {
     char* ptr = (char*)state->start;
     char* end = (char*)state->end;
+    /* bound of positions to start matches (exclusive) */
+    char* stop = state->searchend ?
+        (char*)state->searchend + state->charsize : end + state->charsize;
     Py_ssize_t status = 0;
     Py_ssize_t prefix_len = 0;
     Py_ssize_t prefix_skip = 0;
@@ -1492,6 +1779,11 @@ SRE_SEARCH(SRE_STATE* state, SRE_CODE* pattern)
 
         flags = pattern[2];
 
+        /* the target is shorter than the pattern can match. (searching
+           it anyway makes the repeat operators to run past the end) */
+        if (pattern[3] && (end - ptr)/state->charsize < pattern[3])
+            return 0;
+
         if (pattern[3] > 1) {
             /* adjust end point (but make sure we leave at least one
                character in there, so literal search will work) */
@@ -1524,7 +1816,16 @@ SRE_SEARCH(SRE_STATE* state, SRE_CODE* pattern)
            table to skip forward as fast as we possibly can */
         Py_ssize_t i = 0;
         end = (char *)state->end;
+        /* the prefix ends prefix_len-1 characters after the start */
+        if (stop + (prefix_len - 1) * state->charsize < end)
+            end = stop + (prefix_len - 1) * state->charsize;
         while (ptr < end) {
+            if (!i) {
+                /* skip to the first character of the prefix */
+                ptr = sre_find_literal(state, ptr, end, prefix[0]);
+                if (ptr >= end)
+                    break;
+            }
             for (;;) {
                 if ((SRE_CODE) SRE_CHARGET(state, ptr, 0) != prefix[i]) {
                     if (!i)
@@ -1539,6 +1840,7 @@ SRE_SEARCH(SRE_STATE* state, SRE_CODE* pattern)
                         state->ptr = ptr - (prefix_len - prefix_skip - 1) * state->charsize;
                         if (flags & SRE_INFO_LITERAL)
                             return 1; /* we got all of it */
+                        RESET_CAPTURE_GROUP();
                         status = SRE_MATCH(state, pattern + 2*prefix_skip);
                         if (status != 0)
                             return status;
@@ -1559,9 +1861,10 @@ SRE_SEARCH(SRE_STATE* state, SRE_CODE* pattern)
            for short prefixes, and if fast search is disabled */
         SRE_CODE chr = pattern[1];
         end = (char*)state->end;
+        if (stop < end)
+            end = stop;
         for (;;) {
-            while (ptr < end && (SRE_CODE) SRE_CHARGET(state, ptr, 0) != chr)
-                ptr += state->charsize;
+            ptr = sre_find_literal(state, ptr, end, chr);
             if (ptr >= end)
                 return 0;
             TRACE(("|%p|%p|SEARCH LITERAL\n", pattern, ptr));
@@ -1570,6 +1873,7 @@ SRE_SEARCH(SRE_STATE* state, SRE_CODE* pattern)
             state->ptr = ptr;
             if (flags & SRE_INFO_LITERAL)
                 return 1; /* we got all of it */
+            RESET_CAPTURE_GROUP();
             status = SRE_MATCH(state, pattern + 2);
             if (status != 0)
                 break;
@@ -1577,6 +1881,8 @@ SRE_SEARCH(SRE_STATE* state, SRE_CODE* pattern)
     } else if (charset) {
         /* pattern starts with a character from a known set */
         end = (char*)state->end;
+        if (stop < end)
+            end = stop;
         for (;;) {
             while (ptr < end && !SRE_CHARSET(charset, SRE_CHARGET(state, ptr, 0)))
                 ptr += state->charsize;
@@ -1585,6 +1891,7 @@ SRE_SEARCH(SRE_STATE* state, SRE_CODE* pattern)
             TRACE(("|%p|%p|SEARCH CHARSET\n", pattern, ptr));
             state->start = ptr;
             state->ptr = ptr;
+            RESET_CAPTURE_GROUP();
             status = SRE_MATCH(state, pattern);
             if (status != 0)
                 break;
@@ -1592,10 +1899,11 @@ SRE_SEARCH(SRE_STATE* state, SRE_CODE* pattern)
         }
     } else
         /* general case */
-        while (ptr <= end) {
+        while (ptr <= end && ptr < stop) {
             TRACE(("|%p|%p|SEARCH\n", pattern, ptr));
             state->start = state->ptr = ptr;
             ptr += state->charsize;
+            RESET_CAPTURE_GROUP();
             status = SRE_MATCH(state, pattern);
             if (status != 0)
                 break;
@@ -1660,6 +1968,10 @@ state_reset(SRE_STATE* state)
 
     state->repeat = NULL;
 
+    /* the rope may be modified since last search */
+    state->chunkbegin = state->chunkend = 0;
+    state->readerror = 0;
+
     data_stack_dealloc(state);
 }
 static void *
@@ -1674,6 +1986,13 @@ getgappedbuf(PyObject* string, Py_ssize_t* p_length,
         *p_logical_charsize = 4;
         return 0;
     }
+    if (PyObject_TypeCheck(string, &RopeBufferType)) {
+        struct RopeBufferObj *obj =(struct RopeBufferObj*)string;
+        *p_length = obj->numelems;
+        *p_charsize = 1;
+        *p_logical_charsize = 4;
+        return 0;
+    }
     PyErr_SetString(PyExc_TypeError, "expected gappedbuffer");
     return (void*)-1;
 }
@@ -1749,6 +2068,61 @@ getstring(PyObject* string, Py_ssize_t* p_length,
     return NULL;
 }
 
+LOCAL(void)
+sre_setup_direct(SRE_STATE* state)
+{
+    /* read characters directly from the gapped buffer if the gap doesn't
+       split the range from the beginning to the end of the target.
+       Otherwise each character is read on either side of the gap. The
+       gap is never moved, so a search doesn't change the buffer */
+    struct GappedBufferObj* gappedbuf = state->gappedbuf;
+    Py_ssize_t end = (Py_ssize_t)state->end;
+    Py_ssize_t gap = gappedbuf->gap;
+
+    state->direct = NULL;
+    state->directkind = gappedbuf->kind;
+
+    if (!gappedbuf->gapsize || gap >= end)
+        state->direct = gappedbuf->buf;
+    else if (gap == 0)
+        state->direct = gappedbuf->buf + gappedbuf->gapsize * gappedbuf->kind;
+}
+
+static Py_ssize_t
+sre_run(SRE_STATE* state, SRE_CODE* pattern, int search)
+{
+    /* run matcher. GIL is released while matching a gapped buffer, and
+       the buffer is locked as if exported so that it cannot be modified
+       meanwhile. A rope is read through Python API, so GIL is held */
+    Py_ssize_t status;
+    struct GappedBufferObj* gappedbuf = state->gappedbuf;
+
+    state->direct = NULL;
+    if (!gappedbuf) {
+        status = search ? sre_usearch(state, pattern) :
+                          sre_umatch(state, pattern);
+        if (state->readerror)
+            return SRE_ERROR_READ;
+        return status;
+    }
+
+    sre_setup_direct(state);
+
+    Py_INCREF((PyObject*)gappedbuf);
+    gappedbuf->exports++;
+    state->threadstate = PyEval_SaveThread();
+
+    status = search ? sre_usearch(state, pattern) :
+                      sre_umatch(state, pattern);
+
+    PyEval_RestoreThread(state->threadstate);
+    state->threadstate = NULL;
+    state->direct = NULL;
+    gappedbuf->exports--;
+    Py_DECREF((PyObject*)gappedbuf);
+    return status;
+}
+
 LOCAL(PyObject*)
 state_init(SRE_STATE* state, PatternObject* pattern, PyObject* string,
            Py_ssize_t start, Py_ssize_t end)
@@ -1789,7 +2163,9 @@ state_init(SRE_STATE* state, PatternObject* pattern, PyObject* string,
     state->end = (void*) ((char*) ptr + end * state->charsize);
 
     Py_INCREF(string);
-    state->string = (struct GappedBufferObj*)string;
+    state->string = string;
+    if (PyObject_TypeCheck(string, &GappedBufferType))
+        state->gappedbuf = (struct GappedBufferObj*)string;
     state->pos = start;
     state->endpos = end;
 
@@ -1857,8 +2233,15 @@ pattern_error(int status)
         PyErr_NoMemory();
         break;
     case SRE_ERROR_INTERRUPTED:
+    case SRE_ERROR_READ:
     /* An exception has already been raised, so let it fly */
         break;
+    case SRE_ERROR_STEPLIMIT:
+        PyErr_SetString(
+            StepLimitError,
+            "maximum number of steps exceeded"
+            );
+        break;
     default:
         /* other error codes indicate compiler/engine bugs */
         PyErr_SetString(
@@ -1890,14 +2273,16 @@ pattern_match(PatternObject* self, PyObject* args, PyObject* kw)
     PyObject* string;
     Py_ssize_t start = 0;
     Py_ssize_t end = PY_SSIZE_T_MAX;
-    static char* kwlist[] = { "pattern", "pos", "endpos", NULL };
-    if (!PyArg_ParseTupleAndKeywords(args, kw, "O|nn:match", kwlist,
-                                     &string, &start, &end))
+    Py_ssize_t maxsteps = 0;
+    static char* kwlist[] = { "pattern", "pos", "endpos", "maxsteps", NULL };
+    if (!PyArg_ParseTupleAndKeywords(args, kw, "O|nnn:match", kwlist,
+                                     &string, &start, &end, &maxsteps))
         return NULL;
 
     string = state_init(&state, self, string, start, end);
     if (!string)
         return NULL;
+    state.maxsteps = maxsteps;
 
     state.ptr = state.start;
 
@@ -1909,7 +2294,7 @@ pattern_match(PatternObject* self, PyObject* args, PyObject* kw)
 //        status = sre_umatch(&state, PatternObject_GetCode(self));
 //    }
 
-    status = sre_umatch(&state, PatternObject_GetCode(self));
+    status = sre_run(&state, PatternObject_GetCode(self), 0);
 
     TRACE(("|%p|%p|END\n", PatternObject_GetCode(self), state.ptr));
     if (PyErr_Occurred())
@@ -1929,14 +2314,16 @@ pattern_search(PatternObject* self, PyObject* args, PyObject* kw)
     PyObject* string;
     Py_ssize_t start = 0;
     Py_ssize_t end = PY_SSIZE_T_MAX;
-    static char* kwlist[] = { "pattern", "pos", "endpos", NULL };
-    if (!PyArg_ParseTupleAndKeywords(args, kw, "O|nn:search", kwlist,
-                                     &string, &start, &end))
+    Py_ssize_t maxsteps = 0;
+    static char* kwlist[] = { "pattern", "pos", "endpos", "maxsteps", NULL };
+    if (!PyArg_ParseTupleAndKeywords(args, kw, "O|nnn:search", kwlist,
+                                     &string, &start, &end, &maxsteps))
         return NULL;
 
     string = state_init(&state, self, string, start, end);
     if (!string)
         return NULL;
+    state.maxsteps = maxsteps;
 
     TRACE(("|%p|%p|SEARCH\n", PatternObject_GetCode(self), state.ptr));
 
@@ -1946,7 +2333,7 @@ pattern_search(PatternObject* self, PyObject* args, PyObject* kw)
 //         status = sre_usearch(&state, PatternObject_GetCode(self));
 //     }
 
-    status = sre_usearch(&state, PatternObject_GetCode(self));
+    status = sre_run(&state, PatternObject_GetCode(self), 1);
 
     TRACE(("|%p|%p|END\n", PatternObject_GetCode(self), state.ptr));
 
@@ -1958,6 +2345,287 @@ pattern_search(PatternObject* self, PyObject* args, PyObject* kw)
     return pattern_new_match(self, &state, status);
 }
 
+LOCAL(int)
+sre_consumes(SRE_STATE* state, SRE_CODE* code, SRE_CODE* end, SRE_CODE ch)
+{
+    /* returns 1 if a match of the code may contain ch. Assertions are
+       skipped, since they don't consume characters. Unknown operators
+       are assumed to consume any character */
+    while (code < end) {
+        switch (*code++) {
+
+        case SRE_OP_LITERAL:
+            if (ch == *code)
+                return 1;
+            code++;
+            break;
+
+        case SRE_OP_NOT_LITERAL:
+            if (ch != *code)
+                return 1;
+            code++;
+            break;
+
+        case SRE_OP_LITERAL_IGNORE:
+            if (state->lower(ch) == state->lower(*code))
+                return 1;
+            code++;
+            break;
+
+        case SRE_OP_NOT_LITERAL_IGNORE:
+            if (state->lower(ch) != state->lower(*code))
+                return 1;
+            code++;
+            break;
+
+        case SRE_OP_ANY:
+            if (!SRE_IS_LINEBREAK(ch))
+                return 1;
+            break;
+
+        case SRE_OP_CATEGORY:
+            if (sre_category(*code, ch))
+                return 1;
+            code++;
+            break;
+
+        case SRE_OP_IN:
+            if (SRE_CHARSET(code + 1, ch))
+                return 1;
+            code += code[0];
+            break;
+
+        case SRE_OP_IN_IGNORE:
+            if (SRE_CHARSET(code + 1, (SRE_CODE)state->lower(ch)))
+                return 1;
+            code += code[0];
+            break;
+
+        case SRE_OP_BRANCH:
+            /* <BRANCH> <0=skip> code <JUMP> ... <NULL> */
+            for (; code[0]; code += code[0])
+                if (sre_consumes(state, code + 1, code + code[0], ch))
+                    return 1;
+            code++;
+            break;
+
+        case SRE_OP_INFO:
+        case SRE_OP_ASSERT:
+        case SRE_OP_ASSERT_NOT:
+            code += code[0];
+            break;
+
+        case SRE_OP_REPEAT:
+        case SRE_OP_REPEAT_ONE:
+        case SRE_OP_MIN_REPEAT_ONE:
+        case SRE_OP_POSSESSIVE_REPEAT:
+        case SRE_OP_POSSESSIVE_REPEAT_ONE:
+            /* <REPEAT> <skip> <1=min> <2=max> item ... */
+            code += 3;
+            break;
+
+        case SRE_OP_GROUPREF_EXISTS:
+            /* <GROUPREF_EXISTS> <group> <skip> then [<JUMP> <skip> else] */
+            code += 2;
+            break;
+
+        case SRE_OP_AT:
+        case SRE_OP_MARK:
+        case SRE_OP_JUMP:
+        case SRE_OP_ATOMIC_GROUP:
+            code++;
+            break;
+
+        case SRE_OP_SUCCESS:
+        case SRE_OP_FAILURE:
+        case SRE_OP_MAX_UNTIL:
+        case SRE_OP_MIN_UNTIL:
+            break;
+
+        default:
+            return 1;
+        }
+    }
+    return 0;
+}
+
+LOCAL(Py_ssize_t)
+sre_syncpos(SRE_STATE* state, PatternObject* pattern, Py_ssize_t index,
+            Py_ssize_t pos, signed char* cache)
+{
+    /* returns the last position from pos to index after a character no
+       match can contain, or pos if there is no such character. No match
+       runs across the position, so a forward scan started there finds
+       the same matches after it as the one started at pos. cache holds
+       results for characters below SRE_SYNC_CACHE (-1: not tested) */
+    SRE_CODE* code = PatternObject_GetCode(pattern);
+    SRE_CODE* end = code + pattern->codesize;
+    SRE_CODE ch;
+    int consumes;
+
+    for (; index > pos; index--) {
+        ch = (SRE_CODE) SRE_CHARGET(state, 0, index-1);
+        if (ch < SRE_SYNC_CACHE) {
+            if (cache[ch] == -1)
+                cache[ch] = sre_consumes(state, code, end, ch);
+            consumes = cache[ch];
+        }
+        else
+            consumes = sre_consumes(state, code, end, ch);
+        if (!consumes)
+            break;
+    }
+    return index;
+}
+
+static PyObject*
+pattern_syncpos(PatternObject* self, PyObject* args, PyObject* kw)
+{
+    SRE_STATE state;
+    Py_ssize_t length;
+    signed char cache[SRE_SYNC_CACHE];
+
+    PyObject* string;
+    Py_ssize_t index;
+    Py_ssize_t start = 0;
+    static char* kwlist[] = { "pattern", "index", "pos", NULL };
+    if (!PyArg_ParseTupleAndKeywords(args, kw, "On|n:syncpos", kwlist,
+                                     &string, &index, &start))
+        return NULL;
+
+    string = state_init(&state, self, string, start, PY_SSIZE_T_MAX);
+    if (!string)
+        return NULL;
+
+    length = STATE_OFFSET(&state, state.end);
+    start = state.pos;
+    if (index > length)
+        index = length;
+
+    memset(cache, -1, sizeof(cache));
+    if (index > start)
+        start = sre_syncpos(&state, self, index, start, cache);
+
+    state_fini(&state);
+
+    if (PyErr_Occurred())
+        return NULL;
+
+    return PyLong_FromSsize_t(start);
+}
+
+static PyObject*
+pattern_rsearch(PatternObject* self, PyObject* args, PyObject* kw)
+{
+    /* find the last match which starts at or after pos and ends at or
+       before endpos, i.e. the last match a forward scan from pos finds
+       before endpos. The string is scanned forward in windows of
+       SRE_RSEARCH_WINDOW characters, starting from the window just
+       before endpos and stepping backward until a match is found, so
+       the cost depends on the distance to the match rather than on the
+       length of the string. A window is moved back to start after a
+       character no match can contain, where the scan from pos would
+       also pass through. If there is no such character, the window
+       extends to pos. Text after endpos is still visible to the
+       pattern (e.g. for lookahead or $). */
+
+    SRE_STATE state;
+    int status;
+    Py_ssize_t length, lo, hi, b, e, last;
+    signed char cache[SRE_SYNC_CACHE];
+
+    PyObject* string;
+    Py_ssize_t start = 0;
+    Py_ssize_t end = PY_SSIZE_T_MAX;
+    Py_ssize_t maxsteps = 0;
+    static char* kwlist[] = { "pattern", "endpos", "pos", "maxsteps", NULL };
+    if (!PyArg_ParseTupleAndKeywords(args, kw, "O|nnn:rsearch", kwlist,
+                                     &string, &end, &start, &maxsteps))
+        return NULL;
+
+    string = state_init(&state, self, string, start, PY_SSIZE_T_MAX);
+    if (!string)
+        return NULL;
+    state.maxsteps = maxsteps;
+
+    length = STATE_OFFSET(&state, state.end);
+    start = state.pos;
+    if (end > length)
+        end = length;
+
+    memset(cache, -1, sizeof(cache));
+    last = -1;
+    hi = end;
+    for (;;) {
+        lo = hi - SRE_RSEARCH_WINDOW;
+        if (lo < start)
+            lo = start;
+        lo = sre_syncpos(&state, self, lo, start, cache);
+        if (PyErr_Occurred())
+            goto error;
+
+        state.start = (void*) ((char*) state.beginning + lo * state.charsize);
+        /* matches are tried only at positions up to hi, so each window
+           costs its length regardless of the text after it */
+        state.searchend = (void*) ((char*) state.beginning +
+                                   hi * state.charsize);
+        while (state.start <= state.searchend) {
+            state_reset(&state);
+            state.ptr = state.start;
+
+            status = sre_run(&state, PatternObject_GetCode(self), 1);
+            if (PyErr_Occurred())
+                goto error;
+
+            if (status <= 0) {
+                if (status == 0)
+                    break;
+                pattern_error(status);
+                goto error;
+            }
+
+            b = STATE_OFFSET(&state, state.start);
+            e = STATE_OFFSET(&state, state.ptr);
+            if (b > hi || e > end)
+                break;
+            last = b;
+
+            if (e == b)
+                state.start = (void*) ((char*) state.ptr + state.charsize);
+            else
+                state.start = state.ptr;
+        }
+        if (last != -1 || lo == start)
+            break;
+        /* no match runs across lo, so the matches before lo end at or
+           before it */
+        hi = lo;
+    }
+
+    if (last == -1) {
+        state_fini(&state);
+        Py_INCREF(Py_None);
+        return Py_None;
+    }
+
+    /* run again to get groups of the last match */
+    state_reset(&state);
+    state.start = state.ptr =
+        (void*) ((char*) state.beginning + last * state.charsize);
+    status = sre_run(&state, PatternObject_GetCode(self), 0);
+
+    state_fini(&state);
+
+    if (PyErr_Occurred())
+        return NULL;
+
+    return pattern_new_match(self, &state, status);
+
+error:
+    state_fini(&state);
+    return NULL;
+}
+
 static PyObject*
 call(char* module, char* function, PyObject* args)
 {
@@ -2093,7 +2761,7 @@ pattern_findall(PatternObject* self, PyObject* args, PyObject* kw)
 //             status = sre_usearch(&state, PatternObject_GetCode(self));
 //         }
 
-        status = sre_usearch(&state, PatternObject_GetCode(self));
+        status = sre_run(&state, PatternObject_GetCode(self), 1);
 
         if (PyErr_Occurred())
             goto error;
@@ -2223,7 +2891,7 @@ pattern_split(PatternObject* self, PyObject* args, PyObject* kw)
 //             status = sre_usearch(&state, PatternObject_GetCode(self));
 //         }
 
-        status = sre_usearch(&state, PatternObject_GetCode(self));
+        status = sre_run(&state, PatternObject_GetCode(self), 1);
 
         if (PyErr_Occurred())
             goto error;
@@ -2373,7 +3041,7 @@ pattern_subx(PatternObject* self, PyObject* ptemplate, PyObject* string,
 //             status = sre_usearch(&state, PatternObject_GetCode(self));
 //         }
 
-        status = sre_usearch(&state, PatternObject_GetCode(self));
+        status = sre_run(&state, PatternObject_GetCode(self), 1);
 
         if (PyErr_Occurred())
             goto error;
@@ -2557,13 +3225,28 @@ pattern_deepcopy(PatternObject* self, PyObject* memo)
 }
 
 PyDoc_STRVAR(pattern_match_doc,
-"match(string[, pos[, endpos]]) -> match object or None.\n\
-    Matches zero or more characters at the beginning of the string");
+"match(string[, pos[, endpos[, maxsteps]]]) -> match object or None.\n\
+    Matches zero or more characters at the beginning of the string.\n\
+    StepLimitError is raised if matching takes more than maxsteps steps.");
+
+PyDoc_STRVAR(pattern_rsearch_doc,
+"rsearch(string[, endpos[, pos[, maxsteps]]]) -> match object or None.\n\
+    Scan backward through string for the last match ending at or\n\
+    before endpos. The match is the last one finditer() from pos\n\
+    yields before endpos.");
+
+PyDoc_STRVAR(pattern_syncpos_doc,
+"syncpos(string, index[, pos]) -> integer.\n\
+    Return the last position from pos to index after a character no\n\
+    match can contain, or pos. A forward scan started there finds the\n\
+    same matches after it as the one started at pos.");
 
 PyDoc_STRVAR(pattern_search_doc,
-"search(string[, pos[, endpos]]) -> match object or None.\n\
+"search(string[, pos[, endpos[, maxsteps]]]) -> match object or None.\n\
     Scan through string looking for a match, and return a corresponding\n\
-    match object instance. Return None if no position in the string matches.");
+    match object instance. Return None if no position in the string matches.\n\
+    StepLimitError is raised if matching at a position takes more than\n\
+    maxsteps steps.");
 
 PyDoc_STRVAR(pattern_split_doc,
 "split(string[, maxsplit = 0])  -> list.\n\
@@ -2574,7 +3257,7 @@ PyDoc_STRVAR(pattern_findall_doc,
    Return a list of all non-overlapping matches of pattern in string.");
 
 PyDoc_STRVAR(pattern_finditer_doc,
-"finditer(string[, pos[, endpos]]) -> iterator.\n\
+"finditer(string[, pos[, endpos[, maxsteps]]]) -> iterator.\n\
     Return an iterator over all non-overlapping matches for the \n\
     RE pattern in string. For each match, the iterator returns a\n\
     match object.");
@@ -2597,6 +3280,10 @@ static PyMethodDef pattern_methods[] = {
         pattern_match_doc},
     {"search", (PyCFunction) pattern_search, METH_VARARGS|METH_KEYWORDS,
         pattern_search_doc},
+    {"rsearch", (PyCFunction) pattern_rsearch, METH_VARARGS|METH_KEYWORDS,
+        pattern_rsearch_doc},
+    {"syncpos", (PyCFunction) pattern_syncpos, METH_VARARGS|METH_KEYWORDS,
+        pattern_syncpos_doc},
     {"sub", (PyCFunction) pattern_sub, METH_VARARGS|METH_KEYWORDS,
         pattern_sub_doc},
     {"subn", (PyCFunction) pattern_subn, METH_VARARGS|METH_KEYWORDS,
@@ -3059,6 +3746,7 @@ _validate_inner(SRE_CODE *code, SRE_CODE *end, Py_ssize_t groups)
 
         case SRE_OP_REPEAT_ONE:
         case SRE_OP_MIN_REPEAT_ONE:
+        case SRE_OP_POSSESSIVE_REPEAT_ONE:
             {
                 SRE_CODE min, max;
                 GET_SKIP;
@@ -3078,8 +3766,9 @@ _validate_inner(SRE_CODE *code, SRE_CODE *end, Py_ssize_t groups)
             break;
 
         case SRE_OP_REPEAT:
+        case SRE_OP_POSSESSIVE_REPEAT:
             {
-                SRE_CODE min, max;
+                SRE_CODE op1 = op, min, max;
                 GET_SKIP;
                 GET_ARG; min = arg;
                 GET_ARG; max = arg;
@@ -3091,11 +3780,26 @@ _validate_inner(SRE_CODE *code, SRE_CODE *end, Py_ssize_t groups)
                     FAIL;
                 code += skip-3;
                 GET_OP;
-                if (op != SRE_OP_MAX_UNTIL && op != SRE_OP_MIN_UNTIL)
+                if (op1 == SRE_OP_POSSESSIVE_REPEAT) {
+                    if (op != SRE_OP_SUCCESS)
+                        FAIL;
+                }
+                else if (op != SRE_OP_MAX_UNTIL && op != SRE_OP_MIN_UNTIL)
                     FAIL;
             }
             break;
 
+        case SRE_OP_ATOMIC_GROUP:
+            GET_SKIP;
+            /* Stop 1 before the end; we check the SUCCESS below */
+            if (!_validate_inner(code, code+skip-2, groups))
+                FAIL;
+            code += skip-2;
+            GET_OP;
+            if (op != SRE_OP_SUCCESS)
+                FAIL;
+            break;
+
         case SRE_OP_GROUPREF:
         case SRE_OP_GROUPREF_IGNORE:
             GET_ARG;
@@ -3803,7 +4507,7 @@ scanner_match(ScannerObject* self, PyObject *unused)
 //         status = sre_umatch(state, PatternObject_GetCode(self->pattern));
 //     }
 
-    status = sre_umatch(state, PatternObject_GetCode(self->pattern));
+    status = sre_run(state, PatternObject_GetCode(self->pattern), 0);
 
     if (PyErr_Occurred())
         return NULL;
@@ -3837,7 +4541,7 @@ scanner_search(ScannerObject* self, PyObject *unused)
 //         status = sre_usearch(state, PatternObject_GetCode(self->pattern));
 //     }
 
-    status = sre_usearch(state, PatternObject_GetCode(self->pattern));
+    status = sre_run(state, PatternObject_GetCode(self->pattern), 1);
     if (PyErr_Occurred())
         return NULL;
 
@@ -3906,9 +4610,11 @@ pattern_scanner(PatternObject* pattern, PyObject* args, PyObject* kw)
     PyObject* string;
     Py_ssize_t start = 0;
     Py_ssize_t end = PY_SSIZE_T_MAX;
-    static char* kwlist[] = { "source", "pos", "endpos", NULL };
-    if (!PyArg_ParseTupleAndKeywords(args, kw, "O|nn:scanner", kwlist,
-                                     &string, &start, &end))
+    Py_ssize_t maxsteps = 0;
+    static char* kwlist[] = { "source", "pos", "endpos", "maxsteps",
+                              NULL };
+    if (!PyArg_ParseTupleAndKeywords(args, kw, "O|nnn:scanner", kwlist,
+                                     &string, &start, &end, &maxsteps))
         return NULL;
 
     /* create scanner object */
@@ -3922,6 +4628,7 @@ pattern_scanner(PatternObject* pattern, PyObject* args, PyObject* kw)
         Py_DECREF(self);
         return NULL;
     }
+    self->state.maxsteps = maxsteps;
 
     Py_INCREF(pattern);
     self->pattern = (PyObject*) pattern;
@@ -3982,6 +4689,13 @@ PyMODINIT_FUNC PyInit__gappedbufre(void)
         Py_DECREF(x);
     }
 
+    StepLimitError = PyErr_NewException("_" SRE_MODULE ".StepLimitError",
+                                        PyExc_RuntimeError, NULL);
+    if (StepLimitError) {
+        Py_INCREF(StepLimitError);
+        PyDict_SetItemString(d, "StepLimitError", StepLimitError);
+    }
+
     x = PyUnicode_FromString(copyright);
     if (x) {
         PyDict_SetItemString(d, "copyright", x);
@@ -43,7 +43,7 @@ typedef struct {
 
 typedef struct {
     PyObject_VAR_HEAD
-    struct GappedBufferObj* string; /* link to the target string (must be first) */
+    PyObject* string; /* link to the target string (must be first) */
     PyObject* regs; /* cached list of matching spans */
     PatternObject* pattern; /* link to the regex (pattern) object */
     Py_ssize_t pos, endpos; /* current target slice */
@@ -70,9 +70,22 @@ typedef struct {
     void* beginning; /* start of original string */
     void* start; /* start of current slice */
     void* end; /* end of original string */
+    void* searchend; /* last start of a match to search (NULL: end) */
     /* attributes for the match object */
-    struct GappedBufferObj* string;
+    PyObject* string;
     Py_ssize_t pos, endpos;
+    /* target gapped buffer (NULL if target is a rope) */
+    struct GappedBufferObj* gappedbuf;
+    /* characters of the gapped buffer to be read directly (NULL if the
+       gap splits characters to be read) */
+    char* direct;
+    int directkind;
+    /* chunk of the rope read last */
+    void* chunk;
+    int chunkkind;
+    Py_ssize_t chunkbegin, chunkend;
+    /* reading the rope raised an exception */
+    int readerror;
     /* character size */
     int logical_charsize; /* kind of thing: 1 - bytes, 2/4 - unicode */
     int charsize;
@@ -89,6 +102,10 @@ typedef struct {
     SRE_REPEAT *repeat;
     /* hooks */
     SRE_TOLOWER_HOOK lower;
+    /* thread state saved while GIL is released */
+    PyThreadState* threadstate;
+    /* max number of steps to try a match at a position (0: no limit) */
+    Py_ssize_t maxsteps;
 } SRE_STATE;
 
 typedef struct {
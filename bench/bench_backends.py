@@ -0,0 +1,52 @@
+"""Compare GappedBuffer and RopeBuffer on local and scattered edits.
+
+usage: python bench/bench_backends.py [MBYTES]
+"""
+
+import sys, time
+import _gappedbuf
+
+def local_edits(buf, n):
+    # typing in the middle of the text
+    pos = len(buf) // 2
+    for i in range(n):
+        buf.insert(pos, 'x')
+        pos += 1
+        if i % 10 == 9:
+            buf.delete(pos-1, pos)
+            pos -= 1
+
+def scattered_edits(buf, n):
+    # replace at top and bottom of the text alternately
+    for i in range(n):
+        pos = 10 if i % 2 else len(buf) - 10
+        buf.replace(pos, pos+3, 'abcd')
+
+def search_edits(buf, n):
+    # read text around edits
+    for i in range(n):
+        pos = (i * 7919 * 4096) % (len(buf) - 100)
+        buf.replace(pos, pos+1, 'y')
+        buf.get(pos, pos+100)
+
+def run(title, cls, text, func, n):
+    buf = cls()
+    buf.insert(0, text)
+    start = time.perf_counter()
+    func(buf, n)
+    elapsed = time.perf_counter() - start
+    print('{:16} {:14} {:8.3f} sec'.format(title, cls.__name__, elapsed))
+
+def main():
+    mbytes = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    text = 'log: 2013/06/16 13:14:50 hello world\n'
+    text = text * (mbytes * 1024 * 1024 // len(text))
+
+    for title, func, n in [('local edits', local_edits, 100000),
+                           ('scattered edits', scattered_edits, 1000),
+                           ('random edits', search_edits, 1000)]:
+        for cls in (_gappedbuf.GappedBuffer, _gappedbuf.RopeBuffer):
+            run(title, cls, text, func, n)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,28 @@
+"""Memory usage of GappedBuffer for texts of each character width.
+
+usage: python bench/bench_memory.py [MBYTES]
+"""
+
+import sys
+import _gappedbuf
+
+def measure(title, line, nchars):
+    buf = _gappedbuf.GappedBuffer()
+    buf.insert(0, line * (nchars // len(line)))
+
+    used = sys.getsizeof(buf)
+    ucs4 = buf.bufsize * 4
+    print('{:8} kind={} {:10,} bytes ({:.0%} of UCS4 storage)'.format(
+        title, buf.kind, used, used / ucs4))
+
+def main():
+    mbytes = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    nchars = mbytes * 1024 * 1024
+
+    measure('ascii', 'log: 2013/06/16 13:14:50 hello world\n', nchars)
+    measure('latin-1', 'caf\xe9 cr\xe8me br\xfbl\xe9e\n', nchars)
+    measure('ucs-2', '吾輩は猫である。名前はまだ無い。\n', nchars)
+    measure('ucs-4', 'emoji \U0001f600\n', nchars)
+
+if __name__ == '__main__':
+    main()
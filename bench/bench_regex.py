@@ -0,0 +1,55 @@
+"""Compare gappedbuf.re on GappedBuffer with re on str.
+
+usage: python bench/bench_regex.py [MBYTES]
+"""
+
+import sys, time, re
+import _gappedbuf
+import gappedbuf.re
+
+PATTERNS = [
+    ('literal (not found)', r'#include'),
+    ('charset (not found)', r'[#$%]'),
+    ('words', r'\w+'),
+    ('numbers', r'\b\d+\b'),
+    ('ignorecase', r'(?i)HELLO\s+WORLD'),
+]
+
+def run(title, func, n=3):
+    start = time.perf_counter()
+    for i in range(n):
+        ret = func()
+    elapsed = (time.perf_counter() - start) / n
+    print('{:28} {:8.4f} sec  {}'.format(title, elapsed, ret))
+
+def count_matches(regex, target):
+    return sum(1 for m in regex.finditer(target))
+
+def main():
+    mbytes = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    line = 'log: 2013/06/16 13:14:50 hello world\n'
+    text = line * (mbytes * 1024 * 1024 // len(line))
+
+    middle = _gappedbuf.GappedBuffer()
+    middle.insert(0, text)
+    middle.insert(len(text) // 2, 'x')
+    middle.delete(len(text) // 2, len(text) // 2 + 1)
+
+    for title, pattern in PATTERNS:
+        print('--', title)
+        gregex = gappedbuf.re.compile(pattern)
+        regex = re.compile(pattern)
+
+        if 'not found' in title:
+            run('re on str', lambda: regex.search(text))
+            run('gappedbuf.re', lambda: gregex.search(middle))
+            if title.startswith('literal'):
+                run('GappedBuffer.find', lambda: middle.find(
+                        pattern, 0, len(middle)))
+                run('str.find', lambda: text.find(pattern))
+        else:
+            run('re on str', lambda: count_matches(regex, text))
+            run('gappedbuf.re', lambda: count_matches(gregex, middle))
+
+if __name__ == '__main__':
+    main()
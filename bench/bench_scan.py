@@ -0,0 +1,41 @@
+"""Measure character scans of GappedBuffer against str methods.
+
+usage: python bench/bench_scan.py [MBYTES]
+"""
+
+import sys, time
+import _gappedbuf
+
+def run(title, func, n=10):
+    start = time.perf_counter()
+    for i in range(n):
+        ret = func()
+    elapsed = (time.perf_counter() - start) / n
+    print('{:32} {:8.4f} sec  {}'.format(title, elapsed, ret))
+
+def main():
+    mbytes = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    line = 'log: 2013/06/16 13:14:50 hello world'
+    text = (line + '\n') * (mbytes * 1024 * 1024 // (len(line)+1))
+    end = len(text)
+
+    for c in ['', 'ā', '\U00010001']:
+        buf = _gappedbuf.GappedBuffer()
+        buf.insert(0, text.replace('h', c or 'h'))
+        buf.insert(end // 2, 'x')
+        buf.delete(end // 2, end // 2 + 1)
+        print('-- kind', buf.kind)
+
+        run('findchr (not found)', lambda: buf.findchr('#', 0, end))
+        run('rfindchr (not found)', lambda: buf.rfindchr('#', 0, end))
+        run('findchr 2 chars (not found)', lambda: buf.findchr('#$', 0, end))
+        run('count newlines', lambda: buf.count('\n', 0, end))
+        run('findint not equal', lambda: buf.findint(
+                [ord(c) for c in set(line)], 0, end, True))
+    print('-- str')
+    run('str.find (not found)', lambda: text.find('#'))
+    run('str.rfind (not found)', lambda: text.rfind('#'))
+    run('str.count newlines', lambda: text.count('\n'))
+
+if __name__ == '__main__':
+    main()
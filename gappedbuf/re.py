@@ -116,6 +116,11 @@ Some of the functions in this module takes flags as optional parameters:
 
 This module also defines an exception 'error'.
 
+match(), search(), rsearch() and finditer() methods of compiled patterns
+take an optional maxsteps argument to limit steps of the engine spent to
+try a match at a position. StepLimitError is raised if the limit is
+exceeded, so patterns which backtrack catastrophically can be given up.
+
 """
 
 import sys
@@ -124,10 +129,10 @@ from . import sre_parse
 import functools
 
 # public symbols
-__all__ = [ "match", "search", "sub", "subn", "split", "findall",
+__all__ = [ "match", "search", "rsearch", "sub", "subn", "split", "findall",
     "compile", "purge", "template", "escape", "A", "I", "L", "M", "S", "X",
     "U", "ASCII", "IGNORECASE", "LOCALE", "MULTILINE", "DOTALL", "VERBOSE",
-    "UNICODE", "error" ]
+    "UNICODE", "error", "StepLimitError" ]
 
 __version__ = "2.2.1"
 
@@ -146,6 +151,7 @@ DEBUG = sre_compile.SRE_FLAG_DEBUG # dump pattern after compilation
 
 # sre exception
 error = sre_compile.error
+StepLimitError = sre_compile._sre.StepLimitError
 
 # --------------------------------------------------------------------
 # public interface
@@ -160,6 +166,12 @@ def search(pattern, string, flags=0):
     a match object, or None if no match was found."""
     return _compile(pattern, flags).search(string)
 
+def rsearch(pattern, string, endpos=sys.maxsize, flags=0):
+    """Scan backward through string looking for the last match to the
+    pattern ending at or before endpos, returning a match object, or
+    None if no match was found."""
+    return _compile(pattern, flags).rsearch(string, endpos)
+
 def sub(pattern, repl, string, count=0, flags=0):
     """Return the string obtained by replacing the leftmost
     non-overlapping occurrences of the pattern in string by the
@@ -29,7 +29,7 @@ def _identityfunction(x):
     return x
 
 _LITERAL_CODES = set([LITERAL, NOT_LITERAL])
-_REPEATING_CODES = set([REPEAT, MIN_REPEAT, MAX_REPEAT])
+_REPEATING_CODES = set([REPEAT, MIN_REPEAT, MAX_REPEAT, POSSESSIVE_REPEAT])
 _SUCCESS_CODES = set([SUCCESS, FAILURE])
 _ASSERT_CODES = set([ASSERT, ASSERT_NOT])
 
@@ -78,6 +78,8 @@ def _compile(code, pattern, flags):
             elif _simple(av) and op is not REPEAT:
                 if op is MAX_REPEAT:
                     emit(OPCODES[REPEAT_ONE])
+                elif op is POSSESSIVE_REPEAT:
+                    emit(OPCODES[POSSESSIVE_REPEAT_ONE])
                 else:
                     emit(OPCODES[MIN_REPEAT_ONE])
                 skip = _len(code); emit(0)
@@ -86,6 +88,14 @@ def _compile(code, pattern, flags):
                 _compile(code, av[2], flags)
                 emit(OPCODES[SUCCESS])
                 code[skip] = _len(code) - skip
+            elif op is POSSESSIVE_REPEAT:
+                emit(OPCODES[POSSESSIVE_REPEAT])
+                skip = _len(code); emit(0)
+                emit(av[0])
+                emit(av[1])
+                _compile(code, av[2], flags)
+                code[skip] = _len(code) - skip
+                emit(OPCODES[SUCCESS])
             else:
                 emit(OPCODES[REPEAT])
                 skip = _len(code); emit(0)
@@ -106,6 +116,12 @@ def _compile(code, pattern, flags):
             if av[0]:
                 emit(OPCODES[MARK])
                 emit((av[0]-1)*2+1)
+        elif op is ATOMIC_GROUP:
+            emit(OPCODES[op])
+            skip = _len(code); emit(0)
+            _compile(code, av, flags)
+            emit(OPCODES[SUCCESS])
+            code[skip] = _len(code) - skip
         elif op in SUCCESS_CODES:
             emit(OPCODES[op])
         elif op in ASSERT_CODES:
@@ -363,7 +379,7 @@ def _simple(av):
     lo, hi = av[2].getwidth()
     if lo == 0 and hi == MAXREPEAT:
         raise error("nothing to repeat")
-    return lo == hi == 1 and av[2][0][0] != SUBPATTERN
+    return lo == hi == 1 and av[2][0][0] not in (SUBPATTERN, ATOMIC_GROUP)
 
 def _compile_info(code, pattern, flags):
     # internal: compile an info block.  in the current version,
@@ -13,7 +13,7 @@
 
 # update when constants are added or removed
 
-MAGIC = 20031017
+MAGIC = 20220615
 
 from _gappedbufre import MAXREPEAT
 
@@ -60,6 +60,9 @@ REPEAT = "repeat"
 REPEAT_ONE = "repeat_one"
 SUBPATTERN = "subpattern"
 MIN_REPEAT_ONE = "min_repeat_one"
+ATOMIC_GROUP = "atomic_group"
+POSSESSIVE_REPEAT = "possessive_repeat"
+POSSESSIVE_REPEAT_ONE = "possessive_repeat_one"
 
 # positions
 AT_BEGINNING = "at_beginning"
@@ -121,7 +124,10 @@ OPCODES = [
     REPEAT,
     REPEAT_ONE,
     SUBPATTERN,
-    MIN_REPEAT_ONE
+    MIN_REPEAT_ONE,
+    ATOMIC_GROUP,
+    POSSESSIVE_REPEAT,
+    POSSESSIVE_REPEAT_ONE
 
 ]
 
@@ -113,6 +113,9 @@ class SubPattern:
                         print(level*"  " + "or")
                     a.dump(level+1); nl = 1
                     i = i + 1
+            elif isinstance(av, SubPattern):
+                print(); nl = 1
+                av.dump(level+1)
             elif isinstance(av, seqtypes):
                 for a in av:
                     if isinstance(a, SubPattern):
@@ -145,7 +148,7 @@ class SubPattern:
             return self.width
         lo = hi = 0
         UNITCODES = (ANY, RANGE, IN, LITERAL, NOT_LITERAL, CATEGORY)
-        REPEATCODES = (MIN_REPEAT, MAX_REPEAT)
+        REPEATCODES = (MIN_REPEAT, MAX_REPEAT, POSSESSIVE_REPEAT)
         for op, av in self.data:
             if op is BRANCH:
                 i = sys.maxsize
@@ -164,6 +167,10 @@ class SubPattern:
                 i, j = av[1].getwidth()
                 lo = lo + i
                 hi = hi + j
+            elif op is ATOMIC_GROUP:
+                i, j = av.getwidth()
+                lo = lo + i
+                hi = hi + j
             elif op in REPEATCODES:
                 i, j = av[2].getwidth()
                 lo = lo + int(i) * av[0]
@@ -414,7 +421,7 @@ def _parse_sub_cond(source, state, condgroup):
 _PATTERNENDERS = set("|)")
 _ASSERTCHARS = set("=!<")
 _LOOKBEHINDASSERTCHARS = set("=!")
-_REPEATCODES = set([MIN_REPEAT, MAX_REPEAT])
+_REPEATCODES = set([MIN_REPEAT, MAX_REPEAT, POSSESSIVE_REPEAT])
 
 def _parse(source, state):
     # parse a simple pattern
@@ -559,6 +566,8 @@ def _parse(source, state):
                 raise error("multiple repeat")
             if sourcematch("?"):
                 subpattern[-1] = (MIN_REPEAT, (min, max, item))
+            elif sourcematch("+"):
+                subpattern[-1] = (POSSESSIVE_REPEAT, (min, max, item))
             else:
                 subpattern[-1] = (MAX_REPEAT, (min, max, item))
 
@@ -616,6 +625,13 @@ def _parse(source, state):
                 elif sourcematch(":"):
                     # non-capturing group
                     group = 2
+                elif sourcematch(">"):
+                    # atomic group
+                    p = _parse_sub(source, state)
+                    if not sourcematch(")"):
+                        raise error("unbalanced parenthesis")
+                    subpatternappend((ATOMIC_GROUP, p))
+                    continue
                 elif sourcematch("#"):
                     # comment
                     while 1:
@@ -1,3 +1,4 @@
+import operator
 import kaa
 from kaa.command import Commands, command, is_enable, norec
 from kaa import LOG
@@ -56,7 +57,8 @@ class ScreenCommands(Commands):
 class EditCommands(Commands):
     (UNDO_INSERT,
      UNDO_REPLACE,
-     UNDO_DELETE) = range(3)
+     UNDO_DELETE,
+     UNDO_EDITS) = range(4)
 
     def on_edited(self, wnd):
         pass
@@ -74,8 +76,8 @@ class EditCommands(Commands):
             wnd.cursor.savecol()
 
         if wnd.document.undo:
-            wnd.document.undo.add(self.UNDO_INSERT, pos, s,
-                                  cur_pos, wnd.cursor.pos)
+            wnd.document.undo.add_insert(self.UNDO_INSERT, pos, s,
+                                         cur_pos, wnd.cursor.pos)
 
         self.on_edited(wnd)
 
@@ -113,10 +115,48 @@ class EditCommands(Commands):
                 wnd.cursor.savecol()
 
         if wnd.document.undo:
-            wnd.document.undo.add(self.UNDO_DELETE, pos, posto, deled,
-                                  cur_pos, wnd.cursor.pos)
+            wnd.document.undo.add_delete(self.UNDO_DELETE, pos, posto, deled,
+                                         cur_pos, wnd.cursor.pos)
         self.on_edited(wnd)
 
+    def apply_edits(self, wnd, edits):
+        """Apply list of (pos, posto, s) at once"""
+
+        wnd.screen.selection.clear()
+        cur_pos = wnd.cursor.pos
+
+        edits = sorted(edits, key=operator.itemgetter(0, 1))
+        deled = [wnd.document.gettext(pos, posto) for pos, posto, s in edits]
+        wnd.document.apply_edits(edits)
+
+        # shift cursor by edits before the cursor
+        newpos = cur_pos
+        delta = 0
+        for pos, posto, s in edits:
+            if posto <= cur_pos:
+                newpos = cur_pos + delta + len(s) - (posto-pos)
+            elif pos < cur_pos:
+                newpos = pos + delta + len(s)
+            delta += len(s) - (posto-pos)
+
+        wnd.cursor.setpos(newpos)
+        wnd.cursor.savecol()
+
+        if wnd.document.undo:
+            wnd.document.undo.add(self.UNDO_EDITS, edits, deled,
+                                  cur_pos, newpos)
+
+        self.on_edited(wnd)
+
+    def _revert_edits(self, edits, deled):
+        # Returns edits to restore deleted strings
+        ret = []
+        delta = 0
+        for (pos, posto, s), d in zip(edits, deled):
+            ret.append((pos+delta, pos+delta+len(s), d))
+            delta += len(s) - (posto-pos)
+        return ret
+
     @command('edit.put-string')
     def put_string(self, wnd, s):
         sel = wnd.screen.selection.get_range()
@@ -159,19 +199,26 @@ class EditCommands(Commands):
 
             self.delete_string(wnd, prevpos, pos)
 
-    def _undo(self, wnd, rec):
+    def undo_action(self, doc, rec):
+        """Revert an action recorded in undo history of doc. Returns
+        position of the cursor before the action."""
+
         (action, args, kwargs) = rec
         if action == self.UNDO_INSERT:
             pos, s, cur_pos, newpos = args
-            wnd.document.delete(pos, pos+len(s))
+            doc.delete(pos, pos+len(s))
             return cur_pos
         elif action == self.UNDO_REPLACE:
             pos, posto, s, deled, cur_pos, newpos = args
-            wnd.document.replace(pos, pos+len(s), deled)
+            doc.replace(pos, pos+len(s), deled)
+            return cur_pos
+        elif action == self.UNDO_EDITS:
+            edits, deled, cur_pos, newpos = args
+            doc.apply_edits(self._revert_edits(edits, deled))
             return cur_pos
         else:
             pos, posto, deled, cur_pos, newpos = args
-            wnd.document.insert(pos, deled)
+            doc.insert(pos, deled)
 
         return cur_pos
 
@@ -180,8 +227,10 @@ class EditCommands(Commands):
         if wnd.document.undo.can_undo():
             wnd.screen.selection.clear()
             pos = None
-            for rec in wnd.document.undo.undo():
-                pos = self._undo(wnd, rec)
+            # actions of a block are notified at once
+            with wnd.document.transaction():
+                for rec in wnd.document.undo.undo():
+                    pos = self.undo_action(wnd.document, rec)
 
             if pos is not None:
                 wnd.cursor.setpos(pos)
@@ -189,19 +238,26 @@ class EditCommands(Commands):
 
             self.on_edited(wnd)
 
-    def _redo(self, wnd, rec):
+    def redo_action(self, doc, rec):
+        """Perform an action recorded in undo history of doc again.
+        Returns position of the cursor after the action."""
+
         (action, args, kwargs) = rec
         if action == self.UNDO_INSERT:
             pos, s, cur_pos, newpos = args
-            wnd.document.insert(pos, s)
+            doc.insert(pos, s)
             return newpos
         elif action == self.UNDO_REPLACE:
             pos, posto, s, deled, cur_pos, newpos = args
-            wnd.document.replace(pos, posto, s)
+            doc.replace(pos, posto, s)
             return pos
+        elif action == self.UNDO_EDITS:
+            edits, deled, cur_pos, newpos = args
+            doc.apply_edits(edits)
+            return newpos
         else:
             pos, posto, deled, cur_pos, newpos = args
-            wnd.document.delete(pos, posto)
+            doc.delete(pos, posto)
 
         return newpos
 
@@ -210,8 +266,9 @@ class EditCommands(Commands):
         if wnd.document.undo.can_redo():
             wnd.screen.selection.clear()
             pos = None
-            for rec in wnd.document.undo.redo():
-                pos = self._redo(wnd, rec)
+            with wnd.document.transaction():
+                for rec in wnd.document.undo.redo():
+                    pos = self.redo_action(wnd.document, rec)
 
             if pos is not None:
                 wnd.cursor.setpos(pos)
@@ -286,3 +343,14 @@ class SearchCommands(Commands):
 
         kaa.app.show_inputline(doc)
 
+    @command('search.showgrep')
+    @norec
+    def showgrep(self, wnd):
+        from kaa.ui.grep import grepmode
+
+        buf = document.Buffer()
+        doc = document.Document(buf)
+        doc.setmode(grepmode.GrepDlgMode(target=wnd))
+
+        kaa.app.show_inputline(doc)
+
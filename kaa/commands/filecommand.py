@@ -56,12 +56,20 @@ class FileCommands(Commands):
 
     def ask_doc_close(self, wnd, document, callback):
         def saved():
+           discard_journal()
            callback()
 
+        def discard_journal():
+            # journal is not needed after changes are saved or discarded.
+            if document.undo and document.undo.journal:
+                document.undo.journal.discard()
+                document.undo.journal = None
+
         def choice(c):
             if c == 'y':
                 self.file_save(wnd, saved=saved)
             elif c == 'n':
+                discard_journal()
                 callback()
 
         if document.undo and document.undo.is_dirty():
@@ -70,6 +78,7 @@ class FileCommands(Commands):
                     document.get_filename()),
                 ['&Yes', '&No', '&Cancel'], choice)
         else:
+            discard_journal()
             callback()
 
     def save_documents(self, wnd, docs, callback):
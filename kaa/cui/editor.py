@@ -126,24 +126,43 @@ class TextEditorWindow(Window):
         else:
             selfrom = selto = -1
 
+        # positions in a row are in ascending order, so walk style runs
+        # and search hits along with them.
+        runs = self.document.styles.iter_runs(row.posfrom, row.posto)
+        runend = row.posfrom
+
+        searchindex = self.document.searchindex
+        if searchindex:
+            hits = searchindex.iter_spans(row.posfrom, row.posto)
+        else:
+            hits = iter(())
+        hitfrom, hitto = next(hits, (-1, -1))
+
         for pos in row.positions:
             attr = 0
             if selfrom <= pos < selto:
                 attr = curses.A_REVERSE
 
-            color = kaa.app.colors.get_color(
-                ColorName.DEFAULT,
-                ColorName.DEFAULT)
-
-            tokenid = self.document.styles.getints(pos, pos+1)[0]
-
-            if self.document.mode.highlight:
-                style = self.document.mode.get_style(tokenid)
-                color = style.cui_colorattr
-                if style.underline:
-                    color += curses.A_UNDERLINE
-                if style.bold:
-                    color += curses.A_BOLD
+            while hitto <= pos and hitfrom != -1:
+                hitfrom, hitto = next(hits, (-1, -1))
+            if hitfrom <= pos < hitto:
+                attr |= curses.A_UNDERLINE
+
+            if pos >= runend:
+                while pos >= runend:
+                    runbegin, runend, tokenid = next(runs)
+
+                color = kaa.app.colors.get_color(
+                    ColorName.DEFAULT,
+                    ColorName.DEFAULT)
+
+                if self.document.mode.highlight:
+                    style = self.document.mode.get_style(tokenid)
+                    color = style.cui_colorattr
+                    if style.underline:
+                        color += curses.A_UNDERLINE
+                    if style.bold:
+                        color += curses.A_BOLD
 
             yield (color + attr, style.rjust)
 
@@ -1,4 +1,14 @@
+import os
+import sys
+import mmap
+import time
+import bisect
+import codecs
 import weakref
+import array
+import contextlib
+import operator
+import collections.abc
 import gappedbuf
 
 
@@ -10,37 +20,272 @@ def is_combine(c):
 
         return True
 
-class Buffer(gappedbuf.GappedBuffer):
+class _BufferMixin:
+    """Notifies listeners when the text is updated.
+    Used with GappedBuffer and RopeBuffer.
+
+    Listeners are called with the buffer and a list of (pos, inslen,
+    dellen) of the edits, from the top and at the position shifted by
+    the preceding edits."""
+
     def __init__(self):
         self.listeners = []
+        self.lines = gappedbuf.LineIndex()
 
     def close(self):
         del self.listeners
 
     def insert(self, index, s):
         super().insert(index, s)
-        self._updated(index, len(s), 0)
+        self.lines.inserted(index, s)
+        self._updated([(index, len(s), 0)])
 
     def delete(self, begin, end):
         super().delete(begin, end)
-        self._updated(begin, 0, end-begin)
+        self.lines.deleted(begin, end)
+        self._updated([(begin, 0, end-begin)])
 
     def replace(self, begin, end, s):
         super().replace(begin, end, s)
-        self._updated(begin, len(s), end-begin)
-    
+        self.lines.deleted(begin, end)
+        self.lines.inserted(begin, s)
+        self._updated([(begin, len(s), end-begin)])
+
+    def apply_edits(self, edits):
+        """Apply list of (begin, end, s). Edits should not overlap each
+        other. Listeners are notified once of all edits after they are
+        applied."""
+
+        edits = sorted(edits, key=operator.itemgetter(0, 1))
+        if not edits:
+            return
+
+        super().apply_edits(edits)
+
+        delta = 0
+        deltas = []
+        for begin, end, s in edits:
+            self.lines.deleted(begin+delta, end+delta)
+            self.lines.inserted(begin+delta, s)
+            deltas.append((begin+delta, len(s), end-begin))
+            delta += len(s) - (end-begin)
+        self._updated(deltas)
+
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+    def _updated(self, deltas):
+        for listener in self.listeners:
+            listener(self, deltas)
+
+class Buffer(_BufferMixin, gappedbuf.GappedBuffer):
+    """Text buffer stored in a gap buffer. Edits near the previous edit
+    are fast."""
+
+class RopeBuffer(_BufferMixin, gappedbuf.RopeBuffer):
+    """Text buffer stored in a rope. Edits at distant places are fast."""
+
+# Number of bytes of a file decoded at a time by MappedBuffer.
+MAPPED_PAGESIZE = 64*1024
+
+class MappedBuffer(gappedbuf.PagedBuffer):
+    """Read-only text of a file mapped to memory.
+
+    The file is decoded page by page when the text is read, and only
+    recently read pages are kept in memory, so the encoding should be
+    one supports() accepts. Newlines are translated to '\\n' as files
+    opened to edit. Positions of characters and lines are known only for
+    pages indexed by index(), so the text grows as the file is indexed
+    from the top.
+    """
+
+    INDEX_TIME = 0.05    # seconds spent by each index() call
+
+    def __init__(self, filename, encoding='utf-8'):
+        if not self.supports(encoding):
+            raise ValueError(
+                'encoding cannot be decoded by page: {}'.format(encoding))
+        self.encoding = codecs.lookup(encoding).name
+
+        self.listeners = []
+        self.lines = _MappedLines(self)
+        self.pagesize = MAPPED_PAGESIZE
+
+        # offset in the file and number of newlines before each page.
+        self.filepos = array.array('q', [0])
+        self.linepos = array.array('q', [0])
+
+        with open(filename, 'rb') as f:
+            self.filesize = os.fstat(f.fileno()).st_size
+            if self.filesize:
+                self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                self.mmap = b''
+
+        # index the first page to show top of the file immediately.
+        self.index(maxpages=1)
+
+    def close(self):
+        del self.listeners
+        if self.filesize:
+            self.mmap.close()
+
+    @staticmethod
+    def supports(encoding):
+        """Returns True if files in encoding can be decoded page by page:
+        UTF-8, or ASCII compatible encoding with a character per byte."""
+
+        try:
+            encoding = codecs.lookup(encoding).name
+        except LookupError:
+            return False
+        if encoding == 'utf-8':
+            return True
+
+        b = bytes(range(256))
+        try:
+            if b[:128].decode(encoding) != b[:128].decode('ascii'):
+                return False
+            chars = [b[i:i+1].decode(encoding, 'surrogateescape')
+                     for i in range(256)]
+        except (LookupError, UnicodeError):
+            # not a text encoding, or not ASCII compatible
+            return False
+        return (all(len(c) == 1 for c in chars) and
+                ''.join(chars) == b.decode(encoding, 'surrogateescape'))
+
     def add_listener(self, listener):
         self.listeners.append(listener)
 
-    def _updated(self, pos, inslen, dellen):
+    def _updated(self, deltas):
         for listener in self.listeners:
-            listener(self, pos, inslen, dellen)
+            listener(self, deltas)
+
+    def _decode(self, b):
+        text = b.decode(self.encoding, 'surrogateescape')
+        if '\r' in text:
+            text = text.replace('\r\n', '\n').replace('\r', '\n')
+        return text
+
+    def _getpageend(self, begin):
+        # Pages of UTF-8 end before the first byte of a sequence. Pages
+        # don't split CRLF.
+        mm = self.mmap
+        end = min(begin+self.pagesize, self.filesize)
+        for i in range(3):
+            if (self.encoding != 'utf-8' or end == self.filesize
+                    or (mm[end] & 0xc0) != 0x80):
+                break
+            end += 1
+
+        if (end < self.filesize and mm[end-1] == ord('\r')
+                and mm[end] == ord('\n')):
+            end += 1
+        return end
+
+    def index(self, maxpages=None):
+        """Index pages after the indexed part of the file for INDEX_TIME
+        seconds or until maxpages pages are indexed, and notify listeners
+        as if the text of the pages is appended. Returns True if the
+        file is not indexed to the end yet."""
+
+        deadline = time.perf_counter() + self.INDEX_TIME
+        oldlen = len(self)
+        numpages = 0
+        while self.filepos[-1] < self.filesize:
+            begin = self.filepos[-1]
+            end = self._getpageend(begin)
+
+            b = self.mmap[begin:end]
+            if b.isascii() and b'\r' not in b:
+                size, numlines = len(b), b.count(b'\n')
+            else:
+                text = self._decode(b)
+                size, numlines = len(text), text.count('\n')
+
+            self.filepos.append(end)
+            self.linepos.append(self.linepos[-1] + numlines)
+            self.addpage(size)
+
+            numpages += 1
+            if numpages == maxpages or time.perf_counter() > deadline:
+                break
+
+        if len(self) != oldlen:
+            self._updated([(oldlen, len(self)-oldlen, 0)])
+        return self.filepos[-1] < self.filesize
+
+    def loadpage(self, n):
+        return self._decode(self.mmap[self.filepos[n]:self.filepos[n+1]])
+
+
+class _MappedLines:
+    """Line index of MappedBuffer. Lines are counted in the page at the
+    position, from the number of newlines before the page."""
+
+    def __init__(self, buf):
+        self.buf = buf
+
+    def linecount(self):
+        return self.buf.linepos[-1] + 1
+
+    def pos_to_line(self, pos):
+        buf = self.buf
+        if not (0 <= pos <= len(buf)):
+            raise ValueError('Invalid index value')
+
+        if pos == len(buf):
+            return buf.linepos[-1]
+
+        n = buf.pageno(pos)
+        return buf.linepos[n] + buf.getpage(n).count(
+            '\n', 0, pos-buf.pagepos[n])
+
+    def line_to_pos(self, lineno):
+        buf = self.buf
+        if not (0 <= lineno <= buf.linepos[-1]):
+            raise IndexError('line number out of range')
+
+        if lineno == 0:
+            return 0
+
+        # find the page which contains (lineno-1)'th newline
+        n = bisect.bisect_left(buf.linepos, lineno) - 1
+        text = buf.getpage(n)
+        p = -1
+        for i in range(lineno - buf.linepos[n]):
+            p = text.index('\n', p+1)
+        return buf.pagepos[n] + p + 1
+
+    def gettol(self, pos):
+        return self.line_to_pos(self.pos_to_line(pos))
+
+    def geteol(self, pos):
+        lineno = self.pos_to_line(pos)
+        if lineno == self.buf.linepos[-1]:
+            return len(self.buf)
+        return self.line_to_pos(lineno+1)
+
+
+def _merge_updates(update, pos, inslen, dellen):
+    # Returns tuple of (pos, inslen, dellen) to update the range of
+    # update and the range from pos, as a single update.
+    if not update:
+        return (pos, inslen, dellen)
+
+    f, i, d = update
+    newpos = min(f, pos)
+    end = max(f+i, pos+dellen)    # end of updated range before this update
+    return (newpos, end+inslen-dellen-newpos, end-(i-d)-newpos)
+
 
 class Document:
     all = weakref.WeakSet()  # should not be used!
 
     closed = False
     fileinfo = None
+    _transactions = 0   # depth of nested transactions
+    _pending = None     # update to be notified at end of transaction
     def __init__(self, buf):
         self.wnds = []
         self.all.add(self)
@@ -48,13 +293,13 @@ class Document:
         self.buf = buf
         self.buf.add_listener(self.updated)
 
-        self.styles = gappedbuf.GappedBuffer()
-        if len(self.buf):
-            self.styles.insertints(0, [0]*len(self.buf))
+        self.styles = gappedbuf.StyleRuns()
+        self.styles.inserted(0, len(self.buf))
 
         self.undo = Undo()
         self.marks = Marks()
         self.mode = None
+        self.searchindex = None
 
         self.title = 'untitled'
 
@@ -73,7 +318,7 @@ class Document:
         self.mode.close()
         self.buf.close()
 
-        self.marks = self.buf = self.mode = None
+        self.marks = self.buf = self.mode = self.searchindex = None
 
     def get_title(self):
         if self.fileinfo:
@@ -95,24 +340,57 @@ class Document:
         self.mode = mode
         mode.on_set_document(self)
 
-    def updated(self, buf, pos, inslen, dellen):
-        """Called when document updated"""
+    @contextlib.contextmanager
+    def transaction(self):
+        """Context manager to defer notification of updates to the
+        highlighter, windows, search index and mode until the outermost
+        transaction ends. Updates in the transaction are notified at once
+        as an update of the range covering them.
+
+        Styles and marks are updated on each edit, and the layout of
+        windows is stale until the transaction ends.
+        """
+
+        self._transactions += 1
+        try:
+            yield
+        finally:
+            self._transactions -= 1
+            if not self._transactions and self._pending:
+                pending, self._pending = self._pending, None
+                self._notify_updated(*pending)
+
+    def updated(self, buf, deltas):
+        """Called when document updated. deltas is a list of (pos,
+        inslen, dellen) of edits from the top, at the position shifted by
+        the preceding edits."""
+
+        # deltas are sorted, so the gaps of styles and marks move only
+        # forward and each is updated in a single pass.
+        update = self._pending
+        for pos, inslen, dellen in deltas:
+            # inserted characters take style of the preceding character.
+            self.styles.deleted(pos, pos+dellen)
+            self.styles.inserted(pos, inslen)
+
+            self.marks.updated(pos, inslen, dellen)
+            update = _merge_updates(update, pos, inslen, dellen)
+
+        if self._transactions:
+            self._pending = update
+        else:
+            self._notify_updated(*update)
 
+    def _notify_updated(self, pos, inslen, dellen):
         if self.mode.highlight:
             self.mode.highlight.updated(self, pos, inslen, dellen)
 
-        if inslen:
-            style = 0
-            if 0 < pos <= len(self.styles):
-                style = self.styles.getints(pos-1, pos)[0]
-            self.styles.replaceints(pos, pos+dellen, [style]*inslen)
-        else:
-            self.styles.delete(pos, pos+dellen)
-
-        self.marks.updated(pos, inslen, dellen)
         for wnd in self.wnds:
             wnd.on_document_updated(pos, inslen, dellen)
 
+        if self.searchindex:
+            self.searchindex.updated(pos, inslen, dellen)
+
         self.mode.on_document_updated(pos, inslen, dellen)
 
     def style_updated(self, posfrom, posto):
@@ -126,41 +404,43 @@ class Document:
     def gettol(self, pos):
         """Returns top of line at pos"""
 
-        if pos == 0:
-            return 0
-        tol = self.buf.rfindchr('\n', 0, pos)
-        return 0 if tol == -1 else tol+1
+        return self.buf.lines.gettol(pos)
    
-    def _findeol(self, pos):
-        """Find next occurrence of newline"""
-
-        eol = self.buf.findchr('\n', pos, len(self.buf))
-        if eol != -1:
-            eol += 1
-        return eol
-
     def geteol(self, pos):
         """Returns end of line at pos"""
 
-        eol = self._findeol(pos)
-        if eol == -1:
-            eol = len(self.buf)
-        return eol
+        return self.buf.lines.geteol(pos)
+
+    def getlineno(self, pos):
+        """Returns line number at pos. Line number starts from 0."""
+
+        return self.buf.lines.pos_to_line(pos)
+
+    def getlinepos(self, lineno):
+        """Returns top of line of lineno"""
+
+        return self.buf.lines.line_to_pos(lineno)
+
+    def linecount(self):
+        """Returns number of lines in the document"""
+
+        return self.buf.lines.linecount()
 
     def gettext(self, begin, end):
         return self.buf[begin:end]
 
     def get_styles(self, begin, end):
-        return self.styles.getints(begin, end)
+        """Returns array of token ids from begin to end"""
+
+        ret = array.array('I', [0]) * (end-begin)
+        self.styles.getints_into(begin, end, ret)
+        return ret
 
     def getline(self, pos):
         """Returns tuple of eol and string"""
 
-        eol = self._findeol(pos)
-        if eol == -1:
-            return (len(self.buf), self.buf[pos:])
-        else:
-            return (eol, self.buf[pos:eol])
+        eol = self.geteol(pos)
+        return (eol, self.buf[pos:eol])
 
     def insert(self, pos, s):
         self.buf.insert(pos, s)
@@ -174,6 +454,12 @@ class Document:
     def replace(self, begin, end, s):
         self.buf.replace(begin, end, s)
 
+    def apply_edits(self, edits):
+        """Apply list of (begin, end, s) at once. Windows and the mode are
+        notified once of the range covering the edits."""
+
+        self.buf.apply_edits(edits)
+
     def get_nextpos(self, pos):
         pos += 1
         while pos < self.endpos():
@@ -192,8 +478,82 @@ class Document:
 
 
 
-class Marks(dict):
+class Marks(collections.abc.MutableMapping):
+    """Named positions in the document. Value of a mark is a position,
+    a tuple of (begin, end) or None.
+
+    Positions are stored in gappedbuf.MarkIndex sorted by position, so
+    an edit does not update each mark. End of a (begin, end) mark is
+    moved by insertion at the end, so text appended to the range is
+    included in the range.
+    """
+
     locked = False
+
+    def __init__(self):
+        self._index = gappedbuf.MarkIndex()
+        self._marks = {}    # name -> id, tuple of ids or None
+        self._names = {}    # id -> name
+
+    def __getitem__(self, name):
+        markid = self._marks[name]
+        if isinstance(markid, tuple):
+            f, t = markid
+            return (self._index.get(f), self._index.get(t))
+        if markid is not None:
+            return self._index.get(markid)
+
+    def __setitem__(self, name, markpos):
+        if name in self._marks:
+            del self[name]
+
+        if isinstance(markpos, int):
+            markid = self._add(name, markpos)
+        elif markpos is not None:
+            f, t = markpos
+            markid = (self._add(name, f), self._add(name, t, sticky=True))
+        else:
+            markid = None
+        self._marks[name] = markid
+
+    def _add(self, name, pos, sticky=False):
+        markid = self._index.add(pos, sticky)
+        self._names[markid] = name
+        return markid
+
+    def __delitem__(self, name):
+        markid = self._marks.pop(name)
+        if markid is not None:
+            for i in (markid if isinstance(markid, tuple) else (markid,)):
+                self._index.remove(i)
+                del self._names[i]
+
+    def __iter__(self):
+        return iter(self._marks)
+
+    def __len__(self):
+        return len(self._marks)
+
+    def __contains__(self, name):
+        return name in self._marks
+
+    def __repr__(self):
+        return '{}({!r})'.format(self.__class__.__name__, dict(self))
+
+    def find(self, begin, end):
+        """Returns list of names of marks from begin to end, inclusive,
+        in order of position. A (begin, end) mark is found if either of
+        its ends is in the range."""
+
+        ret = []
+        found = set()
+        for pos, markid in self._index.iter_marks(begin, end):
+            name = self._names[markid]
+            if name not in found:
+                found.add(name)
+                ret.append(name)
+        return ret
+
     def updated(self, pos, inslen, dellen):
 
         # don't update mark if locked
@@ -201,100 +561,367 @@ class Marks(dict):
             return
 
         size = inslen - dellen
-        if size == 0:
-            return
-        elif size > 0:
-            for name, markpos in self.items():
-                if isinstance(markpos, int):
-                    if pos < markpos:
-                        self[name] = markpos+size
-                elif markpos is not None:
-                    f, t = markpos
-                    if pos < f:
-                        f = f + size
-                    if pos <= t:
-                        t = t + size
-                    self[name] = (f, t)
-
-#            updated = ((name, markpos+size) for name, markpos in self.items()
-#                            if (markpos is not None) and (pos < markpos))
+        if size > 0:
+            self._index.inserted(pos, size)
         elif size < 0:
-            size = abs(size)
-            for name, markpos in self.items():
-                if isinstance(markpos, int):
-                    if pos < markpos:
-                        if pos+size > markpos:
-                            self[name] = pos
-                        else:
-                            self[name] = markpos-size
-                elif markpos is not None:
-                    f, t = markpos
-                    if pos < f:
-                        if pos+size > f:
-                            f = pos
-                        else:
-                            f = f-size
-                    if pos < t:
-                        if pos+size > t:
-                            t = pos
-                        else:
-                            t = t-size
-                    self[name] = (f, t)
-
-
-
-#            updated = ((name, pos if (pos+size > markpos) else (markpos-size))
-#                            for name, markpos in self.items()
-#                                if (markpos is not None) and (pos < markpos))
-
-#        for name, p in updated:
-#            self[name] = p
+            self._index.deleted(pos, pos-size)
+
+
+# Max size of the undo history of a document in bytes. The oldest
+# actions are dropped when the history grows larger than this.
+UNDO_MAXSIZE = 64*1024*1024
+
+
+def _getsize(obj):
+    # Returns approximate size of obj and objects in it.
+    size = sys.getsizeof(obj)
+    if isinstance(obj, (tuple, list)):
+        size += sum(_getsize(o) for o in obj)
+    elif isinstance(obj, dict):
+        size += sum(_getsize(k) + _getsize(v) for k, v in obj.items())
+    return size
+
 
 class Undo:
-    """Records edit history"""
+    """Records edit history
 
-    def __init__(self):
+    Insertions and deletions added by add_insert() and add_delete() are
+    packed into an array of integers, and their text is stored in a
+    bytearray shared by all records. Adjacent insertions or deletions
+    are merged into a record until a line break. Other actions are kept
+    as they are added.
+
+    If the history grows larger than maxsize bytes, the oldest actions
+    are dropped.
+
+    If journal is set, actions are written to the journal as they are
+    added, undone and redone (see kaa.journal).
+    """
+
+    journal = None
+
+    # fields of a record in _recs
+    (_KIND, _ACTION, _POS, _POSTO, _TEXTEND, _CURPOS, _NEWPOS) = range(7)
+    _RECSIZE = 7
+
+    # kinds of record. _ACTION of insertion and deletion is an index of
+    # _actiontypes. _POS of an object record is a key of _objects and
+    # _POSTO is the size of the object.
+    (_OBJECT, _INSERT, _DELETE) = range(3)
+
+    def __init__(self, maxsize=None):
+        self.maxsize = UNDO_MAXSIZE if maxsize is None else maxsize
         self.clear()
 
     def clear(self):
-        self._actions = []      # edit operations
+        self._recs = array.array('q')   # edit operations
+        self._text = bytearray()        # text of records in utf-8
+        self._textbase = 0      # offset of the first record's text
+        self._objects = {}      # actions other than insertion and deletion
+        self._actiontypes = []  # actions of insertion and deletion
+        self._objsize = 0       # total size of _objects
+        self._nextkey = 0       # key of the next object
+        self._dropped = 0       # number of actions dropped
         self._closed = False    # Closed group undo block
         self._saved = 0         # position when document saved
         self._next_undo = 0     # undo action to be executed at next
 
+    def _count(self):
+        return len(self._recs) // self._RECSIZE
+
+    def _getrec(self, n):
+        return self._recs[n*self._RECSIZE:(n+1)*self._RECSIZE]
+
+    def _setfield(self, n, field, value):
+        self._recs[n*self._RECSIZE+field] = value
+
+    def _textbegin(self, n):
+        # Returns offset of text of n'th record. Text of the first record
+        # starts at _textbase, and _text[0] is at _textbase.
+        if n:
+            return self._recs[(n-1)*self._RECSIZE+self._TEXTEND]
+        return self._textbase
+
+    def _gettext(self, n):
+        begin = self._textbegin(n) - self._textbase
+        end = self._recs[n*self._RECSIZE+self._TEXTEND] - self._textbase
+        return self._text[begin:end].decode('utf-8', 'surrogatepass')
+
+    def _getaction(self, n):
+        kind, action, pos, posto, textend, cur_pos, newpos = self._getrec(n)
+        if kind == self._OBJECT:
+            return self._objects[pos]
+
+        action = self._actiontypes[action]
+        if kind == self._INSERT:
+            return (action, (pos, self._gettext(n), cur_pos, newpos), {})
+        else:
+            return (action, (pos, posto, self._gettext(n), cur_pos, newpos),
+                    {})
+
+    def _openblock(self):
+        # Returns the last action if it is an open group undo block.
+        if self._recs:
+            rec = self._getrec(self._count()-1)
+            if rec[self._KIND] == self._OBJECT:
+                action, args, kwargs = self._objects[rec[self._POS]]
+                if isinstance(action, Undo) and not action._closed:
+                    return action
+
     def _getblock(self):
-        if self._actions:
-            action, args, kwargs = self._actions[-1]
-            if isinstance(action, Undo) and not action._closed:
-                return action._getblock()
-        return self
+        block = self
+        while True:
+            child = block._openblock()
+            if child is None:
+                return block
+            block = child
+
+    def _write(self, *record):
+        if self.journal:
+            self.journal.write(*record)
 
     def beginblock(self):
         """Begin group undo block"""
 
         block = self._getblock()
         block._add(Undo())
+        self._write('begin')
 
     def endblock(self):
         """End current group undo block"""
 
-        block = self._getblock()
+        parent, block = None, self
+        while True:
+            child = block._openblock()
+            if child is None:
+                break
+            parent, block = block, child
+
         assert block is not self
+        parent._closeblock(block)
+        self._write('end')
+        self._trim()
+
+    def _closeblock(self, block):
+        # Close the last action and count its size.
         block._closed = True
+        size = block.getsize()
+        self._objsize += size
+        self._setfield(self._count()-1, self._POSTO, size)
 
-    def _add(self, action, *args, **kwargs):
+    def _truncate(self):
         # Can not redo thereafter
-        del self._actions[self._next_undo:]
-        if self._saved > len(self._actions):
+        n = self._next_undo
+        if n < self._count():
+            for i in range(n, self._count()):
+                rec = self._getrec(i)
+                if rec[self._KIND] == self._OBJECT:
+                    del self._objects[rec[self._POS]]
+                    self._objsize -= rec[self._POSTO]
+            del self._text[self._textbegin(n)-self._textbase:]
+            del self._recs[n*self._RECSIZE:]
+
+        if self._saved > n:
             self._saved = -1
 
-        self._actions.append((action, args, kwargs))
-        self._next_undo = len(self._actions)
+    def _getactiontype(self, action):
+        # Returns index of action in _actiontypes.
+        if action not in self._actiontypes:
+            self._actiontypes.append(action)
+        return self._actiontypes.index(action)
+
+    def _append(self, kind, action, pos, posto, text, cur_pos, newpos):
+        self._truncate()
+        self._text += text
+        self._recs.extend((kind, action, pos, posto,
+                           self._textbase + len(self._text),
+                           cur_pos, newpos))
+        self._next_undo = self._count()
+
+    def _add(self, action, *args, **kwargs):
+        key = self._nextkey
+        self._nextkey += 1
+        self._objects[key] = (action, args, kwargs)
+
+        # size of a block is added when the block is closed.
+        size = 0 if isinstance(action, Undo) else _getsize((args, kwargs))
+        self._objsize += size
+
+        self._append(self._OBJECT, 0, key, size, b'', 0, 0)
 
     def add(self, action, *args, **kwargs):
         """Add edit action"""
 
         self._getblock()._add(action, *args, **kwargs)
+        self._write('add', action, args, kwargs)
+        self._trim()
+
+    def _mergeable(self, kind, action):
+        # Returns the last record if an action can be merged to it.
+        n = self._next_undo
+        if not n or n != self._count() or self._saved == n:
+            return None
+
+        rec = self._getrec(n-1)
+        if rec[self._KIND] != kind or rec[self._ACTION] != action:
+            return None
+
+        # don't merge across a line break.
+        if self._text.find(b'\n', self._textbegin(n-1)-self._textbase) != -1:
+            return None
+        return rec
+
+    def _add_insert(self, action, pos, s, cur_pos, newpos):
+        action = self._getactiontype(action)
+        text = s.encode('utf-8', 'surrogatepass')
+        rec = self._mergeable(self._INSERT, action)
+        if rec and rec[self._POSTO] == pos:
+            n = self._count() - 1
+            self._text += text
+            self._setfield(n, self._POSTO, pos+len(s))
+            self._setfield(n, self._TEXTEND, rec[self._TEXTEND]+len(text))
+            self._setfield(n, self._NEWPOS, newpos)
+        else:
+            self._append(self._INSERT, action, pos, pos+len(s), text,
+                         cur_pos, newpos)
+
+    def add_insert(self, action, pos, s, cur_pos, newpos):
+        """Add action to insert s at pos. The action is performed as
+        (action, (pos, s, cur_pos, newpos), {}), and merged with the last
+        insertion if s is inserted at the end of it."""
+
+        self._getblock()._add_insert(action, pos, s, cur_pos, newpos)
+        self._write('insert', action, pos, s, cur_pos, newpos)
+        self._trim()
+
+    def _add_delete(self, action, pos, posto, deled, cur_pos, newpos):
+        action = self._getactiontype(action)
+        text = deled.encode('utf-8', 'surrogatepass')
+        rec = self._mergeable(self._DELETE, action)
+        n = self._count() - 1
+        if rec and rec[self._POS] == pos:
+            # deleted forward
+            self._text += text
+            self._setfield(n, self._POSTO, rec[self._POSTO]+posto-pos)
+        elif rec and rec[self._POS] == posto:
+            # deleted backward
+            begin = self._textbegin(n) - self._textbase
+            self._text[begin:begin] = text
+            self._setfield(n, self._POS, pos)
+        else:
+            self._append(self._DELETE, action, pos, posto, text,
+                         cur_pos, newpos)
+            return
+
+        self._setfield(n, self._TEXTEND, rec[self._TEXTEND]+len(text))
+        self._setfield(n, self._NEWPOS, newpos)
+
+    def add_delete(self, action, pos, posto, deled, cur_pos, newpos):
+        """Add action to delete deled from pos to posto. The action is
+        performed as (action, (pos, posto, deled, cur_pos, newpos), {}),
+        and merged with the last deletion if the range is adjacent to
+        it."""
+
+        self._getblock()._add_delete(action, pos, posto, deled,
+                                     cur_pos, newpos)
+        self._write('delete', action, pos, posto, deled, cur_pos, newpos)
+        self._trim()
+
+    def getsize(self):
+        """Returns approximate size of the history in bytes"""
+
+        return (len(self._recs) * self._recs.itemsize + len(self._text) +
+                self._objsize)
+
+    def _trim(self):
+        # Drop the oldest actions to make the history smaller than 3/4 of
+        # maxsize, if it exceeds maxsize.
+        size = self.getsize()
+        if size <= self.maxsize:
+            return
+
+        limit = self._next_undo
+        if self._openblock():
+            limit = min(limit, self._count()-1)
+
+        n = 0
+        textend = self._textbase
+        while n < limit and size > self.maxsize * 3 // 4:
+            rec = self._getrec(n)
+            size -= len(rec) * self._recs.itemsize
+            size -= rec[self._TEXTEND] - textend
+            textend = rec[self._TEXTEND]
+            if rec[self._KIND] == self._OBJECT:
+                del self._objects[rec[self._POS]]
+                self._objsize -= rec[self._POSTO]
+                size -= rec[self._POSTO]
+            n += 1
+
+        del self._text[:textend-self._textbase]
+        del self._recs[:n*self._RECSIZE]
+        self._textbase = textend
+        self._next_undo -= n
+        self._saved = self._saved - n if self._saved >= n else -1
+        self._dropped += n
+
+    def stats(self):
+        """Returns dict of statistics of the history"""
+
+        return {
+            'actions': self._count(),
+            'dropped': self._dropped,
+            'textsize': len(self._text),
+            'size': self.getsize(),
+        }
+
+    def getstate(self):
+        """Returns the history as a list of lists, strings and numbers to
+        be restored by setstate()"""
+
+        actions = []
+        for n in range(self._count()):
+            kind = self._getrec(n)[self._KIND]
+            action, args, kwargs = self._getaction(n)
+            if isinstance(action, Undo):
+                actions.append(['block', action.getstate()])
+            elif kind == self._INSERT:
+                actions.append(['insert', action, args])
+            elif kind == self._DELETE:
+                actions.append(['delete', action, args])
+            else:
+                actions.append(['add', action, args, kwargs])
+        return [actions, self._next_undo, self._saved, self._closed]
+
+    def setstate(self, state):
+        """Restore the history returned by getstate()"""
+
+        actions, next_undo, saved, closed = state
+        self.clear()
+        for op, action, *args in actions:
+            if op == 'block':
+                block = Undo()
+                block.setstate(action)
+                self._add(block)
+                if block._closed:
+                    self._closeblock(block)
+            elif op == 'insert':
+                pos, s, cur_pos, newpos = args[0]
+                self._append(self._INSERT, self._getactiontype(action),
+                             pos, pos+len(s),
+                             s.encode('utf-8', 'surrogatepass'),
+                             cur_pos, newpos)
+            elif op == 'delete':
+                pos, posto, deled, cur_pos, newpos = args[0]
+                self._append(self._DELETE, self._getactiontype(action),
+                             pos, posto,
+                             deled.encode('utf-8', 'surrogatepass'),
+                             cur_pos, newpos)
+            else:
+                self._add(action, *args[0], **args[1])
+
+        self._next_undo = next_undo
+        self._saved = saved
+        self._closed = closed
 
     def saved(self):
         """Notifies document saved"""
@@ -314,13 +941,14 @@ class Undo:
     def can_redo(self):
         """Returns True if redo action is not exhausted"""
 
-        return self._next_undo < len(self._actions)
+        return self._next_undo < self._count()
 
     def undo(self):
         """Performe undo action"""
 
-        action, args, kwargs = self._actions[self._next_undo-1]
+        action, args, kwargs = self._getaction(self._next_undo-1)
         self._next_undo -= 1
+        self._write('undo')
 
         if isinstance(action, Undo):
             yield from action.undo_all()
@@ -334,8 +962,9 @@ class Undo:
     def redo(self):
         """Performe redo action"""
 
-        action, args, kwargs = self._actions[self._next_undo]
+        action, args, kwargs = self._getaction(self._next_undo)
         self._next_undo += 1
+        self._write('redo')
         if isinstance(action, Undo):
             yield from action.redo_all()
         else:
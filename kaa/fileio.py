@@ -1,7 +1,14 @@
-import os, importlib, unicodedata, sys
+import os, importlib, unicodedata, sys, locale
 import kaa
-from kaa import LOG, document
+from kaa import LOG, document, journal
 from kaa.filetype.default import defaultmode
+from kaa.ui.msgbox import msgboxmode
+from kaa.ui.viewer import viewmode
+
+# Files larger than this are opened read-only in ViewMode, without
+# reading whole the file into memory, if the locale encoding can be
+# decoded page by page.
+VIEW_FILESIZE = 64*1024*1024
 
 class FileStorage:
     def get_textio(self, *args, **kwargs):
@@ -15,7 +22,7 @@ class FileStorage:
         dirname, filename = os.path.split(filename)
         ret = FileInfo(self, fullpath, dirname, filename)
         try:
-            ret.stat = os.stat(filename)
+            ret.stat = os.stat(fullpath)
         except FileNotFoundError:
             ret.stat = None
         return ret
@@ -23,16 +30,39 @@ class FileStorage:
     def listdir(self, dirname):
         dirs = []
         files = []
-        for name in os.listdir(dirname):
-            if os.path.isdir(os.path.join(dirname, name)):
-                dirs.append(name)
-            else:
-                files.append(name)
+        # scandir() tells type of entries without stat() on most systems.
+        with os.scandir(dirname) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    dirs.append(entry.name)
+                else:
+                    files.append(entry.name)
         if sys.platform == 'darwin':
             dirs = [unicodedata.normalize('NFC', n) for n in dirs]
             files = [unicodedata.normalize('NFC', n) for n in files]
         return dirs, files
 
+    def walk(self, dirname):
+        """Yields path of each file under dirname. Hidden directories,
+        symbolic links to directories and directories which cannot be
+        read are skipped."""
+
+        stack = [dirname]
+        while stack:
+            dirname = stack.pop()
+            try:
+                dirs, files = self.listdir(dirname)
+            except OSError:
+                continue
+
+            for name in sorted(files):
+                yield os.path.join(dirname, name)
+
+            for name in sorted(dirs, reverse=True):
+                path = os.path.join(dirname, name)
+                if not name.startswith('.') and not os.path.islink(path):
+                    stack.append(path)
+
     def openfile(self, filename):
         return openfile(filename)
 
@@ -41,6 +71,7 @@ class FileStorage:
         doc.fileinfo = self.get_fileinfo(filename)
         if doc.undo:
             doc.undo.saved()
+            start_journal(doc)
         mode = select_mode(filename)
         if doc.mode is not mode:
             doc.setmode(mode())
@@ -89,6 +120,14 @@ def openfile(filename):
 
     fileinfo = kaa.app.storage.get_fileinfo(filename)
 
+    note = ''
+    if fileinfo.stat and fileinfo.stat.st_size > VIEW_FILESIZE:
+        # encoding=None below reads the file in the locale encoding.
+        encoding = locale.getpreferredencoding(False)
+        if document.MappedBuffer.supports(encoding):
+            return openview(fileinfo, encoding)
+        note = '. Large files in {} are read into memory'.format(encoding)
+
     # use surrogateescape to preserve file contents intact.
     textio = kaa.app.storage.get_textio(fileinfo.fullpathname, 'r', encoding=None,
                                 errors='surrogateescape', newline=None)
@@ -101,11 +140,68 @@ def openfile(filename):
     doc = document.Document(buf)
     doc.setmode(select_mode(filename)())
     doc.fileinfo = fileinfo
+    open_journal(doc)
 
     dir, file = os.path.split(fileinfo.fullpathname)
     if not dir.endswith(os.path.sep):
         dir += os.path.sep
 
-    kaa.app.messagebar.set_message('Read from {}({})'.format(file, dir))
+    kaa.app.messagebar.set_message(
+        'Read from {}({}){}'.format(file, dir, note))
 
     return doc
+
+
+def openview(fileinfo, encoding):
+    """Open a file read-only. The file is mapped to memory and indexed in
+    idle time, so the top of the file is shown at once."""
+
+    buf = document.MappedBuffer(fileinfo.fullpathname, encoding)
+    doc = document.Document(buf)
+    doc.setmode(viewmode.ViewMode())
+    doc.fileinfo = fileinfo
+
+    dir, file = os.path.split(fileinfo.fullpathname)
+    if not dir.endswith(os.path.sep):
+        dir += os.path.sep
+
+    kaa.app.messagebar.set_message(
+        'Read from {}({}) read-only'.format(file, dir))
+    return doc
+
+
+def start_journal(doc):
+    """Start a new journal of doc for the current contents of the file.
+    Undo history is written to the journal, since the history before
+    the journal started can not be replayed."""
+
+    if doc.undo.journal:
+        doc.undo.journal.discard()
+    doc.undo.journal = journal.Journal(doc.fileinfo.fullpathname)
+    if doc.undo.can_undo() or doc.undo.can_redo():
+        doc.undo.journal.write('state', doc.undo.getstate())
+
+
+def open_journal(doc):
+    """Start journal of doc. If a journal of the file is left by a session
+    crashed, ask to recover edits in the journal."""
+
+    filename = doc.fileinfo.fullpathname
+    records = journal.read_journal(filename)
+    if not records:
+        doc.undo.journal = journal.Journal(filename)
+        return
+
+    def choice(c):
+        if c == 'y':
+            journal.replay(doc, records)
+            doc.undo.journal = journal.Journal(filename, resume=True)
+            kaa.app.messagebar.set_message(
+                'Recovered {} edits'.format(len(records)))
+        else:
+            doc.undo.journal = journal.Journal(filename)
+            doc.undo.journal.discard()
+
+    msgboxmode.MsgBoxMode.show_msgbox(
+        'Recover unsaved changes? [{}]: '.format(filename),
+        ['&Yes', '&No'], choice)
@@ -50,6 +50,7 @@ macro_command_keys = {
 search_command_keys = {
     (ctrl, 's'): 'search.showsearch',
     (alt, 's'): 'search.showreplace',
+    (alt, 'g'): 'search.showgrep',
 }
 
 # emacs like keys
@@ -1,5 +1,6 @@
 import itertools, unicodedata
 
+import gappedbuf
 import gappedbuf.re
 import kaa
 from kaa import keyboard, keydispatcher, LOG
@@ -12,8 +13,22 @@ class SearchOption:
         self.ignorecase = True
         self.word = False
         self.regex = False
+        self.anyword = False
+
+    def is_literal(self):
+        """Returns True if text can be searched as a plain string"""
+
+        return (bool(self.text) and not self.regex and not self.word and
+                not self.anyword)
 
     def get_regex(self):
+        if self.anyword:
+            # search any of words separated by spaces. MultiMatcher has
+            # same search methods as compiled regex.
+            return gappedbuf.MultiMatcher(self.text.split(),
+                                          wordboundary=self.word,
+                                          ignorecase=self.ignorecase)
+
         text = self.text
         if not self.regex:
             text = gappedbuf.re.escape(text)
@@ -159,6 +174,10 @@ class ModeBase:
             return
 
         ret = self.run_highlight()
+
+        searchindex = self.document.searchindex
+        if searchindex and searchindex.build():
+            ret = True
         return ret
 
     def run_highlight(self):
@@ -202,17 +221,31 @@ class ModeBase:
         yield from self._split_chars(begin, self.document.endpos())
 
     def search_next(self, wnd, pos, searchinfo):
+        if searchinfo.is_literal():
+            buf = self.document.buf
+            f = buf.find(searchinfo.text, pos, len(buf), 
+                         searchinfo.ignorecase)
+            if f != -1:
+                return (f, f+len(searchinfo.text))
+            return
+
         regex = searchinfo.get_regex()
         m = regex.search(self.document.buf, pos)
         if m:
             return m.span()
 
     def search_prev(self, wnd, pos, searchinfo):
-        regex = searchinfo.get_regex()
-        last = None
-        for m in regex.finditer(self.document.buf, 0):
-            span = m.span()
-            if span[1] >= pos:
-                break
-            last = span
-        return last
+        if searchinfo.is_literal():
+            # find string ends before pos
+            if pos > 0:
+                f = self.document.buf.rfind(searchinfo.text, 0, pos-1,
+                                            searchinfo.ignorecase)
+                if f != -1:
+                    return (f, f+len(searchinfo.text))
+            return
+
+        if pos > 0:
+            regex = searchinfo.get_regex()
+            m = regex.rsearch(self.document.buf, pos-1)
+            if m:
+                return m.span()
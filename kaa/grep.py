@@ -0,0 +1,170 @@
+import os, time
+import concurrent.futures
+import gappedbuf
+import gappedbuf.re
+from kaa import searchindex
+
+# Number of files searched by a task of the process pool.
+CHUNK_FILES = 64
+
+# Files larger than this are not searched.
+MAX_FILESIZE = 32*1024*1024
+
+# Max length of a line shown in the results.
+MAX_LINELEN = 256
+
+# Seconds spent to search a file. The file is given up after this.
+MAX_SEARCHTIME = 10
+
+
+def grep_file(regex, filename):
+    """Returns list of (pos, lineno, line) of matches in the file.
+    Binary files and files too large are skipped. TimeoutError is raised
+    if the search takes more than MAX_SEARCHTIME seconds."""
+
+    try:
+        if os.path.getsize(filename) > MAX_FILESIZE:
+            return []
+        with open(filename, 'rb') as f:
+            data = f.read()
+    except OSError:
+        return []
+
+    if b'\0' in data[:8192]:
+        return []
+
+    # positions should be same as documents opened by fileio.openfile(),
+    # which translates newlines.
+    text = data.decode('utf-8', errors='surrogateescape')
+    text = text.replace('\r\n', '\n').replace('\r', '\n')
+
+    buf = gappedbuf.GappedBuffer()
+    buf.insert(0, text)
+
+    # search runs chunk by chunk, so a pattern too slow to search the
+    # file doesn't keep the worker busy.
+    task = searchindex.SearchTask(searchindex.search_all(regex, buf))
+    task.STEP_TIME = MAX_SEARCHTIME
+    if task.step():
+        task.cancel()
+        raise TimeoutError('search timed out')
+    if task.error:
+        raise task.error
+
+    ret = []
+    lineno = 1
+    last = 0
+    eol = -1
+    for f, t in task.result:
+        if f <= eol:
+            # line of this match is already listed
+            continue
+
+        lineno += text.count('\n', last, f)
+        last = f
+        tol = text.rfind('\n', 0, f) + 1
+        eol = text.find('\n', f)
+        if eol == -1:
+            eol = len(text)
+        ret.append((f, lineno, text[tol:min(eol, tol+MAX_LINELEN)]))
+    return ret
+
+
+def grep_files(option, filenames):
+    """Search files with SearchOption. Runs in a worker process. Returns
+    list of (filename, hits, error) where hits is a list returned by
+    grep_file() and error is an error message or None."""
+
+    regex = option.get_regex()
+    ret = []
+    for filename in filenames:
+        try:
+            hits = grep_file(regex, filename)
+        except gappedbuf.re.StepLimitError:
+            ret.append((filename, [], 'pattern is too complex'))
+        except TimeoutError:
+            ret.append((filename, [], 'search timed out'))
+        else:
+            if hits:
+                ret.append((filename, hits, None))
+    return ret
+
+
+class GrepTask:
+    """Search files in a directory tree with a process pool. Call step()
+    until it returns False, and results collected are returned by
+    get_results() as they arrive. Files are listed little by little in
+    step(), so a large tree does not block the editor."""
+
+    STEP_TIME = 0.05    # seconds spent by each step() call
+    MAX_PENDING = 16    # max number of chunks submitted at a time
+
+    done = False
+
+    def __init__(self, storage, option, dirname, executor=None):
+        self.option = option
+        self.dirname = dirname
+        self.files = storage.walk(dirname)
+        self.executor = executor or concurrent.futures.ProcessPoolExecutor()
+        self.pending = set()
+        self.results = []
+        self.numfiles = 0
+        self.walked = False
+
+    def step(self):
+        """Search for a while. Returns True if the search is still in
+        progress."""
+
+        if self.done:
+            return False
+
+        deadline = time.perf_counter() + self.STEP_TIME
+        chunk = []
+        while not self.walked and len(self.pending) < self.MAX_PENDING:
+            filename = next(self.files, None)
+            if filename is None:
+                self.walked = True
+            else:
+                chunk.append(filename)
+                self.numfiles += 1
+
+            if chunk and (self.walked or len(chunk) >= CHUNK_FILES):
+                self.pending.add(self.executor.submit(
+                    grep_files, self.option, chunk))
+                chunk = []
+
+            if time.perf_counter() > deadline:
+                break
+
+        if chunk:
+            self.pending.add(self.executor.submit(
+                grep_files, self.option, chunk))
+
+        for future in [f for f in self.pending if f.done()]:
+            self.pending.remove(future)
+            self.results.extend(future.result())
+
+        if self.walked and not self.pending:
+            self._finish()
+            return False
+        return True
+
+    def get_results(self):
+        """Returns list of (filename, hits, error) arrived since the
+        last call"""
+
+        ret = self.results
+        self.results = []
+        return ret
+
+    def _finish(self):
+        self.done = True
+        self.files.close()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def cancel(self):
+        """Stop the search"""
+
+        if not self.done:
+            self.pending.clear()
+            self._finish()
@@ -1,3 +1,4 @@
+import gappedbuf
 from gappedbuf import re as gre
 import collections
 
@@ -13,6 +14,10 @@ class Token:
     def re_start(self):
         """Returns regular expression to find begging of token"""
 
+    def multimatcher(self):
+        """Returns gappedbuf.MultiMatcher to find begging of token, if
+        token starts with one of words"""
+
     def on_start(self, tokenizer, doc, pos, match):
         """Called when token started. Yield (pos, posto, tokenid)
         until exhausted"""
@@ -50,6 +55,12 @@ class Keywords(Token):
     def re_start(self):
         return r'\b({})\b'.format('|'.join(self.keywords))
 
+    def multimatcher(self):
+        # Keywords are found with a single automaton instead of
+        # alternation of regular expression, which tries each keyword in
+        # turn at every position.
+        return gappedbuf.MultiMatcher(self.keywords, wordboundary=True)
+
     def on_start(self, tokenizer, doc, pos, match):
         yield (match.start(), match.end(), self.keywordtoken)
         return match.end(), None, False
@@ -78,19 +89,27 @@ class Span(Token):
     def on_start(self, tokenizer, doc, pos, match):
         yield (match.start(), match.end(), self.span_start)
 
-        for m in self.end.finditer(doc.buf, match.end()):
-            if self.escape and m.group(1) is not None:
-                continue
+        try:
+            for m in self.end.finditer(doc.buf, match.end(),
+                                       maxsteps=tokenizer.MAXSTEPS):
+                if self.escape and m.group(1) is not None:
+                    continue
 
-            if match.end() != m.start():
-                yield (match.end(), m.start(), self.span_mid)
+                if match.end() != m.start():
+                    yield (match.end(), m.start(), self.span_mid)
 
-            yield (m.start(), m.end(), self.span_end)
-            return m.end(), None, False
+                yield (m.start(), m.end(), self.span_end)
+                return m.end(), None, False
 
-        else:
-            yield (match.end(), doc.endpos(), self.span_mid)
-            return doc.endpos(), None, False
+            else:
+                yield (match.end(), doc.endpos(), self.span_mid)
+                return doc.endpos(), None, False
+
+        except gre.StepLimitError:
+            # pattern is too complex. span ends at the end of line.
+            eol = doc.geteol(match.end())
+            yield (match.end(), eol, self.span_mid)
+            return eol, None, False
 
 class SubSection(Token):
     def __init__(self, name, stylename, start, tokenizer):
@@ -145,6 +164,8 @@ class EndSection(Token):
 
 class Tokenizer:
     re_starts = None
+    MAXSTEPS = 1000000  # max steps of regex engine to try a match
+
     def __init__(self, tokens):
 
         self.groupnames = {}
@@ -153,35 +174,82 @@ class Tokenizer:
     def prepare(self, highlighter):
         self.highlighter = highlighter
 
+        # list of (index of token, matcher, token) to find tokens. Token is
+        # None for re_starts, which finds one of tokens.
+        self.matchers = []
         starts = []
         for i, token in enumerate(self.tokens):
             token.prepare(self)
+            matcher = token.multimatcher()
+            if matcher:
+                self.matchers.append((i, matcher, token))
+                continue
+
             start = token.re_start()
             if start:
                 name = 'G{}'.format(i)
-                self.groupnames[name] = token
+                self.groupnames[name] = (i, token)
                 starts.append(r'(?P<{}>{})'.format(name, start))
 
         if starts:
             self.re_starts = gre.compile('|'.join(starts), gre.M+gre.X)
+            self.matchers.append((None, self.re_starts, None))
 
     def assign_tokenid(self, obj):
         return self.highlighter.assign_tokenid(self, obj)
 
+    def _find_start(self, doc, pos, end, hits):
+        # Returns tuple of (match, token) of the first token starts from
+        # pos to end, or (None, None). If tokens start at same position,
+        # the token listed first is used. Matches are cached in hits while
+        # they are not passed, to avoid searching same text again.
+        found = None
+        for key, (i, matcher, token) in enumerate(self.matchers):
+            hit = hits.get(key)
+            if (not hit or hit[0] > pos or hit[1] != end or
+                    (hit[2] and hit[2].start() < pos)):
+                m = matcher.search(doc.buf, pos, end, maxsteps=self.MAXSTEPS)
+                hit = hits[key] = (pos, end, m)
+
+            m = hit[2]
+            if m:
+                if token is None:
+                    i, token = self.groupnames[m.lastgroup]
+                if not found or (m.start(), i) < (found[0].start(), found[1]):
+                    found = (m, i, token)
+
+        if found:
+            return found[0], found[2]
+        return None, None
+
     def start(self, doc, pos):
-        if self.re_starts:
+        if self.matchers:
+            # Once a pattern exceeds MAXSTEPS, tokens are searched line by
+            # line to skip lines the pattern cannot handle.
+            linemode = False
+            hits = {}
             while True:
-                m = self.re_starts.search(doc.buf, pos)
+                end = doc.geteol(pos) if linemode else doc.endpos()
+                try:
+                    m, token = self._find_start(doc, pos, end, hits)
+                except gre.StepLimitError:
+                    if not linemode:
+                        linemode = True
+                        continue
+                    m = None
+
                 if not m:
-                    break
+                    if end == doc.endpos():
+                        break
+                    yield (pos, end, 0)
+                    pos = end
+                    continue
 
                 f, t = m.span()
                 if f != pos:
                     yield (pos, f, 0)
                     pos = f
 
-                token = self.groupnames[m.lastgroup]
-
                 pos, childtokenizer, close = yield from token.on_start(
                                                 self, doc, pos, m)
                 if close:
@@ -306,7 +374,7 @@ class Highlighter:
 
         # check a character proceeding to updated pos
         pos -= 1
-        style = doc.styles.getints(pos, pos+1)[0]
+        style = doc.styles.getint(pos)
         if style == 0:
             # not highlighted yet.
             p = doc.styles.rfindint([0], 0, pos, comp_ne=True)
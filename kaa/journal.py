@@ -0,0 +1,191 @@
+import os, json, hashlib, threading, queue
+from kaa import LOG
+
+# Directory to store journals of documents.
+JOURNAL_DIR = os.path.join(
+    os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'),
+    'kaa', 'journal')
+
+JOURNAL_MAGIC = 'kaa-journal-1'
+
+
+def get_journalname(filename):
+    """Returns path of the journal of filename"""
+
+    key = os.path.abspath(filename).encode('utf-8', 'surrogateescape')
+    return os.path.join(JOURNAL_DIR,
+                        hashlib.sha1(key).hexdigest() + '.journal')
+
+
+def _getstat(filename):
+    # Returns [size, mtime] of the file to detect the file changed since
+    # the journal is started, or None if the file does not exist.
+    try:
+        st = os.stat(filename)
+    except OSError:
+        return None
+    return [st.st_size, st.st_mtime_ns]
+
+
+class _Writer:
+    """Writes journals in a background thread. Files are flushed each
+    time the queue is emptied."""
+
+    def __init__(self):
+        self.queue = queue.Queue()
+        self.files = {}
+        self.thread = None
+
+    def put(self, path, op, data=None):
+        if not self.thread:
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread.start()
+        self.queue.put((path, op, data))
+
+    def flush(self):
+        """Wait until queued records are written"""
+
+        self.queue.join()
+
+    def _run(self):
+        while True:
+            path, op, data = self.queue.get()
+            try:
+                self._write(path, op, data)
+                if self.queue.empty():
+                    for f in self.files.values():
+                        f.flush()
+            except OSError:
+                LOG.exception('Failed to write journal: {}'.format(path))
+            finally:
+                self.queue.task_done()
+
+    def _close(self, path):
+        f = self.files.pop(path, None)
+        if f:
+            f.close()
+
+    def _write(self, path, op, data):
+        if op == 'start':
+            self._close(path)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            self.files[path] = open(path, 'w', encoding='utf-8')
+            self.files[path].write(data)
+        elif op == 'append':
+            if path not in self.files:
+                self.files[path] = open(path, 'a', encoding='utf-8')
+            self.files[path].write(data)
+        elif op == 'close':
+            self._close(path)
+        elif op == 'remove':
+            self._close(path)
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+_writer = _Writer()
+
+
+class Journal:
+    """Append-only log of undo actions of a document, to recover edits
+    lost by a crash.
+
+    Records are written to a file in JOURNAL_DIR by a background thread.
+    The first line of the file is a header with the name and the size
+    and mtime of the file when the journal was started, and each line
+    after it is a record written by document.Undo as a JSON array.
+
+    The file is created when the first record is written. If resume is
+    True, records are appended to the existing journal.
+    """
+
+    def __init__(self, filename, resume=False):
+        self.filename = filename
+        self.path = get_journalname(filename)
+        self.started = resume
+        self.stat = _getstat(filename)
+
+    def write(self, *record):
+        """Queue a record to be written"""
+
+        if not self.started:
+            self.started = True
+            _writer.put(self.path, 'start', json.dumps(
+                [JOURNAL_MAGIC, self.filename, self.stat]) + '\n')
+        _writer.put(self.path, 'append', json.dumps(record) + '\n')
+
+    def flush(self):
+        """Wait until records are written"""
+
+        _writer.flush()
+
+    def close(self):
+        _writer.put(self.path, 'close')
+
+    def discard(self):
+        """Remove the journal file"""
+
+        self.started = False
+        _writer.put(self.path, 'remove')
+
+
+def read_journal(filename):
+    """Returns list of records in the journal of filename, or None if
+    there is no valid journal for the current contents of the file. A
+    broken record at the end, written when crashed, is ignored."""
+
+    try:
+        with open(get_journalname(filename), encoding='utf-8') as f:
+            lines = f.read().split('\n')
+    except (OSError, UnicodeDecodeError):
+        return None
+
+    try:
+        header = json.loads(lines[0])
+    except ValueError:
+        return None
+
+    if header != [JOURNAL_MAGIC, filename, _getstat(filename)]:
+        return None
+
+    records = []
+    for line in lines[1:]:
+        try:
+            records.append(json.loads(line))
+        except ValueError:
+            break
+    return records
+
+
+def replay(doc, records):
+    """Apply records of a journal to doc and its undo history"""
+
+    undo = doc.undo
+    commands = doc.mode.edit_commands
+    with doc.transaction():
+        for op, *args in records:
+            if op == 'state':
+                undo.setstate(args[0])
+            elif op == 'add':
+                action, actionargs, kwargs = args
+                undo.add(action, *actionargs, **kwargs)
+                commands.redo_action(doc, (action, actionargs, kwargs))
+            elif op == 'insert':
+                undo.add_insert(*args)
+                commands.redo_action(doc, (args[0], args[1:], {}))
+            elif op == 'delete':
+                undo.add_delete(*args)
+                commands.redo_action(doc, (args[0], args[1:], {}))
+            elif op == 'begin':
+                undo.beginblock()
+            elif op == 'end':
+                undo.endblock()
+            elif op == 'undo':
+                if undo.can_undo():
+                    for rec in undo.undo():
+                        commands.undo_action(doc, rec)
+            elif op == 'redo':
+                if undo.can_redo():
+                    for rec in undo.redo():
+                        commands.redo_action(doc, rec)
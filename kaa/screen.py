@@ -349,8 +349,9 @@ class Screen:
                 if pos + deleted > self.updated_pos:
                     self.updated_pos = pos
                 else:
-                    tol = self.document.gettol(self.updated_pos - deleted) 
-                    if tol != self.document.gettol(pos):
+                    lineno = self.document.getlineno(
+                                self.updated_pos - deleted)
+                    if lineno != self.document.getlineno(pos):
                         # Position of top of screen is not changed 
                         # if deleted on same physical line.
                         self.updated_pos -= deleted
@@ -0,0 +1,360 @@
+import time
+import gappedbuf
+import gappedbuf.re
+
+# Number of characters searched at a time by incremental searches.
+SEARCH_CHUNK = 1024*1024
+
+# Number of characters after the chunk visible to the pattern. Matches
+# longer than this across the end of chunk are not found.
+SEARCH_OVERLAP = 64*1024
+
+# Max steps of the regex engine to try a match at a position. Patterns
+# exceeding this raise gappedbuf.re.StepLimitError. The limit is not
+# for a whole search, so searches over a long text should run little by
+# little with SearchTask.
+SEARCH_MAXSTEPS = 1000000
+
+
+def search_range(regex, buf, pos, end):
+    """Returns the first match starts from pos to end, or None if not
+    found. Text after end is visible to the pattern only up to
+    SEARCH_OVERLAP characters, so time spent does not depend on the
+    length of the text."""
+
+    size = len(buf)
+    limit = min(size, end+SEARCH_OVERLAP)
+    while pos <= end:
+        m = regex.search(buf, pos, limit, SEARCH_MAXSTEPS)
+        if not m or m.start() > end:
+            return None
+        if limit == size:
+            return m
+
+        # the match may be changed by the text after limit.
+        found = regex.match(buf, m.start(), maxsteps=SEARCH_MAXSTEPS)
+        if found:
+            return found
+        pos = m.start() + 1
+
+
+def search_forward(regex, buf, pos):
+    """Generator to find the first match starts at or after pos. Yields
+    progress of the search from 0 to 1 periodically, and returns the span
+    of the match or None."""
+
+    begin = pos
+    while True:
+        size = len(buf)
+        if pos > size:
+            return None
+
+        end = min(pos+SEARCH_CHUNK, size)
+        m = search_range(regex, buf, pos, end)
+        if m:
+            return m.span()
+
+        pos = end + 1
+        yield (pos-begin) / max(1, size-begin)
+
+
+def search_all(regex, buf, pos=0):
+    """Generator to find all matches start at or after pos, as finditer()
+    does. Yields progress of the search from 0 to 1 periodically, and
+    returns list of spans of the matches."""
+
+    begin = pos
+    ret = []
+    while True:
+        size = len(buf)
+        if pos > size:
+            return ret
+
+        end = min(pos+SEARCH_CHUNK, size)
+        m = search_range(regex, buf, pos, end)
+        if m:
+            f, t = m.span()
+            ret.append((f, t))
+            pos = t if t != f else t + 1
+        else:
+            pos = end + 1
+        yield (pos-begin) / max(1, size-begin)
+
+
+def search_backward(regex, buf, pos, floor=0):
+    """Generator to find the last match starts at or after floor and
+    ends before pos. Yields progress of the search from 0 to 1
+    periodically, and returns the span of the match or None.
+
+    Chunks are searched forward from the one just before pos. Each chunk
+    starts at regex.syncpos(), where no match runs across, so the match
+    found is the one search_forward() from floor would find last."""
+
+    endpos = pos - 1
+    hi = endpos
+    while True:
+        lo = regex.syncpos(buf, max(floor, hi-SEARCH_CHUNK), floor)
+        last = None
+        p = lo
+        while p <= hi:
+            m = search_range(regex, buf, p, hi)
+            if not m:
+                break
+            f, t = m.span()
+            if t > endpos:
+                break
+            last = (f, t)
+            p = t if t != f else t + 1
+            yield (endpos-lo) / max(1, endpos-floor)
+
+        if last or lo == floor:
+            return last
+        hi = lo
+        yield (endpos-lo) / max(1, endpos-floor)
+
+
+class SearchTask:
+    """Runs a search generator little by little. Call step() until it
+    returns False, then the result is stored in result. If the pattern
+    is too complex to search, the exception is stored in error."""
+
+    STEP_TIME = 0.05    # seconds spent by each step() call
+
+    done = False
+    result = None
+    error = None
+    progress = 0
+
+    def __init__(self, search):
+        self._search = search
+
+    def step(self):
+        """Search for a while. Returns True if the search is still in
+        progress."""
+
+        if self.done:
+            return False
+
+        deadline = time.perf_counter() + self.STEP_TIME
+        try:
+            while True:
+                self.progress = next(self._search)
+                if time.perf_counter() > deadline:
+                    return True
+        except StopIteration as e:
+            self.result = e.value
+            self.done = True
+            return False
+        except gappedbuf.re.StepLimitError as e:
+            self.error = e
+            self.done = True
+            return False
+
+    def cancel(self):
+        """Stop the search"""
+
+        self._search.close()
+        self.done = True
+
+
+class SearchIndex:
+    """Spans of all matches of a search in a document.
+
+    Spans are collected by build() in idle time, and the index is kept
+    up to date on each update of the document by rescanning lines around
+    the updated range. If the pattern is too complex to search, the index
+    gives up and stays empty with failed set.
+    """
+
+    BUILD_TIME = 0.05   # seconds spent by each build() call
+    completed = False
+    failed = False
+
+    def __init__(self, doc, option):
+        self.document = doc
+        self.key = self._get_key(option)
+        self.regex = option.get_regex()
+
+        self.spans = gappedbuf.MatchSpans()
+        self.spans.inserted(0, doc.endpos())
+
+        # all matches started before scanned are in spans
+        self.scanned = 0
+
+    @staticmethod
+    def _get_key(option):
+        return (option.text, option.ignorecase, option.word, option.regex,
+                option.anyword)
+
+    def is_valid_for(self, option):
+        """Returns True if this index was built for option"""
+
+        return self.key == self._get_key(option)
+
+    def build(self):
+        """Collect matches for a while. Returns True if more matches
+        remain to be collected."""
+
+        if self.completed:
+            return False
+
+        deadline = time.perf_counter() + self.BUILD_TIME
+        begin = self.scanned
+        buf = self.document.buf
+        try:
+            while True:
+                end = min(self.scanned+SEARCH_CHUNK, len(buf))
+                m = search_range(self.regex, buf, self.scanned, end)
+                if m:
+                    f, t = m.span()
+                    # empty match may be already found by rescan.
+                    if self.spans.next(f) != (f, t):
+                        self.spans.add(f, t)
+                    self.scanned = t if t != f else t + 1
+                else:
+                    self.scanned = end + 1
+
+                if self.scanned > len(buf):
+                    self.scanned = len(buf)
+                    self.completed = True
+                    return False
+
+                if time.perf_counter() > deadline:
+                    return True
+        except gappedbuf.re.StepLimitError:
+            self._fail()
+            return False
+        finally:
+            self.document.style_updated(begin, self.scanned)
+
+    def updated(self, pos, inslen, dellen):
+        """Called when document updated"""
+
+        delta = inslen - dellen
+        removed = self.spans.deleted(pos, pos+dellen)
+        self.spans.inserted(pos, inslen)
+
+        if self.failed:
+            return
+
+        if self.completed:
+            self.scanned = self.document.endpos()
+        elif pos+dellen < self.scanned:
+            self.scanned += delta
+        else:
+            # matches at the end of scanned range may be changed. Let 
+            # build() collect them again.
+            self.scanned = self._get_rescan_top(min(pos, self.scanned))
+            self.spans.remove(self.scanned, self.document.endpos())
+            return
+
+        # rescan lines of updated range and removed matches.
+        begin, end = pos, pos+inslen
+        if removed:
+            begin = min(begin, removed[0])
+            if removed[1] > pos+dellen:
+                end = max(end, removed[1]+delta)
+
+        try:
+            self._rescan(self._get_rescan_top(begin),
+                         min(self.document.geteol(end), self.scanned))
+        except gappedbuf.re.StepLimitError:
+            self._fail()
+
+    def _get_rescan_top(self, pos):
+        # Returns top of the line preceding to pos, for matches across
+        # lines. A match across the position should be searched again
+        # from its top.
+        pos = self.document.gettol(pos)
+        if pos:
+            pos = self.document.gettol(pos-1)
+
+        for f, t in self.spans.iter_spans(pos, pos):
+            return min(pos, f)
+        return pos
+
+    def _rescan(self, begin, end):
+        self.spans.remove(begin, end)
+
+        buf = self.document.buf
+        pos = begin
+        while pos <= end:
+            m = search_range(self.regex, buf, pos, end)
+            if not m:
+                break
+            f, t = m.span()
+            if f == end and (f != t or self.spans.next(f) == (f, t)):
+                break
+            if t > end:
+                # a match overruns the range. Remove matches which
+                # overlap with it.
+                self.spans.remove(end, t)
+                end = t
+            self.spans.add(f, t)
+            pos = t if t != f else t + 1
+
+        if end > self.scanned and not self.completed:
+            self.scanned = min(end, self.document.endpos())
+        self.document.style_updated(begin, end)
+
+    def _fail(self):
+        self.failed = self.completed = True
+        self.scanned = self.document.endpos()
+        self.spans.remove(0, self.scanned)
+        self.document.style_updated(0, self.scanned)
+
+    def count(self):
+        """Returns number of matches found so far"""
+
+        return len(self.spans)
+
+    def index(self, span):
+        """Returns index of span in found matches, or None if span is not
+        indexed"""
+
+        f, t = span
+        if self.spans.next(f) == (f, t):
+            return self.spans.index(f)
+
+    def search(self, pos, reverse=False):
+        """Returns SearchTask to find the first match starts at or after
+        pos, or the last match ends before pos if reverse is True."""
+
+        if reverse:
+            return SearchTask(self._search_prev(pos))
+        return SearchTask(self._search_next(pos))
+
+    def _search_next(self, pos):
+        if self.failed:
+            return (yield from search_forward(
+                        self.regex, self.document.buf, pos))
+
+        span = self.spans.next(pos)
+        if span or self.completed:
+            return span
+
+        # search text not indexed yet.
+        return (yield from search_forward(
+                    self.regex, self.document.buf, max(pos, self.scanned)))
+
+    def _search_prev(self, pos):
+        if pos <= 0:
+            return None
+
+        if self.failed:
+            return (yield from search_backward(
+                        self.regex, self.document.buf, pos))
+
+        if not self.completed and self.scanned < pos:
+            span = yield from search_backward(
+                    self.regex, self.document.buf, pos, self.scanned)
+            if span:
+                return span
+
+        return self.spans.prev(pos-1)
+
+    def iter_spans(self, begin, end):
+        """Yields (begin, end) of each matches overlap the range from
+        begin to end"""
+
+        return self.spans.iter_spans(begin, end)
@@ -61,28 +61,30 @@ class FileListDlgMode(dialogmode.DialogMode):
         self.cursel = None
 
     def build_doc(self):
-        self.document.delete(0, self.document.endpos())
-        if self.filename_check:
-            files = [file for file in self.files if self.filename_check(file)]
-            dirs = [dir for dir in self.dirs if self.filename_check(dir)]
-        else:
-            files = self.files
-            dirs = self.dirs
-
-        self._cur_items = dirs+files
-
-        f = dialogmode.FormBuilder(self.document)
-
-        f.append_text('caption', self.dirname+':\n')
-        for dir in dirs:
-            start = f.document.endpos()
-            f.append_text('dirname', dir.replace('&', '&&')+'/', mark_pair=dir)
-            f.append_text('default', ' ')
-
-        for file in files:
-            start = f.document.endpos()
-            f.append_text('filename', file.replace('&', '&&'), mark_pair=file)
-            f.append_text('default', ' ')
+        # the document is updated at once after all items are added.
+        with self.document.transaction():
+            self.document.delete(0, self.document.endpos())
+            if self.filename_check:
+                files = [file for file in self.files if self.filename_check(file)]
+                dirs = [dir for dir in self.dirs if self.filename_check(dir)]
+            else:
+                files = self.files
+                dirs = self.dirs
+
+            self._cur_items = dirs+files
+
+            f = dialogmode.FormBuilder(self.document)
+
+            f.append_text('caption', self.dirname+':\n')
+            for dir in dirs:
+                start = f.document.endpos()
+                f.append_text('dirname', dir.replace('&', '&&')+'/', mark_pair=dir)
+                f.append_text('default', ' ')
+
+            for file in files:
+                start = f.document.endpos()
+                f.append_text('filename', file.replace('&', '&&'), mark_pair=file)
+                f.append_text('default', ' ')
 
 
     def init_keybind(self):
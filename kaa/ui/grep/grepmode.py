@@ -0,0 +1,260 @@
+import copy, os
+import kaa
+from kaa import document, grep
+from kaa.command import Commands, command, norec
+from kaa.theme import Theme, Style
+from kaa.keyboard import *
+from kaa.ui.dialog import dialogmode
+from kaa.ui.searchdlg import searchdlgmode
+from kaa.filetype.default import defaultmode, modebase
+from kaa.filetype.default import keybind as default_keybind
+
+GrepTheme = Theme('default', [
+    Style('default', 'default', 'default', False, False),
+    Style('caption', 'yellow', 'default', bold=True),
+    Style('filename', 'green', 'default'),
+    Style('lineno', 'cyan', 'default'),
+    Style('error', 'red', 'default'),
+])
+
+grepdlg_keys = {
+    '\n': 'grepdlg.field.next',
+}
+
+grep_keys = {
+    '\n': 'grep.open',
+}
+
+
+LAST_GREP = modebase.SearchOption()
+
+class GrepDlgCommands(Commands):
+    @command('grepdlg.field.next')
+    def field_next(self, wnd):
+        searchfrom, searchto = wnd.document.marks['searchtext']
+        dirfrom, dirto = wnd.document.marks['directory']
+
+        if searchfrom <= wnd.cursor.pos <= searchto:
+            wnd.cursor.setpos(dirto)
+        else:
+            wnd.document.mode.start_grep(wnd)
+
+
+class GrepDlgMode(searchdlgmode.SearchDlgMode):
+    """Dialog to input text and directory to search files"""
+
+    lastdir = None
+    incremental = False
+
+    def __init__(self, target):
+        super().__init__(target)
+        self.option = LAST_GREP
+
+    def init_keybind(self):
+        super().init_keybind()
+        self.keybind.add_keybind(grepdlg_keys)
+
+    def init_commands(self):
+        super().init_commands()
+        self._grepdlgcommands = GrepDlgCommands()
+        self.register_command(self._grepdlgcommands)
+
+    def create_cursor(self, wnd):
+        return dialogmode.DialogCursor(wnd,
+                  [dialogmode.MarkRange('searchtext'),
+                   dialogmode.MarkRange('directory')])
+
+    def on_add_window(self, wnd):
+        super().on_add_window(wnd)
+
+        dirname = self.lastdir
+        if not dirname:
+            filename = self.target.document.get_filename()
+            dirname = os.path.dirname(filename) if filename else os.getcwd()
+        self.document.insert(self.document.marks['directory'][0], dirname)
+
+    def _build_input(self, f):
+        # search text
+        f.append_text('caption', 'Search:')
+        f.append_text('default', ' ')
+        f.append_text('default', '', mark_pair='searchtext')
+        f.append_text('default', '\n')
+
+        # directory to search
+        f.append_text('caption', 'Directory:')
+        f.append_text('default', ' ')
+        f.append_text('default', '', mark_pair='directory')
+        f.append_text('default', '\n')
+
+    def _build_buttons(self, f):
+        f.append_text('checkbox', '[&Search]', mark_pair='search',
+                      shortcut_style='checkbox.shortcut',
+                      on_shortcut=self.start_grep)
+
+    def get_directory(self):
+        f, t = self.document.marks['directory']
+        return os.path.expanduser(self.document.gettext(f, t).strip())
+
+    def start_grep(self, wnd):
+        self.option.text = self.get_search_str()
+        if not self.option.text:
+            return
+
+        dirname = self.get_directory()
+        if not os.path.isdir(dirname):
+            kaa.app.messagebar.set_message(
+                'Not a directory: {}'.format(dirname))
+            return
+
+        GrepDlgMode.lastdir = dirname
+
+        # the dialog may change options while searching.
+        doc = GrepMode.build(copy.copy(self.option), dirname)
+
+        self.target.activate()
+        self.target = None
+        wnd.get_label('popup').destroy()
+        self.document.close()
+
+        kaa.app.show_doc(doc)
+
+
+class GrepCommands(Commands):
+    @command('grep.open')
+    @norec
+    def open_hit(self, wnd):
+        mode = wnd.document.mode
+        hit = mode.get_hit(wnd.cursor.pos)
+        if hit:
+            mode.open_hit(*hit)
+
+
+class GrepMode(defaultmode.DefaultMode):
+    """Results of search in files. Hits are added in idle time as worker
+    processes find them. Each line after the caption is a hit."""
+
+    task = None
+
+    @classmethod
+    def build(cls, option, dirname, executor=None):
+        buf = document.Buffer()
+        doc = document.Document(buf)
+        mode = cls()
+        doc.setmode(mode)
+        doc.title = 'grep: {}'.format(option.text)
+
+        mode.start(option, dirname, executor)
+        return doc
+
+    def close(self):
+        self.cancel_grep()
+        super().close()
+
+    def init_keybind(self):
+        # results are not editable
+        self.keybind.add_keybind(default_keybind.app_keys)
+        self.keybind.add_keybind(default_keybind.cursor_keys)
+        self.keybind.add_keybind(default_keybind.emacs_keys)
+        self.keybind.add_keybind(default_keybind.search_command_keys)
+        self.keybind.add_keybind(grep_keys)
+
+    def init_commands(self):
+        super().init_commands()
+        self.grep_commands = GrepCommands()
+        self.register_command(self.grep_commands)
+
+    def init_theme(self):
+        self.theme = GrepTheme
+
+    def init_tokenizers(self):
+        self.tokenizers = []
+
+    def on_str(self, wnd, s):
+        pass
+
+    def start(self, option, dirname, executor=None):
+        self.dirname = dirname
+        self.hits = []
+        self.numhits = 0
+        self.numfiles = 0
+
+        self.get_styleid('default')
+        self._append([('caption', 'Search {!r} in {}'.format(
+                           option.text, dirname)),
+                      (None, '\n')])
+
+        self.task = grep.GrepTask(kaa.app.storage, option, dirname,
+                                  executor)
+
+    def _append(self, items):
+        # Append list of (stylename, text) to the document.
+        pos = self.document.endpos()
+        self.document.append(''.join(text for style, text in items))
+        for stylename, text in items:
+            if stylename:
+                self.document.styles.setints(pos, pos+len(text),
+                                             self.get_styleid(stylename))
+            pos += len(text)
+
+    def _show_results(self, results):
+        items = []
+        for filename, hits, error in results:
+            relname = os.path.relpath(filename, self.dirname)
+            if error:
+                self.hits.append((filename, 0))
+                items.extend([('filename', relname), (None, ': '),
+                              ('error', error), (None, '\n')])
+                continue
+
+            self.numfiles += 1
+            for pos, lineno, line in hits:
+                self.hits.append((filename, pos))
+                self.numhits += 1
+                items.extend([('filename', relname), (None, ':'),
+                              ('lineno', str(lineno)), (None, ': '),
+                              (None, line), (None, '\n')])
+        if items:
+            self._append(items)
+
+    def _run_grep(self):
+        running = self.task.step()
+        self._show_results(self.task.get_results())
+        if running:
+            kaa.app.messagebar.set_message(
+                'Searching... {:,} files, {:,} matches (Esc to cancel)'
+                .format(self.task.numfiles, self.numhits))
+            return True
+
+        kaa.app.messagebar.set_message(
+            '{:,} matches in {:,} files'.format(self.numhits, self.numfiles))
+        self.task = None
+        return False
+
+    def cancel_grep(self):
+        if self.task:
+            self.task.cancel()
+            self.task = None
+            return True
+
+    def on_idle(self):
+        ret = super().on_idle()
+        if self.task and self._run_grep():
+            ret = True
+        return ret
+
+    def on_esc_pressed(self, wnd, event):
+        if self.cancel_grep():
+            kaa.app.messagebar.set_message('Search canceled')
+
+    def get_hit(self, pos):
+        """Returns tuple of (filename, pos) of the hit at pos, or None"""
+
+        n = self.document.getlineno(pos) - 1
+        if 0 <= n < len(self.hits):
+            return self.hits[n]
+
+    def open_hit(self, filename, pos):
+        doc = kaa.app.storage.openfile(filename)
+        kaa.app.show_doc(doc)
+        for wnd in doc.wnds:
+            wnd.cursor.setpos(min(pos, doc.endpos()))
@@ -42,6 +42,11 @@ class SearchCommands(editorcommand.EditCommands):
         mode = wnd.document.mode
         mode.toggle_option_regex()
 
+    @command('searchdlg.toggle.anyword')
+    def toggle_anyword(self, wnd):
+        mode = wnd.document.mode
+        mode.toggle_option_anyword()
+
 class ReplaceCommands(Commands):
     @command('replacedlg.field.next')
     def field_next(self, wnd):
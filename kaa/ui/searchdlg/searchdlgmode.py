@@ -1,4 +1,6 @@
+import time
 import kaa
+from kaa import searchindex
 from kaa.ui.dialog import dialogmode
 from kaa.theme import Theme, Style
 from kaa.filetype.default import modebase, keybind as default_keybind
@@ -20,6 +22,12 @@ SearchTheme = Theme('default', [
 LAST_SEARCH = modebase.SearchOption()
 
 class SearchDlgMode(dialogmode.DialogMode):
+    # Seconds to wait after the search text is typed before incremental
+    # search runs, so that fast typing does not search and redraw the
+    # target on each key.
+    INCSEARCH_DELAY = 0.1
+    incremental = True
+
     def __init__(self, target):
         super().__init__()
 
@@ -28,9 +36,17 @@ class SearchDlgMode(dialogmode.DialogMode):
         self.initialrange = target.screen.selection.get_range()
         self.lastsearch = None
         self.option = LAST_SEARCH
+        self.searchtask = None
+
+        # Incremental search. incstates is a stack of (text, hit) found
+        # from incbase. incpending is the time search text updated.
+        self.incbase = None
+        self.incstates = []
+        self.incpending = None
 
     def close(self):
         super().close()
+        self.cancel_search()
         self.target = None
 
     def init_keybind(self):
@@ -76,6 +92,9 @@ class SearchDlgMode(dialogmode.DialogMode):
             wnd.screen.selection.set_range(*self.document.marks['searchtext'])
         wnd.cursor.setpos(self.document.marks['searchtext'][1])
 
+        # initial text is not searched until updated.
+        self.incpending = None
+
     def _build_input(self, f):
         # search text
         f.append_text('caption', 'Search:')
@@ -112,6 +131,12 @@ class SearchDlgMode(dialogmode.DialogMode):
                       shortcut_style='checkbox.shortcut',
                       shortcut_mark='shortcut-r')
 
+        f.append_text('checkbox', '[An&y word]',
+                      mark_pair='anyword',
+                      on_shortcut=self.toggle_option_anyword,
+                      shortcut_style='checkbox.shortcut',
+                      shortcut_mark='shortcut-y')
+
     def build_document(self):
         f = dialogmode.FormBuilder(self.document)
         self._build_input(f)
@@ -147,7 +172,15 @@ class SearchDlgMode(dialogmode.DialogMode):
         self._set_option_style('regex', style, 'shortcut-r',
                                'checkbox.shortcut')
 
+        style = self._get_optionstylename(self.option.anyword)
+        self._set_option_style('anyword', style, 'shortcut-y',
+                               'checkbox.shortcut')
+
     def _option_updated(self):
+        self.cancel_search()
+        self.incstates = []
+        if self.incbase is not None:
+            self.incpending = time.perf_counter()
         self.update_option_style()
         self.document.style_updated(0, self.document.endpos())
 
@@ -163,10 +196,30 @@ class SearchDlgMode(dialogmode.DialogMode):
         self.option.regex = not self.option.regex
         self._option_updated()
 
+    def toggle_option_anyword(self, wnd):
+        self.option.anyword = not self.option.anyword
+        self._option_updated()
+
     def get_search_str(self):
         f, t = self.document.marks['searchtext']
         return self.document.gettext(f, t)
 
+    def _get_searchindex(self):
+        doc = self.target.document
+        index = doc.searchindex
+        if not index or not index.is_valid_for(self.option):
+            index = doc.searchindex = searchindex.SearchIndex(
+                doc, self.option)
+            # rest of matches are collected in idle time.
+            index.build()
+        return index
+
+    def _clear_searchindex(self):
+        doc = self.target.document
+        if doc.searchindex:
+            doc.searchindex = None
+            doc.style_updated(0, doc.endpos())
+
     def _show_searchresult(self, hit):
         if hit:
             self.target.cursor.setpos(hit[0])
@@ -174,54 +227,166 @@ class SearchDlgMode(dialogmode.DialogMode):
             self.target.screen.selection.end = hit[1]
             self.lastsearch = hit
 
-            kaa.app.messagebar.set_message('found')
+            index = self.target.document.searchindex
+            n = index.index(hit)
+            if n is not None:
+                more = '' if index.completed else '+'
+                kaa.app.messagebar.set_message(
+                    'match {:,} of {:,}{}'.format(n+1, index.count(), more))
+            else:
+                kaa.app.messagebar.set_message('found')
         else:
             kaa.app.messagebar.set_message('not found')
 
+    def _get_startpos(self, reverse):
+        if self.initialrange:
+            return self.initialrange[1 if reverse else 0]
+        return self.initialpos
+
     def search_next(self, wnd):
         self.option.text = self.get_search_str()
         if self.option.text:
             if not self.lastsearch:
-                if self.initialrange:
-                    pos = self.initialrange[0]
-                else:
-                    pos = self.initialpos
+                pos = self._get_startpos(False)
             else:
                 pos = self.lastsearch[1]
 
             if pos >= self.target.document.endpos():
                 return
 
-            ret = self.target.document.mode.search_next(self.target, pos, self.option)
-            self._show_searchresult(ret)
-            return ret
+            self._start_search(wnd, pos, False)
 
     def search_prev(self, wnd):
         self.option.text = self.get_search_str()
         if self.option.text:
             if not self.lastsearch:
-                if self.initialrange:
-                    pos = self.initialrange[1]
-                else:
-                    pos = self.initialpos
+                pos = self._get_startpos(True)
             else:
                 pos = self.lastsearch[0]
 
-            ret = self.target.document.mode.search_prev(self.target, pos, self.option)
-            self._show_searchresult(ret)
-            return ret
+            self._start_search(wnd, pos, True)
+
+    def _start_search(self, wnd, pos, reverse):
+        self.cancel_search()
+        task = self._get_searchindex().search(pos, reverse)
+
+        def on_finished(task):
+            if task.error:
+                kaa.app.messagebar.set_message(
+                    'Search failed: pattern is too complex')
+            elif wnd is None:
+                self.on_incsearch_finished(task.result)
+            else:
+                self.on_search_finished(wnd, task.result, reverse)
+
+        self._start_task(task, on_finished)
+
+    def _start_task(self, task, on_finished):
+        # Search runs in idle time not to block key inputs.
+        # on_finished(task) is called when the task is done.
+        self.cancel_search()
+        self.incpending = None
+        self.searchtask = (task, on_finished)
+        self._run_search()
+
+    def _run_search(self):
+        task, on_finished = self.searchtask
+        if task.step():
+            kaa.app.messagebar.set_message(
+                'Searching... {:.0%} (Esc to cancel)'.format(task.progress))
+            return True
+
+        self.searchtask = None
+        on_finished(task)
+        return False
+
+    def incsearch(self):
+        """Search text from incbase as typed. If the text is a literal
+        string and extends the text searched before, it cannot be found
+        before the previous hit, so the search restarts from the hit."""
+
+        self.incpending = None
+        text = self.option.text = self.get_search_str()
+        while self.incstates and not text.startswith(self.incstates[-1][0]):
+            self.incstates.pop()
+
+        if not text:
+            self.cancel_search()
+            self._clear_searchindex()
+            return
+
+        pos = self.incbase
+        if self.incstates and self.option.is_literal():
+            prevtext, hit = self.incstates[-1]
+            if prevtext == text:
+                self._show_searchresult(hit)
+                return
+            if not hit:
+                # longer text cannot be found if the prefix was not.
+                self._get_searchindex()
+                self.on_incsearch_finished(None)
+                return
+            pos = hit[0]
+
+        self._start_search(None, pos, False)
+
+    def on_incsearch_finished(self, hit):
+        self.incstates.append((self.option.text, hit))
+        self._show_searchresult(hit)
+
+    def cancel_search(self):
+        if self.searchtask:
+            task, on_finished = self.searchtask
+            task.cancel()
+            self.searchtask = None
+            return True
+
+    def on_search_finished(self, wnd, hit, reverse):
+        self._show_searchresult(hit)
+
+        # further typing extends the search from this hit.
+        self.incstates = []
+        if hit:
+            self.incbase = hit[0]
+
+    def on_idle(self):
+        ret = super().on_idle()
+        if self.incpending is not None and self.target:
+            if time.perf_counter() - self.incpending >= self.INCSEARCH_DELAY:
+                self.incsearch()
+            else:
+                ret = True
+        if self.searchtask and self._run_search():
+            ret = True
+        return ret
 
     def on_esc_pressed(self, wnd, event):
+        if self.cancel_search():
+            kaa.app.messagebar.set_message('Search canceled')
+            return
+
+        self._clear_searchindex()
         self.target.activate()
         self.target = None
         wnd.get_label('popup').destroy()
         self.document.close()
 
     def on_document_updated(self, pos, inslen, dellen):
-        if self.lastsearch:
-            newstr = self.get_search_str()
-            if newstr != self.option.text:
-                self.lastsearch = None
+        if 'searchtext' not in self.document.marks:
+            # dialog is being built
+            return
+
+        newstr = self.get_search_str()
+        if newstr != self.option.text:
+            self.lastsearch = None
+            self.cancel_search()
+
+            # search text updated. Incremental search runs after a while.
+            if not self.incremental:
+                return
+            if self.incbase is None:
+                self.incbase = self._get_startpos(False)
+            self.incpending = time.perf_counter()
 
 
 class ReplaceDlgMode(SearchDlgMode):
@@ -292,10 +457,15 @@ class ReplaceDlgMode(SearchDlgMode):
         msgdoc = msgboxmode.MsgBoxMode.show_msgbox(
             'Replace text?', ['&Yes', '&No', '&All', '&Cancel'], cb)
 
-    def search_next(self, wnd):
-        ret = super().search_next(wnd)
-        if ret:
-            self._show_replace_msg(wnd, self.replace_and_next, self.search_next)
+    def on_search_finished(self, wnd, hit, reverse):
+        super().on_search_finished(wnd, hit, reverse)
+        if hit:
+            if reverse:
+                self._show_replace_msg(wnd, self.replace_and_prev,
+                                       self.search_prev)
+            else:
+                self._show_replace_msg(wnd, self.replace_and_next,
+                                       self.search_next)
 
     def replace_and_next(self, wnd):
         if self.lastsearch:
@@ -308,11 +478,6 @@ class ReplaceDlgMode(SearchDlgMode):
             self.lastsearch = (f, f+len(newstr))
             self.search_next(wnd)
 
-    def search_prev(self, wnd):
-        ret = super().search_prev(wnd)
-        if ret:
-            self._show_replace_msg(wnd, self.replace_and_prev, self.search_prev)
-
     def replace_and_prev(self, wnd):
         if self.lastsearch:
             f, t = self.lastsearch
@@ -331,25 +496,37 @@ class ReplaceDlgMode(SearchDlgMode):
         self.lastsearch = None
         newstr = self.get_replace_str()
 
-        self.target.document.undo.beginblock()
-        pos = 0
-        n = 0
-        try:
-            while True:
-                ret = self.target.document.mode.search_next(self.target, pos, self.option)
-                if ret:
-                    f, t = ret
-                    self.target.document.mode.edit_commands.replace_string(
-                        self.target, f, t, newstr, update_cursor=False)
-                    self.lastsearch = (f, f+len(newstr))
-                    pos = self.lastsearch[1]
-                    n += 1
-                else:
-                    break
-        finally:
-            self.target.document.undo.endblock()
-
-        if self.lastsearch:
-            self.target.cursor.setpos(self.lastsearch[0])
+        # Matches are collected little by little in idle time, so that
+        # a long document or a complex pattern can be canceled.
+        start = time.perf_counter()
+        doc = self.target.document
+        task = searchindex.SearchTask(
+            searchindex.search_all(self.option.get_regex(), doc.buf))
+
+        def on_finished(task):
+            if task.error:
+                kaa.app.messagebar.set_message(
+                    'Replace failed: pattern is too complex')
+                return
+            self._replace_spans(task.result, newstr, start)
+
+        self._start_task(task, on_finished)
+
+    def _replace_spans(self, spans, newstr, start):
+        # Replace all matches with a single edit, so that the document
+        # is updated and an undo record is added at once.
+        doc = self.target.document
+        edits = [(f, t, newstr) for f, t in spans]
+        if edits:
+            doc.mode.edit_commands.apply_edits(self.target, edits)
+
+            delta = 0
+            for f, t, s in edits[:-1]:
+                delta += len(s) - (t-f)
+            f = edits[-1][0] + delta
+            self.lastsearch = (f, f+len(newstr))
+            self.target.cursor.setpos(f)
 
-        kaa.app.messagebar.set_message('Replaced {} time(s)'.format(n))
+        kaa.app.messagebar.set_message(
+            'Replaced {:,} time(s) in {:.2f} sec'.format(
+                len(edits), time.perf_counter() - start))
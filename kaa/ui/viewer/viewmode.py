@@ -0,0 +1,61 @@
+import kaa
+from kaa.command import Commands, command, norec
+from kaa.keyboard import *
+from kaa.filetype.default import defaultmode
+from kaa.filetype.default import keybind as default_keybind
+
+# search commands except replace
+view_search_keys = {
+    (ctrl, 's'): 'search.showsearch',
+    (alt, 'g'): 'search.showgrep',
+}
+
+
+class ViewCommands(Commands):
+    # The text is not saved, since it is not indexed to the end of the
+    # file yet.
+
+    @command('file.save')
+    @norec
+    def file_save(self, wnd, filename=None, saved=None, document=None):
+        kaa.app.messagebar.set_message('Read-only file cannot be saved')
+
+    @command('file.saveas')
+    @norec
+    def file_saveas(self, wnd, saved=None, document=None):
+        kaa.app.messagebar.set_message('Read-only file cannot be saved')
+
+    @command('search.showreplace')
+    @norec
+    def showreplace(self, wnd):
+        kaa.app.messagebar.set_message('Read-only file cannot be modified')
+
+
+class ViewMode(defaultmode.DefaultMode):
+    """Read-only view of a file too large to edit. The document has a
+    document.MappedBuffer, and the file is indexed in idle time. The text
+    grows as it is indexed."""
+
+    def init_keybind(self):
+        # text is not editable
+        self.keybind.add_keybind(default_keybind.app_keys)
+        self.keybind.add_keybind(default_keybind.cursor_keys)
+        self.keybind.add_keybind(default_keybind.emacs_keys)
+        self.keybind.add_keybind(view_search_keys)
+
+    def init_commands(self):
+        super().init_commands()
+        self.view_commands = ViewCommands()
+        self.register_command(self.view_commands)
+
+    def init_tokenizers(self):
+        self.tokenizers = []
+
+    def on_str(self, wnd, s):
+        pass
+
+    def on_idle(self):
+        ret = super().on_idle()
+        if not self.closed and self.document.buf.index():
+            ret = True
+        return ret
@@ -23,6 +23,9 @@ class _DmyWnd(context.Context):
     def on_document_updated(self, pos, inslen, dellen):
         self.screen.on_document_updated(pos, inslen, dellen)
 
+    def style_updated(self, posfrom, posto):
+        pass
+
     def linedown(self):
         return self.screen.linedown()
 
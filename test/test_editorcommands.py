@@ -96,3 +96,42 @@ class TestEdit(kaa_testutils._TestScreenBase):
         cmd.redo(wnd)
         assert wnd.document.gettext(0, 2) == 'bc'
         assert wnd.cursor.pos == 0
+
+    def test_undo_merged(self):
+        wnd = self._getwnd("")
+        cmd = editorcommand.EditCommands()
+
+        for c in 'abc\ndef':
+            cmd.put_string(wnd, c)
+        cmd.backspace(wnd)
+        cmd.backspace(wnd)
+
+        cmd.undo(wnd)
+        assert wnd.document.gettext(0, wnd.document.endpos()) == 'abc\ndef'
+        assert wnd.cursor.pos == 7
+
+        cmd.undo(wnd)
+        assert wnd.document.gettext(0, wnd.document.endpos()) == 'abc\n'
+        assert wnd.cursor.pos == 4
+
+        cmd.redo(wnd)
+        cmd.redo(wnd)
+        assert wnd.document.gettext(0, wnd.document.endpos()) == 'abc\nd'
+        assert wnd.cursor.pos == 5
+
+    def test_apply_edits(self):
+        wnd = self._getwnd("abc abc abc")
+        cmd = editorcommand.EditCommands()
+
+        wnd.cursor.setpos(6)
+        cmd.apply_edits(wnd, [(8, 11, 'x'), (0, 3, 'xyz1'), (4, 7, '')])
+        assert wnd.document.gettext(0, wnd.document.endpos()) == 'xyz1  x'
+        assert wnd.cursor.pos == 5
+
+        cmd.undo(wnd)
+        assert wnd.document.gettext(0, wnd.document.endpos()) == 'abc abc abc'
+        assert wnd.cursor.pos == 6
+
+        cmd.redo(wnd)
+        assert wnd.document.gettext(0, wnd.document.endpos()) == 'xyz1  x'
+        assert wnd.cursor.pos == 5
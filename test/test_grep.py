@@ -0,0 +1,105 @@
+import concurrent.futures
+from unittest.mock import patch
+import gappedbuf.re
+from kaa import grep, fileio
+from kaa.filetype.default import modebase
+from kaa.ui.grep import grepmode
+import kaa_testutils
+
+
+def _option(text, regex=False):
+    option = modebase.SearchOption()
+    option.text = text
+    option.ignorecase = False
+    option.regex = regex
+    return option
+
+
+def _maketree(tmp_path):
+    (tmp_path / 'a.txt').write_text('spam\nham spam\n')
+    (tmp_path / 'sub').mkdir()
+    (tmp_path / 'sub' / 'b.txt').write_bytes(b'egg\r\nspam\r\n')
+    (tmp_path / 'sub' / 'c.bin').write_bytes(b'spam\0')
+    (tmp_path / '.hidden').mkdir()
+    (tmp_path / '.hidden' / 'd.txt').write_text('spam')
+    return tmp_path
+
+
+class TestGrep:
+    def test_walk(self, tmp_path):
+        _maketree(tmp_path)
+        files = list(fileio.FileStorage().walk(str(tmp_path)))
+        assert files == [str(tmp_path / 'a.txt'),
+                         str(tmp_path / 'sub' / 'b.txt'),
+                         str(tmp_path / 'sub' / 'c.bin')]
+
+    def test_grep_file(self, tmp_path):
+        _maketree(tmp_path)
+        regex = _option('spam').get_regex()
+
+        assert grep.grep_file(regex, str(tmp_path / 'a.txt')) == [
+            (0, 1, 'spam'), (9, 2, 'ham spam')]
+
+        # newlines are translated as files opened in the editor
+        assert grep.grep_file(regex, str(tmp_path / 'sub' / 'b.txt')) == [
+            (4, 2, 'spam')]
+
+        # binary file
+        assert grep.grep_file(regex, str(tmp_path / 'sub' / 'c.bin')) == []
+
+    def test_grep_files(self, tmp_path):
+        (tmp_path / 'a.txt').write_text('a' * 30 + 'b')
+        with patch.object(grep.searchindex, 'SEARCH_MAXSTEPS', 1000):
+            ret = grep.grep_files(_option('(a+)+c', regex=True),
+                                  [str(tmp_path / 'a.txt')])
+        assert ret == [(str(tmp_path / 'a.txt'), [],
+                        'pattern is too complex')]
+
+    def test_grep_timeout(self, tmp_path):
+        (tmp_path / 'a.txt').write_text('spam\n' * 100)
+        with patch.object(grep, 'MAX_SEARCHTIME', 0), \
+                patch.object(grep.searchindex, 'SEARCH_CHUNK', 10):
+            ret = grep.grep_files(_option('ham'), [str(tmp_path / 'a.txt')])
+        assert ret == [(str(tmp_path / 'a.txt'), [], 'search timed out')]
+
+    def test_task(self, tmp_path):
+        _maketree(tmp_path)
+        executor = concurrent.futures.ProcessPoolExecutor(2)
+        task = grep.GrepTask(fileio.FileStorage(), _option('spam'),
+                             str(tmp_path), executor)
+
+        results = []
+        while task.step():
+            results.extend(task.get_results())
+        results.extend(task.get_results())
+
+        assert task.numfiles == 3
+        assert sorted(results) == [
+            (str(tmp_path / 'a.txt'), [(0, 1, 'spam'), (9, 2, 'ham spam')],
+             None),
+            (str(tmp_path / 'sub' / 'b.txt'), [(4, 2, 'spam')], None)]
+
+
+class TestGrepMode(kaa_testutils._TestDocBase):
+
+    @patch('kaa.app', create=True)
+    def test_grepmode(self, mock, tmp_path):
+        _maketree(tmp_path)
+        mock.storage = fileio.FileStorage()
+
+        doc = grepmode.GrepMode.build(
+            _option('spam'), str(tmp_path),
+            concurrent.futures.ThreadPoolExecutor(1))
+        while doc.mode.on_idle():
+            pass
+
+        lines = doc.gettext(0, doc.endpos()).splitlines()
+        assert lines[0] == "Search 'spam' in {}".format(tmp_path)
+        assert sorted(lines[1:]) == [
+            'a.txt:1: spam', 'a.txt:2: ham spam', 'sub/b.txt:2: spam']
+        mock.messagebar.set_message.assert_called_with(
+            '3 matches in 2 files')
+
+        assert doc.mode.get_hit(0) is None
+        pos = doc.getlinepos(lines.index('a.txt:2: ham spam'))
+        assert doc.mode.get_hit(pos+3) == (str(tmp_path / 'a.txt'), 9)
@@ -19,6 +19,24 @@ class TestKeyword(kaa_testutils._TestDocBase):
             (12, 13, 0)
         ] == list((f, t, style) for f, t, style in hl.highlight(doc, 0))
 
+    def test_keyword_span(self):
+        kwds = highlight.Keywords('keywords', 'keyword', ['if', 'in'])
+        span = highlight.Span('str', 'style', '"', '"')
+        tokenizer = highlight.Tokenizer([kwds, span])
+
+        doc = self._getdoc('if "in" ifin in')
+        hl = highlight.Highlighter(tokenizers=[tokenizer])
+
+        assert [
+            (0, 2, kwds.keywordtoken),
+            (2, 3, 0),
+            (3, 4, span.span_start),
+            (4, 6, span.span_mid),
+            (6, 7, span.span_end),
+            (7, 13, 0),
+            (13, 15, kwds.keywordtoken),
+        ] == list((f, t, style) for f, t, style in hl.highlight(doc, 0))
+
     def test_keyword_resume(self):
         kwds = highlight.Keywords('keywords', 'style', ['if', 'while', 'for'])
         tokenizer = highlight.Tokenizer([kwds])
@@ -81,6 +99,39 @@ class TestKeyword(kaa_testutils._TestDocBase):
             (0, 1, 1),
             (1, 10, 2),] == ret
 
+    def test_span_steplimit(self, monkeypatch):
+        monkeypatch.setattr(highlight.Tokenizer, 'MAXSTEPS', 1000)
+        span = highlight.Span('str', 'style', '"', '(a+)+"')
+        tokenizer = highlight.Tokenizer([span])
+        hl = highlight.Highlighter(tokenizers=[tokenizer])
+
+        doc = self._getdoc('"' + 'a' * 30 + '\n"a"')
+        ret = list((f, t, style) for f, t, style in hl.highlight(doc, 0))
+        assert [
+            (0, 1, span.span_start),
+            (1, 32, span.span_mid),
+            (32, 33, span.span_start),
+            (33, 35, span.span_end),] == ret
+
+    def test_start_steplimit(self, monkeypatch):
+        monkeypatch.setattr(highlight.Tokenizer, 'MAXSTEPS', 1000)
+        # keywords searched with regular expression
+        class RegexKeywords(highlight.Keywords):
+            def multimatcher(self):
+                return None
+
+        kwds = RegexKeywords('keywords', 'keyword', ['(a+)+b'])
+        tokenizer = highlight.Tokenizer([kwds])
+        hl = highlight.Highlighter(tokenizers=[tokenizer])
+
+        doc = self._getdoc('ab\n' + 'a' * 30 + '\nab')
+        ret = list((f, t, style) for f, t, style in hl.highlight(doc, 0))
+        assert [
+            (0, 2, kwds.keywordtoken),
+            (2, 3, 0),
+            (3, 34, 0),
+            (34, 36, kwds.keywordtoken),] == ret
+
     def test_span_resume(self):
         span = highlight.Span('str', 'style', '"', '"', None)
         tokenizer = highlight.Tokenizer([span])
@@ -0,0 +1,115 @@
+from unittest.mock import patch
+from kaa import fileio, journal, screen, cursor
+import kaa_testutils
+
+
+class TestJournal:
+    def _openwnd(self, filename):
+        doc = fileio.openfile(filename)
+
+        scrn = screen.Screen()
+        scrn.set_document(doc)
+        scrn.setsize(10, 30)
+        wnd = kaa_testutils._DmyWnd(scrn)
+        wnd.document = doc
+        doc.add_window(wnd)
+        wnd.cursor = cursor.Cursor(wnd)
+        return wnd
+
+    def _recover(self, filename, answer='y'):
+        with patch.object(fileio.msgboxmode.MsgBoxMode,
+                          'show_msgbox') as msgbox:
+            wnd = self._openwnd(filename)
+        assert msgbox.called
+        callback = msgbox.call_args[0][2]
+        callback(answer)
+        return wnd
+
+    def _gettext(self, wnd):
+        return wnd.document.gettext(0, wnd.document.endpos())
+
+    @patch('kaa.app', create=True)
+    def test_recover(self, mock, tmp_path):
+        mock.storage = fileio.FileStorage()
+        filename = str(tmp_path / 'a.txt')
+        (tmp_path / 'a.txt').write_text('abc\n')
+
+        with patch.object(journal, 'JOURNAL_DIR', str(tmp_path / 'j')):
+            wnd = self._openwnd(filename)
+            cmd = wnd.document.mode.edit_commands
+            for c in 'xyz':
+                cmd.put_string(wnd, c)
+            cmd.backspace(wnd)
+            cmd.apply_edits(wnd, [(3, 4, 'C')])
+            cmd.undo(wnd)
+            cmd.undo(wnd)
+            cmd.redo(wnd)
+            wnd.document.undo.journal.flush()
+
+            # edits are recovered from the journal of crashed session
+            wnd2 = self._recover(filename)
+            assert self._gettext(wnd2) == self._gettext(wnd) == 'xyabc\n'
+            assert wnd2.document.undo.is_dirty()
+
+            cmd2 = wnd2.document.mode.edit_commands
+            cmd2.redo(wnd2)
+            assert self._gettext(wnd2) == 'xyaCc\n'
+            cmd2.undo(wnd2)
+            cmd2.undo(wnd2)
+            assert self._gettext(wnd2) == 'xyzabc\n'
+            cmd2.undo(wnd2)
+            assert self._gettext(wnd2) == 'abc\n'
+            assert not wnd2.document.undo.can_undo()
+
+    @patch('kaa.app', create=True)
+    def test_save(self, mock, tmp_path):
+        mock.storage = fileio.FileStorage()
+        filename = str(tmp_path / 'a.txt')
+        (tmp_path / 'a.txt').write_text('abc\n')
+
+        with patch.object(journal, 'JOURNAL_DIR', str(tmp_path / 'j')):
+            wnd = self._openwnd(filename)
+            cmd = wnd.document.mode.edit_commands
+            cmd.put_string(wnd, '1\n')
+            fileio.FileStorage().save_document(filename, wnd.document)
+            wnd.document.mode.edit_commands.put_string(wnd, '2')
+            wnd.document.undo.journal.flush()
+
+            # history before save is recovered
+            wnd2 = self._recover(filename)
+            assert self._gettext(wnd2) == '1\n2abc\n'
+            cmd2 = wnd2.document.mode.edit_commands
+            cmd2.undo(wnd2)
+            assert not wnd2.document.undo.is_dirty()
+            cmd2.undo(wnd2)
+            assert self._gettext(wnd2) == 'abc\n'
+
+            # journal is discarded
+            wnd3 = self._recover(filename, 'n')
+            assert self._gettext(wnd3) == '1\nabc\n'
+            wnd3.document.undo.journal.flush()
+            assert journal.read_journal(filename) is None
+
+    def test_read_journal(self, tmp_path):
+        filename = str(tmp_path / 'a.txt')
+        (tmp_path / 'a.txt').write_text('abc\n')
+
+        with patch.object(journal, 'JOURNAL_DIR', str(tmp_path / 'j')):
+            assert journal.read_journal(filename) is None
+
+            j = journal.Journal(filename)
+            j.write('insert', 0, 0, '\udcff', 0, 1)
+            j.write('undo')
+            j.flush()
+            j.close()
+
+            # broken record written at crash is ignored
+            with open(journal.get_journalname(filename), 'a') as f:
+                f.write('["redo"')
+
+            assert journal.read_journal(filename) == [
+                ['insert', 0, 0, '\udcff', 0, 1], ['undo']]
+
+            # the file was modified after the journal started
+            (tmp_path / 'a.txt').write_text('abcd\n')
+            assert journal.read_journal(filename) is None
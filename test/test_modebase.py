@@ -29,7 +29,7 @@ class TestModeBase(kaa_testutils._TestScreenBase):
     def test_search_next(self):
         w = self._getwnd('abcdefgabcdefg/efg/EFG')
 
-        opt = defaultmode.SearchOption()
+        opt = modebase.SearchOption()
         opt.text = 'EFG'
         opt.ignorecase = True
         opt.word = False
@@ -56,8 +56,20 @@ class TestModeBase(kaa_testutils._TestScreenBase):
         ret = w.document.mode.search_next(w, 0, opt)
         assert ret is None
 
+        opt.text = 'xyz EFG cde'
+        opt.word = False
+        opt.anyword = True
+        ret = w.document.mode.search_next(w, 0, opt)
+        assert ret == (2, 5)
+        ret = w.document.mode.search_next(w, 12, opt)
+        assert ret == (19, 22)
 
-    def test_search_next(self):
+        opt.word = True
+        ret = w.document.mode.search_next(w, 0, opt)
+        assert ret == (19, 22)
+
+
+    def test_search_prev(self):
         w = self._getwnd('abcdefgabcdefg/efg/EFG01234567890')
 
         opt = modebase.SearchOption()
@@ -74,3 +86,19 @@ class TestModeBase(kaa_testutils._TestScreenBase):
         opt.regex = False
         ret = w.document.mode.search_prev(w, endpos, opt)
         assert ret is None
+
+        opt.text = 'efg'
+        opt.ignorecase = False
+        ret = w.document.mode.search_prev(w, endpos, opt)
+        assert ret == (15, 18)
+        ret = w.document.mode.search_prev(w, 18, opt)
+        assert ret == (11, 14)
+        ret = w.document.mode.search_prev(w, 0, opt)
+        assert ret is None
+
+        opt.text = 'bcd efg'
+        opt.anyword = True
+        ret = w.document.mode.search_prev(w, 18, opt)
+        assert ret == (11, 14)
+        ret = w.document.mode.search_prev(w, 12, opt)
+        assert ret == (8, 11)
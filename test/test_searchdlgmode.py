@@ -1,4 +1,5 @@
 from unittest.mock import patch
+from kaa import searchindex
 from kaa.ui.searchdlg import searchdlgmode
 import kaa_testutils
 
@@ -14,14 +15,17 @@ class TestSearchDlgMode(kaa_testutils._TestDocBase):
         ignorecase = doc.mode.option.ignorecase
         word = doc.mode.option.word
         regex = doc.mode.option.regex
+        anyword = doc.mode.option.anyword
 
         doc.mode.toggle_option_ignorecase(None)
         doc.mode.toggle_option_word(None)
         doc.mode.toggle_option_regex(None)
+        doc.mode.toggle_option_anyword(None)
 
         assert ignorecase != doc.mode.option.ignorecase
         assert word != doc.mode.option.word
         assert regex != doc.mode.option.regex
+        assert anyword != doc.mode.option.anyword
 
         pos = doc.marks['searchtext']
         doc.insert(pos[0], 'test string')
@@ -35,12 +39,87 @@ class TestSearchDlgMode(kaa_testutils._TestDocBase):
         option.ignorecase = False
         option.word = False
         option.regex = False
+        option.anyword = False
         pos = doc.marks['searchtext']
         doc.insert(pos[0], 'test string')
 
         doc.mode.target.document.append('012345test string')
         doc.mode.search_next(None)
         assert doc.mode.target.screen.selection.get_range() == (6, 17)
+        mock.messagebar.set_message.assert_called_with('match 1 of 1')
+
+    @patch('kaa.app', create=True)
+    def test_search_anyword(self, mock):
+        doc = self._getdoc('')
+        option = doc.mode.option
+        option.ignorecase = False
+        option.word = True
+        option.regex = False
+        option.anyword = True
+        pos = doc.marks['searchtext']
+        doc.insert(pos[0], 'spam ham')
+
+        doc.mode.target.document.append('hams ham spam')
+        doc.mode.search_next(None)
+        assert doc.mode.target.screen.selection.get_range() == (5, 8)
+        doc.mode.search_next(None)
+        assert doc.mode.target.screen.selection.get_range() == (9, 13)
+
+    @patch('kaa.app', create=True)
+    def test_incsearch(self, mock):
+        doc = self._getdoc('')
+        option = doc.mode.option
+        option.ignorecase = False
+        option.word = False
+        option.regex = False
+        option.anyword = False
+        target = doc.mode.target
+        target.document.append('ab ax abc abd')
+
+        def type_text(s):
+            f, t = doc.marks['searchtext']
+            doc.replace(f, t, s)
+            doc.mode.incsearch()
+            while doc.mode.searchtask:
+                doc.mode.on_idle()
+            return target.screen.selection.get_range()
+
+        assert type_text('a') == (0, 1)
+        assert type_text('ab') == (0, 2)
+        assert type_text('abc') == (6, 9)
+        assert doc.mode.incstates[-1] == ('abc', (6, 9))
+
+        # not searched since the shorter text was not found
+        assert type_text('abcx') == (6, 9)
+        mock.messagebar.set_message.assert_called_with('not found')
+        with patch.object(doc.mode, '_start_search') as start:
+            type_text('abcxy')
+            assert not start.called
+
+            # previous result is reused
+            assert type_text('ab') == (0, 2)
+            assert not start.called
+
+        # search next and continue typing from the hit
+        doc.mode.search_next(None)
+        while doc.mode.searchtask:
+            doc.mode.on_idle()
+        assert target.screen.selection.get_range() == (6, 8)
+        assert type_text('abd') == (10, 13)
+
+    @patch('kaa.app', create=True)
+    def test_incsearch_delay(self, mock):
+        doc = self._getdoc('')
+        doc.mode.target.document.append('abc')
+
+        with patch.object(doc.mode, 'incsearch') as incsearch:
+            doc.insert(doc.marks['searchtext'][0], 'b')
+            assert doc.mode.on_idle()
+            assert not incsearch.called
+
+            doc.mode.INCSEARCH_DELAY = 0
+            doc.mode.on_idle()
+            assert incsearch.called
 
 
 class TestReplaceDlg(kaa_testutils._TestDocBase):
@@ -76,6 +155,7 @@ class TestReplaceDlg(kaa_testutils._TestDocBase):
         option.ignorecase = False
         option.word = False
         option.regex = False
+        option.anyword = False
         pos = doc.marks['searchtext']
         doc.insert(pos[0], 'test string')
 
@@ -83,3 +163,62 @@ class TestReplaceDlg(kaa_testutils._TestDocBase):
         doc.mode.search_next(None)
         assert doc.mode.target.screen.selection.get_range() == (6, 17)
 
+
+    @patch('kaa.app', create=True)
+    def test_replace_all(self, mock):
+        doc = self._getdoc('')
+        option = doc.mode.option
+        option.ignorecase = False
+        option.word = False
+        option.regex = False
+        option.anyword = False
+        doc.insert(doc.marks['searchtext'][0], 'abc')
+        doc.insert(doc.marks['replacetext'][0], 'XY')
+
+        target = doc.mode.target
+        target.document.append('abc-abc-ab-abc')
+        doc.mode.replace_all(None)
+
+        assert target.document.gettext(0, target.document.endpos()) == \
+            'XY-XY-ab-XY'
+        assert doc.mode.lastsearch == (9, 11)
+        assert target.cursor.pos == 9
+        msg = mock.messagebar.set_message.call_args[0][0]
+        assert msg.startswith('Replaced 3 time(s)')
+
+        # replaced at once
+        target.document.mode.edit_commands.undo(target)
+        assert target.document.gettext(0, target.document.endpos()) == \
+            'abc-abc-ab-abc'
+
+    @patch('kaa.app', create=True)
+    def test_replace_all_cancel(self, mock):
+        doc = self._getdoc('')
+        option = doc.mode.option
+        option.ignorecase = False
+        option.word = False
+        option.regex = False
+        option.anyword = False
+        doc.insert(doc.marks['searchtext'][0], 'abc')
+        doc.insert(doc.marks['replacetext'][0], 'XY')
+
+        target = doc.mode.target
+        target.document.append('abc-' * 100)
+
+        # matches are collected in idle time
+        with patch.object(searchindex, 'SEARCH_CHUNK', 10), \
+                patch.object(searchindex.SearchTask, 'STEP_TIME', 0):
+            doc.mode.replace_all(None)
+            assert doc.mode.searchtask
+            doc.mode.on_esc_pressed(None, None)
+            mock.messagebar.set_message.assert_called_with('Search canceled')
+            assert not doc.mode.searchtask
+            assert target.document.gettext(0, 8) == 'abc-abc-'
+
+            doc.mode.replace_all(None)
+            while doc.mode.searchtask:
+                doc.mode.on_idle()
+
+        assert target.document.gettext(0, 6) == 'XY-XY-'
+        msg = mock.messagebar.set_message.call_args[0][0]
+        assert msg.startswith('Replaced 100 time(s)')
@@ -0,0 +1,195 @@
+import gappedbuf.re
+from kaa import searchindex
+from kaa.filetype.default import modebase
+import kaa_testutils
+
+
+class TestSearchRange:
+    def test_search_range(self, monkeypatch):
+        monkeypatch.setattr(searchindex, 'SEARCH_OVERLAP', 3)
+        buf = kaa_testutils._TestDocBase()._getbuf('abc abcd abcde')
+        option = modebase.SearchOption()
+        option.text = r'\w+$'
+        option.regex = True
+        regex = option.get_regex()
+
+        # match at the end of range is checked with whole text
+        assert searchindex.search_range(regex, buf, 0, 5) is None
+        assert searchindex.search_range(regex, buf, 0, 9).span() == (9, 14)
+
+    def _run(self, gen):
+        task = searchindex.SearchTask(gen)
+        while task.step():
+            pass
+        return task.result
+
+    def test_search(self, monkeypatch):
+        monkeypatch.setattr(searchindex, 'SEARCH_CHUNK', 10)
+        monkeypatch.setattr(searchindex, 'SEARCH_OVERLAP', 10)
+        buf = kaa_testutils._TestDocBase()._getbuf(
+            'a' * 100 + ' abcdefghijklmn ' + 'a' * 100)
+        option = modebase.SearchOption()
+        option.text = r'ab\w+'
+        option.regex = True
+        regex = option.get_regex()
+
+        assert self._run(searchindex.search_forward(regex, buf, 0)) == (
+            101, 115)
+        assert self._run(searchindex.search_forward(regex, buf, 102)) is None
+        assert self._run(searchindex.search_backward(regex, buf, 200)) == (
+            101, 115)
+        assert self._run(searchindex.search_backward(regex, buf, 115)) is None
+        assert self._run(searchindex.search_backward(regex, buf, 116)) == (
+            101, 115)
+
+        # match across chunks
+        option.text = r'a\w+'
+        regex = option.get_regex()
+        assert self._run(searchindex.search_backward(regex, buf, 100)) is None
+        assert self._run(searchindex.search_backward(regex, buf, 101)) == (
+            0, 100)
+
+        # tail of a match in the middle of chunk
+        buf = kaa_testutils._TestDocBase()._getbuf(' ' + 'ab' * 20)
+        assert self._run(searchindex.search_backward(regex, buf, 42)) == (
+            1, 41)
+
+        # the match doesn't depend on where chunks start
+        buf = kaa_testutils._TestDocBase()._getbuf(('c' + 'a' * 9) * 5)
+        option.text = 'c[^c]*c'
+        regex = option.get_regex()
+        for pos in range(32, 51):
+            assert self._run(searchindex.search_backward(regex, buf, pos)) == (
+                20, 31)
+        assert self._run(searchindex.search_backward(regex, buf, 31)) == (
+            0, 11)
+
+    def test_search_all(self, monkeypatch):
+        monkeypatch.setattr(searchindex, 'SEARCH_CHUNK', 10)
+        buf = kaa_testutils._TestDocBase()._getbuf(
+            'ab ' * 20 + ' ' * 30 + 'ab')
+        for text in (r'\w+', r'b*', r'\s+$'):
+            regex = gappedbuf.re.compile(text)
+            assert self._run(searchindex.search_all(regex, buf)) == [
+                m.span() for m in regex.finditer(buf)]
+        assert self._run(searchindex.search_all(regex, buf, 100)) == []
+
+    def test_cancel(self, monkeypatch):
+        monkeypatch.setattr(searchindex, 'SEARCH_CHUNK', 10)
+        buf = kaa_testutils._TestDocBase()._getbuf('a' * 1000)
+        option = modebase.SearchOption()
+        option.text = 'b'
+        task = searchindex.SearchTask(
+            searchindex.search_forward(option.get_regex(), buf, 0))
+        task.STEP_TIME = 0
+        assert task.step()
+        assert 0 < task.progress < 1
+        task.cancel()
+        assert not task.step()
+        assert task.result is None
+
+
+class TestSearchIndex(kaa_testutils._TestDocBase):
+    def _getindex(self, doc, text):
+        option = modebase.SearchOption()
+        option.text = text
+        doc.searchindex = searchindex.SearchIndex(doc, option)
+        while doc.searchindex.build():
+            pass
+        return doc.searchindex
+
+    def _matches(self, doc, index):
+        regex = index.regex
+        return [m.span() for m in regex.finditer(doc.buf)]
+
+    def _search(self, index, pos, reverse=False):
+        task = index.search(pos, reverse)
+        while task.step():
+            pass
+        return task.result
+
+    def test_build(self):
+        doc = self._getdoc('abc abc\nabc\n' * 100)
+        index = self._getindex(doc, 'ABC')
+
+        assert index.completed
+        assert index.count() == 300
+        assert list(index.iter_spans(0, doc.endpos())) == self._matches(
+            doc, index)
+
+        assert self._search(index, 1) == (4, 7)
+        assert self._search(index, 7, True) == (0, 3)
+        assert self._search(index, 8, True) == (4, 7)
+        assert index.index((4, 7)) == 1
+        assert index.index((5, 7)) is None
+
+    def test_partial(self, monkeypatch):
+        monkeypatch.setattr(searchindex, 'SEARCH_CHUNK', 100)
+        doc = self._getdoc('abc abc\nabc\n' * 1000)
+        option = modebase.SearchOption()
+        option.text = 'abc'
+        index = searchindex.SearchIndex(doc, option)
+        index.BUILD_TIME = 0
+        assert index.build()
+        assert not index.completed
+        assert 0 < index.count() < 3000
+
+        # matches not indexed yet are searched
+        pos = index.scanned + 1
+        f = doc.buf[:].index('abc', pos)
+        assert self._search(index, pos) == (f, f+3)
+        f = doc.buf[:].rindex('abc', 0, doc.endpos()-1)
+        assert self._search(index, doc.endpos(), True) == (f, f+3)
+
+    def test_update(self):
+        doc = self._getdoc('abc abc\nabc\n' * 100)
+        index = self._getindex(doc, 'abc')
+
+        doc.insert(5, 'x')
+        assert index.count() == 299
+        doc.delete(5, 6)
+        assert index.count() == 300
+        doc.replace(100, 200, 'ABC')
+        doc.insert(0, 'ab')
+        doc.insert(2, 'c')
+        doc.insert(doc.endpos(), 'abc')
+        assert list(index.iter_spans(0, doc.endpos())) == self._matches(
+            doc, index)
+
+    def test_update_regex(self):
+        doc = self._getdoc('a1 a22 a333\n' * 10)
+        option = modebase.SearchOption()
+        option.text = r'a\d+'
+        option.regex = True
+        doc.searchindex = index = searchindex.SearchIndex(doc, option)
+        while index.build():
+            pass
+
+        doc.insert(4, '9\n')
+        doc.delete(20, 23)
+        doc.insert(11, 'a')
+        assert list(index.iter_spans(0, doc.endpos())) == self._matches(
+            doc, index)
+
+    def test_steplimit(self, monkeypatch):
+        monkeypatch.setattr(searchindex, 'SEARCH_MAXSTEPS', 1000)
+        doc = self._getdoc('ab ' + 'a' * 30 + ' ab')
+        option = modebase.SearchOption()
+        option.text = r'(a+)+b'
+        option.regex = True
+        doc.searchindex = index = searchindex.SearchIndex(doc, option)
+        assert not index.build()
+        assert index.failed
+        assert index.count() == 0
+
+        # matches before the complex part are still found.
+        assert self._search(index, 0) == (0, 2)
+
+        task = index.search(1)
+        while task.step():
+            pass
+        assert task.result is None
+        assert isinstance(task.error, gappedbuf.re.StepLimitError)
+
+        doc.insert(0, 'ab')
+        assert index.count() == 0
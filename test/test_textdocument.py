@@ -1,4 +1,7 @@
-from kaa import document
+import pytest
+from unittest.mock import patch
+from kaa import document, fileio, screen
+from kaa.ui.viewer import viewmode
 import kaa_testutils
 
 
@@ -32,6 +35,48 @@ class TestDocument(kaa_testutils._TestScreenBase):
         assert doc.getline(0) == (5, 'abc\r\n')
         assert doc.getline(5) == (8, 'def')
 
+    def test_lineno(self):
+        doc = self._getdoc('abc\ndef\n')
+        assert doc.linecount() == 3
+        assert doc.getlineno(0) == 0
+        assert doc.getlineno(4) == 1
+        assert doc.getlineno(8) == 2
+        assert doc.getlinepos(1) == 4
+
+        doc.insert(4, '012\n')
+        assert doc.linecount() == 4
+        assert doc.getlinepos(2) == 8
+        assert doc.geteol(4) == 8
+
+        doc.replace(2, 6, 'x')
+        assert doc.gettext(0, doc.endpos()) == 'abx2\ndef\n'
+        assert doc.linecount() == 3
+        assert doc.getlinepos(1) == 5
+
+    def test_apply_edits(self):
+        doc = self._getdoc('abc\ndef\nghi\n')
+        updates = []
+        doc.buf.add_listener(lambda buf, deltas: updates.append(deltas))
+
+        doc.marks['mark1'] = 5
+        doc.styles.setints(4, 7, 1)
+        wndupdates = []
+        with patch.object(doc.mode, 'on_document_updated',
+                          lambda *args: wndupdates.append(args)):
+            doc.apply_edits([(9, 10, 'XY\n'), (1, 2, '')])
+        assert doc.gettext(0, doc.endpos()) == 'ac\ndef\ngXY\ni\n'
+        # listeners are notified once of all edits
+        assert updates == [[(1, 0, 1), (8, 3, 1)]]
+        assert wndupdates == [(1, 10, 9)]
+        assert doc.linecount() == 5
+        assert doc.getlinepos(3) == 11
+        assert len(doc.styles) == doc.endpos()
+
+        # marks and styles between edits are shifted by the edits before
+        assert doc.marks['mark1'] == 4
+        assert doc.styles.getints(0, doc.endpos()) == (
+            [0, 0, 0] + [1, 1, 1] + [0] * 7)
+
     def test_style(self):
         assert len(self._getdoc('').styles) == 0
         assert len(self._getdoc('abcde').styles) == 5
@@ -94,6 +139,31 @@ class TestDocument(kaa_testutils._TestScreenBase):
         assert doc.get_prevpos(5) == 0
         assert doc.get_prevpos(6) == 5
 
+    def test_transaction(self):
+        doc = self._getdoc('0123456789')
+        doc.marks['mark1'] = 5
+        updates = []
+        doc.mode.on_document_updated = lambda *args: updates.append(args)
+
+        with doc.transaction():
+            doc.insert(8, 'ab')
+            with doc.transaction():
+                doc.delete(1, 3)
+            assert updates == []
+
+        assert doc.gettext(0, doc.endpos()) == '034567ab89'
+        assert updates == [(1, 7, 7)]
+        assert doc.marks['mark1'] == 3
+
+        doc.insert(0, 'x')
+        assert updates[-1] == (0, 1, 0)
+
+class TestRopeDocument(TestDocument):
+    def _getbuf(self, s=''):
+        buf = document.RopeBuffer()
+        buf.insert(0, s)
+        return buf
+
 class TestMark(kaa_testutils._TestDocBase):
     def test_mark(self):
         doc = self._getdoc('01234567890123456789')
@@ -144,6 +214,23 @@ class TestMark(kaa_testutils._TestDocBase):
         doc.delete(1, 4)
         assert doc.marks['mark1'] == (1, 1)
 
+    def test_find(self):
+        doc = self._getdoc('01234567890123456789')
+        doc.marks['mark1'] = 5
+        doc.marks['mark2'] = (1, 8)
+        doc.marks['mark3'] = (12, 15)
+        doc.marks['mark4'] = None
+
+        assert doc.marks.find(0, 20) == ['mark2', 'mark1', 'mark3']
+        assert doc.marks.find(5, 12) == ['mark1', 'mark2', 'mark3']
+        assert doc.marks.find(9, 11) == []
+
+        doc.marks['mark1'] = 13
+        del doc.marks['mark3']
+        assert doc.marks.find(8, 20) == ['mark2', 'mark1']
+        assert dict(doc.marks) == {'mark1': 13, 'mark2': (1, 8),
+                                   'mark4': None}
+
 class TestUndo:
     def test_undo(self):
         undo = document.Undo()
@@ -290,3 +377,192 @@ class TestUndo:
         assert (('8', (), {}),) == tuple(undo.redo())
         assert undo.is_dirty()
 
+
+    def test_merge(self):
+        undo = document.Undo()
+        for i, c in enumerate('ab\ncd'):
+            undo.add_insert('ins', i, c, i, i+1)
+
+        # insertions are merged until a line break
+        assert (('ins', (3, 'cd', 3, 5), {}),) == tuple(undo.undo())
+        assert (('ins', (0, 'ab\n', 0, 3), {}),) == tuple(undo.undo())
+        assert (('ins', (0, 'ab\n', 0, 3), {}),) == tuple(undo.redo())
+
+        # backward and forward deletions
+        undo.add_delete('del', 2, 3, 'c', 3, 2)
+        undo.add_delete('del', 1, 2, 'é', 2, 1)
+        undo.add_delete('del', 1, 2, 'd', 1, 1)
+        assert (('del', (1, 4, 'écd', 3, 1), {}),) == tuple(undo.undo())
+
+        # not merged with the action before save
+        undo.add_insert('ins', 0, 'x', 0, 1)
+        undo.saved()
+        undo.add_insert('ins', 1, 'y', 1, 2)
+        assert (('ins', (1, 'y', 1, 2), {}),) == tuple(undo.undo())
+        assert not undo.is_dirty()
+
+    def test_maxsize(self):
+        undo = document.Undo(maxsize=1000)
+        undo.add('action1', 'x'*200)
+        undo.saved()
+        for i in range(100):
+            undo.add_insert('ins', i*2, 'a\n', i*2, i*2+2)
+
+        stats = undo.stats()
+        assert stats['size'] == undo.getsize() <= 1000
+        assert stats['dropped'] + stats['actions'] == 101
+        assert stats['textsize'] == stats['actions'] * 2
+
+        assert undo.is_dirty()
+        assert (('ins', (198, 'a\n', 198, 200), {}),) == tuple(undo.undo())
+        while undo.can_undo():
+            tuple(undo.undo())
+        assert undo.is_dirty()
+
+    def test_block_size(self):
+        undo = document.Undo()
+        undo.beginblock()
+        undo.add_insert('ins', 0, 'abc', 0, 3)
+        undo.add('action1', 'x'*100)
+        size = undo.getsize()
+        undo.endblock()
+        assert undo.getsize() > size
+
+
+class TestMappedBuffer:
+    def _getbuf(self, tmp_path, b):
+        (tmp_path / 'a.txt').write_bytes(b)
+        with patch.object(document, 'MAPPED_PAGESIZE', 5):
+            buf = document.MappedBuffer(str(tmp_path / 'a.txt'))
+            while buf.index():
+                pass
+        return buf
+
+    def test_text(self, tmp_path):
+        b = 'aあ\r\nb\r\rcd\n\n'.encode() + b'\xff' + 'い\r\n'.encode()
+        buf = self._getbuf(tmp_path, b*3)
+        s = 'aあ\nb\n\ncd\n\n\udcffい\n' * 3
+        assert buf[:] == s
+
+        # pages don't split characters or CRLF
+        for p, chunk in buf.iterchunks(0, len(buf)):
+            assert chunk == s[p:p+len(chunk)]
+
+        lines = document.Buffer()
+        lines.insert(0, s)
+        lines = lines.lines
+        assert buf.lines.linecount() == lines.linecount()
+        for pos in range(len(s)+1):
+            assert buf.lines.pos_to_line(pos) == lines.pos_to_line(pos)
+            assert buf.lines.gettol(pos) == lines.gettol(pos)
+            assert buf.lines.geteol(pos) == lines.geteol(pos)
+        for lineno in range(lines.linecount()):
+            assert buf.lines.line_to_pos(lineno) == lines.line_to_pos(lineno)
+
+        assert self._getbuf(tmp_path, b'')[:] == ''
+
+    def test_encoding(self, tmp_path):
+        for encoding in ('utf-8', 'latin-1', 'cp1251', 'ascii'):
+            assert document.MappedBuffer.supports(encoding)
+        for encoding in ('shift_jis', 'euc-jp', 'utf-16', 'cp037', 'base64',
+                         'unknown'):
+            assert not document.MappedBuffer.supports(encoding)
+
+        s = 'caf\xe9 \xe0\r\n' * 5
+        (tmp_path / 'a.txt').write_bytes(s.encode('latin-1'))
+        with patch.object(document, 'MAPPED_PAGESIZE', 5):
+            buf = document.MappedBuffer(str(tmp_path / 'a.txt'), 'latin-1')
+            while buf.index():
+                pass
+        assert buf[:] == s.replace('\r\n', '\n')
+
+        with pytest.raises(ValueError):
+            document.MappedBuffer(str(tmp_path / 'a.txt'), 'shift_jis')
+
+    def test_index(self, tmp_path):
+        (tmp_path / 'a.txt').write_text('0123456789\n' * 3)
+        with patch.object(document, 'MAPPED_PAGESIZE', 5):
+            doc = document.Document(
+                document.MappedBuffer(str(tmp_path / 'a.txt')))
+        with patch('kaa.app', create=True):
+            doc.setmode(viewmode.ViewMode())
+
+        updates = []
+        doc.buf.add_listener(lambda buf, deltas: updates.extend(deltas))
+        assert doc.endpos() == 5
+        assert doc.linecount() == 1
+
+        # indexed pages are appended to the text
+        doc.buf.index(maxpages=2)
+        assert updates == [(5, 10, 0)]
+        assert doc.gettext(0, doc.endpos()) == '0123456789\n0123'
+        assert doc.linecount() == 2
+
+        with patch.object(document.MappedBuffer, 'INDEX_TIME', 10):
+            assert not doc.buf.index()
+        assert doc.endpos() == 33
+        assert len(doc.styles) == 33
+
+        with pytest.raises(BufferError):
+            doc.insert(0, 'a')
+
+    @patch('kaa.app', create=True)
+    def test_openfile(self, mock, tmp_path):
+        mock.storage = fileio.FileStorage()
+        (tmp_path / 'a.txt').write_text('abc\n' * 10)
+
+        with patch.object(fileio, 'VIEW_FILESIZE', 4):
+            doc = fileio.openfile(str(tmp_path / 'a.txt'))
+        assert isinstance(doc.buf, document.MappedBuffer)
+
+        scrn = screen.Screen()
+        scrn.set_document(doc)
+        scrn.setsize(10, 30)
+        wnd = kaa_testutils._DmyWnd(scrn)
+        wnd.document = doc
+        doc.add_window(wnd)
+
+        while doc.mode.on_idle():
+            pass
+        assert doc.gettext(0, doc.endpos()) == 'abc\n' * 10
+
+        # the text is not editable
+        doc.mode.on_str(wnd, 'x')
+        doc.mode.view_commands.file_save(wnd)
+        mock.messagebar.set_message.assert_called_with(
+            'Read-only file cannot be saved')
+
+        # replace is not bound, and refused from the menu
+        assert all('search.showreplace' not in commands
+                   for keys, commands in doc.mode.keybind.keylist)
+        is_available, showreplace = doc.mode.get_command(
+            'search.showreplace')
+        showreplace(wnd)
+        mock.messagebar.set_message.assert_called_with(
+            'Read-only file cannot be modified')
+        assert not mock.show_inputline.called
+        assert (tmp_path / 'a.txt').read_text() == 'abc\n' * 10
+        doc.close()
+
+    @patch('kaa.app', create=True)
+    def test_openfile_encoding(self, mock, tmp_path):
+        mock.storage = fileio.FileStorage()
+        (tmp_path / 'a.txt').write_text('abc\n' * 10)
+
+        # large files are read into memory if the locale encoding can't
+        # be decoded page by page
+        with patch.object(fileio, 'VIEW_FILESIZE', 4), \
+                patch.object(fileio.locale, 'getpreferredencoding',
+                             lambda do_setlocale: 'shift_jis'):
+            doc = fileio.openfile(str(tmp_path / 'a.txt'))
+        assert isinstance(doc.buf, document.Buffer)
+        msg = mock.messagebar.set_message.call_args[0][0]
+        assert msg.endswith('. Large files in shift_jis are read into memory')
+        doc.close()
+
+        with patch.object(fileio, 'VIEW_FILESIZE', 4), \
+                patch.object(fileio.locale, 'getpreferredencoding',
+                             lambda do_setlocale: 'latin-1'):
+            doc = fileio.openfile(str(tmp_path / 'a.txt'))
+        assert doc.buf.encoding == 'iso8859-1'
+        doc.close()
@@ -197,6 +197,51 @@ class TestGappedBuf:
         del buf[1:-1]
         assert buf[:] == 'ag'
 
+    def test_apply_edits(self):
+        buf = _gappedbuf.GappedBuffer()
+        buf.insert(0, '0123456789')
+        buf.insert(3, 'abc')
+        buf.apply_edits([(0, 1, 'xyz'), (2, 5, ''), (6, 6, 'あ'), 
+                         (13, 13, '!')])
+        assert buf[:] == 'xyz1cあ3456789!'
+        assert buf.kind == 2
+
+        buf.apply_edits([])
+        assert buf[:] == 'xyz1cあ3456789!'
+
+        with pytest.raises(ValueError):
+            buf.apply_edits([(3, 5, ''), (4, 6, '')])
+        with pytest.raises(ValueError):
+            buf.apply_edits([(3, 5, ''), (1, 2, '')])
+        with pytest.raises(ValueError):
+            buf.apply_edits([(3, 15, '')])
+        assert buf[:] == 'xyz1cあ3456789!'
+
+    def test_find(self):
+        buf = _gappedbuf.GappedBuffer()
+        buf.insert(0, 'abcABCabcABC')
+        buf.insert(4, 'xyz')
+        s = buf[:]
+
+        for needle in ['abc', 'ABC', 'Cx', 'zB', 'q', 'abcABCabc']:
+            for begin, end in [(0, len(s)), (1, 10), (5, 6)]:
+                assert buf.find(needle, begin, end) == s.find(needle, begin, end)
+                assert (buf.rfind(needle, begin, end) ==
+                        s.rfind(needle, begin, end))
+
+        assert buf.find('ABC', 0, len(s), True) == 0
+        assert buf.rfind('ABC', 0, len(s), True) == 12
+        assert buf.find('', 3, 5) == 3
+        assert buf.rfind('', 3, 5) == 5
+        with pytest.raises(ValueError):
+            buf.find('a', 0, 100)
+
+        buf = _gappedbuf.GappedBuffer()
+        buf.insert(0, 'xxxÄÖxxxäöxxx')
+        assert buf.find('äö', 0, len(buf)) == 8
+        assert buf.find('äö', 0, len(buf), True) == 3
+        assert buf.rfind('ÄÖ', 0, len(buf), True) == 8
+
     def test_findchr(self):
         buf = _gappedbuf.GappedBuffer()
         buf[:] = 'abcdefg'
@@ -221,6 +266,37 @@ class TestGappedBuf:
         assert buf.rfindchr("Ag", 0, 17) == 16
         assert buf.rfindchr("A", 0, 17) == -1
 
+    def test_findchr_kind(self):
+        # long enough to scan a word at a time
+        for c in ['a', 'ā', '\U00010001']:
+            s = (c * 100 + '\n') * 3
+            buf = _gappedbuf.GappedBuffer()
+            buf.insert(0, s)
+            buf.insert(150, 'x')
+            buf.delete(150, 151)
+
+            assert buf.findchr('\n', 0, len(s)) == 100
+            assert buf.findchr('\n', 101, len(s)) == 201
+            assert buf.rfindchr('\n', 0, len(s)) == 302
+            assert buf.rfindchr('\n', 0, 302) == 201
+            assert buf.rfindchr('\n', 0, 100) == -1
+            assert buf.findint([ord(c)], 0, len(s), True) == 100
+            assert buf.rfindint([ord(c)], 0, len(s), True) == 302
+            assert buf.findchr('\U00010002', 0, len(s)) == -1
+
+    def test_count(self):
+        buf = _gappedbuf.GappedBuffer()
+        buf.insert(0, 'ab\ncd\n\nef')
+        buf.insert(3, 'ā')
+
+        assert buf.count('\n', 0, 10) == 3
+        assert buf.count('\n', 0, 3) == 1
+        assert buf.count('\n', 3, 3) == 0
+        assert buf.count('aā', 0, 10) == 2
+        assert buf.count('x', 0, 10) == 0
+        with pytest.raises(ValueError):
+            buf.count('a', 0, 11)
+
     def test_getints(self):
         buf = _gappedbuf.GappedBuffer()
         buf[:] = 'abcdefg'
@@ -317,3 +393,490 @@ class TestGappedBuf:
         buf.insertints(0, (1,)*10)
         assert buf.rfindint([0,1], 0, 21, True) == -1
 
+
+    def test_kind(self):
+        buf = _gappedbuf.GappedBuffer()
+        assert buf.kind == 1
+
+        buf.insert(0, 'abcdefg')
+        assert buf.kind == 1
+        assert buf.bufsize == 4096
+
+        # widen to UCS2 with gap at center
+        buf.insert(3, 'あい')
+        assert buf.kind == 2
+        assert buf[:] == 'abcあいdefg'
+
+        buf.insert(0, '0123')
+        assert buf.kind == 2
+        assert buf[:] == '0123abcあいdefg'
+
+        # widen to UCS4
+        buf.insert(7, '\U00100000')
+        assert buf.kind == 4
+        assert buf[:] == '0123abc\U00100000あいdefg'
+        assert buf[4:7] == 'abc'
+        assert buf[7] == '\U00100000'
+
+        # buffer never be narrowed
+        buf.delete(0, len(buf))
+        assert buf.kind == 4
+
+    def test_kind_setitem(self):
+        buf = _gappedbuf.GappedBuffer()
+        buf[:] = 'abcdefg'
+        buf.insert(0, 'abc')
+        buf[5] = 'あ'
+        assert buf.kind == 2
+        assert buf[:] == 'abcabあdefg'
+
+    def test_kind_find(self):
+        for c in ('\xff', 'あ', '\U00100000'):
+            buf = _gappedbuf.GappedBuffer()
+            buf[:] = 'abcdefg'
+            buf.insert(0, '0123456789'+c)
+
+            assert buf.findchr(c, 0, 18) == 10
+            assert buf.findchr('g', 0, 18) == 17
+            assert buf.rfindchr(c, 0, 18) == 10
+            assert buf.rfindchr('0', 0, 18) == 0
+            assert buf.getints(9, 12) == [ord('9'), ord(c), ord('a')]
+
+    def test_kind_ints(self):
+        buf = _gappedbuf.GappedBuffer()
+        buf.appendints((0,1,2,3,4,5,6,7,8,9))
+        assert buf.kind == 1
+
+        buf.insertints(5, (1000,))
+        assert buf.kind == 2
+        assert buf.getints(0, 11) == [0,1,2,3,4,1000,5,6,7,8,9]
+
+        buf.setints(0, 2, 100000)
+        assert buf.kind == 4
+        assert buf.getints(0, 11) == [100000,100000,2,3,4,1000,5,6,7,8,9]
+        assert buf.findint([1000], 0, 11, False) == 5
+
+    def test_sizeof(self):
+        buf = _gappedbuf.GappedBuffer()
+        buf.insert(0, 'a'*10000)
+        size1 = sys.getsizeof(buf)
+
+        buf.insert(0, 'あ')
+        assert sys.getsizeof(buf) >= size1 + buf.bufsize
+
+    def test_segments(self):
+        buf = _gappedbuf.GappedBuffer()
+        buf.insert(0, 'defg')
+        buf.insert(0, 'abc')
+
+        before, after = buf.segments()
+        assert before.readonly
+        assert before.tobytes() == b'abc'
+        assert after.tobytes() == b'defg'
+        before.release()
+        after.release()
+
+        before, after = buf.segments(1, 5)
+        assert (before.tobytes(), after.tobytes()) == (b'bc', b'de')
+        before.release()
+        after.release()
+
+        before, after = buf.segments(4, 5)
+        assert (before.tobytes(), after.tobytes()) == (b'', b'e')
+        before.release()
+        after.release()
+
+        before, after = buf.segments(0, 2)
+        assert (before.tobytes(), after.tobytes()) == (b'ab', b'')
+        before.release()
+        after.release()
+
+        with pytest.raises(ValueError):
+            buf.segments(0, 8)
+
+    def test_segments_kind(self):
+        buf = _gappedbuf.GappedBuffer()
+        buf.insert(0, 'あいう')
+        buf.insert(1, 'abc')
+        before, after = buf.segments()
+        assert before.itemsize == 2
+        assert before.tolist() == [ord(c) for c in 'あabc']
+        assert after.tolist() == [ord(c) for c in 'いう']
+        before.release()
+        after.release()
+
+        buf.insert(0, '\U00100000')
+        before, after = buf.segments()
+        assert before.itemsize == 4
+        assert before.tolist()+after.tolist() == [
+                ord(c) for c in '\U00100000あabcいう']
+
+    def test_segments_lock(self):
+        buf = _gappedbuf.GappedBuffer()
+        buf.insert(0, 'abcdefg')
+        segs = buf.segments()
+        assert buf.exports == 2
+
+        with pytest.raises(BufferError):
+            buf.insert(0, 'a')
+        with pytest.raises(BufferError):
+            buf.delete(0, 1)
+        with pytest.raises(BufferError):
+            buf[0] = 'x'
+        with pytest.raises(BufferError):
+            buf.setints(0, 1, 0)
+
+        for seg in segs:
+            seg.release()
+        assert buf.exports == 0
+        buf.insert(0, 'a')
+        assert buf[:] == 'aabcdefg'
+
+    def test_segments_hash(self):
+        import hashlib
+        s = '0123456789' * 1000
+        buf = _gappedbuf.GappedBuffer()
+        buf.insert(0, s)
+        buf.insert(5000, 'abc')
+        s = s[:5000]+'abc'+s[5000:]
+
+        md5 = hashlib.md5()
+        for seg in buf.segments():
+            md5.update(seg)
+            seg.release()
+        assert md5.hexdigest() == hashlib.md5(s.encode('latin-1')).hexdigest()
+
+
+class TestLineIndex:
+    def _check(self, lines, s):
+        assert lines.linecount() == s.count('\n')+1
+        tops = [0]+[i+1 for i, c in enumerate(s) if c == '\n']
+        for lineno, tol in enumerate(tops):
+            assert lines.line_to_pos(lineno) == tol
+        for pos in range(len(s)+1):
+            tol = s.rfind('\n', 0, pos)+1
+            eol = s.find('\n', pos)
+            eol = len(s) if eol == -1 else eol+1
+            assert lines.gettol(pos) == tol
+            assert lines.geteol(pos) == eol
+            assert lines.pos_to_line(pos) == s.count('\n', 0, pos)
+
+    def test_insert(self):
+        lines = _gappedbuf.LineIndex()
+        assert lines.linecount() == 1
+        assert lines.gettol(0) == 0
+        assert lines.geteol(0) == 0
+
+        s = 'abc\ndef\n\nghi'
+        lines.inserted(0, s)
+        self._check(lines, s)
+
+        lines.inserted(5, '\n\nxyz\n')
+        s = s[:5]+'\n\nxyz\n'+s[5:]
+        self._check(lines, s)
+
+        lines.inserted(0, '\n')
+        s = '\n'+s
+        self._check(lines, s)
+
+        lines.inserted(len(s), '\nend')
+        s = s+'\nend'
+        self._check(lines, s)
+
+    def test_delete(self):
+        lines = _gappedbuf.LineIndex()
+        s = '0\n1\n2\n3\n4\n5\n6\n7\n8\n9\n'
+        lines.inserted(0, s)
+
+        lines.deleted(3, 7)
+        s = s[:3]+s[7:]
+        self._check(lines, s)
+
+        lines.deleted(0, 1)
+        s = s[1:]
+        self._check(lines, s)
+
+        lines.deleted(10, len(s))
+        s = s[:10]
+        self._check(lines, s)
+
+        lines.deleted(0, len(s))
+        self._check(lines, '')
+
+    def test_expand(self):
+        lines = _gappedbuf.LineIndex()
+        s = 'a\n' * 1000
+        lines.inserted(0, s)
+        lines.inserted(1001, '\n' * 1000)
+        s = s[:1001] + '\n' * 1000 + s[1001:]
+        self._check(lines, s)
+
+    def test_range(self):
+        lines = _gappedbuf.LineIndex()
+        lines.inserted(0, 'abc\n')
+        with pytest.raises(ValueError):
+            lines.inserted(5, 'a')
+        with pytest.raises(ValueError):
+            lines.deleted(0, 5)
+        with pytest.raises(ValueError):
+            lines.pos_to_line(5)
+        with pytest.raises(IndexError):
+            lines.line_to_pos(2)
+
+class TestStyleRuns:
+    def _check(self, runs, values):
+        assert len(runs) == len(values)
+        assert runs.getints(0, len(values)) == values
+        for pos, v in enumerate(values):
+            assert runs.getint(pos) == v
+
+        ret = list(runs.iter_runs(0, len(values)))
+        assert len(ret) == runs.numruns
+        assert [v for (b, e, v) in ret for i in range(b, e)] == values
+
+    def test_setints(self):
+        runs = _gappedbuf.StyleRuns()
+        runs.inserted(0, 10)
+        self._check(runs, [0]*10)
+        assert runs.numruns == 1
+
+        runs.setints(3, 5, 1)
+        self._check(runs, [0, 0, 0, 1, 1, 0, 0, 0, 0, 0])
+        assert list(runs.iter_runs(0, 10)) == [(0, 3, 0), (3, 5, 1), 
+                                               (5, 10, 0)]
+        assert list(runs.iter_runs(4, 6)) == [(4, 5, 1), (5, 6, 0)]
+
+        runs.setints(4, 8, 2)
+        self._check(runs, [0, 0, 0, 1, 2, 2, 2, 2, 0, 0])
+
+        runs.setints(0, 10, 0)
+        self._check(runs, [0]*10)
+        assert runs.numruns == 1
+
+    def test_edit(self):
+        runs = _gappedbuf.StyleRuns()
+        runs.inserted(0, 6)
+        runs.setints(2, 4, 1)
+
+        # inserted characters inherit preceding value
+        runs.inserted(3, 2)
+        self._check(runs, [0, 0, 1, 1, 1, 1, 0, 0])
+        runs.inserted(0, 1)
+        self._check(runs, [0, 0, 0, 1, 1, 1, 1, 0, 0])
+
+        runs.deleted(1, 5)
+        self._check(runs, [0, 1, 1, 0, 0])
+        runs.deleted(1, 3)
+        self._check(runs, [0, 0, 0])
+        assert runs.numruns == 1
+        runs.deleted(0, 3)
+        self._check(runs, [])
+        assert runs.numruns == 0
+
+    def test_find(self):
+        runs = _gappedbuf.StyleRuns()
+        runs.inserted(0, 10)
+        runs.setints(3, 5, 1)
+        runs.setints(7, 8, 2)
+
+        assert runs.findint([1, 2], 0, 10, False) == 3
+        assert runs.findint([1, 2], 5, 10, False) == 7
+        assert runs.findint([0], 0, 10, True) == 3
+        assert runs.findint([2], 0, 7, False) == -1
+        assert runs.rfindint([1, 2], 0, 10, False) == 7
+        assert runs.rfindint([1], 0, 10, False) == 4
+        assert runs.rfindint([0], 0, 10, True) == 7
+        assert runs.rfindint([0], 0, 3, True) == -1
+
+    def test_random(self):
+        import random
+        rnd = random.Random(0)
+
+        runs = _gappedbuf.StyleRuns()
+        values = []
+        for i in range(2000):
+            op = rnd.randrange(3)
+            b = rnd.randint(0, len(values))
+            e = rnd.randint(b, len(values))
+            if op == 0:
+                v = values[b-1] if b else 0
+                runs.inserted(b, e-b+1)
+                values[b:b] = [v] * (e-b+1)
+            elif op == 1:
+                runs.deleted(b, e)
+                del values[b:e]
+            else:
+                v = rnd.randrange(3)
+                runs.setints(b, e, v)
+                values[b:e] = [v] * (e-b)
+
+            assert runs.getints(0, len(values)) == values
+        self._check(runs, values)
+
+    def test_range(self):
+        runs = _gappedbuf.StyleRuns()
+        runs.inserted(0, 3)
+        with pytest.raises(ValueError):
+            runs.inserted(4, 1)
+        with pytest.raises(ValueError):
+            runs.deleted(0, 4)
+        with pytest.raises(ValueError):
+            runs.setints(2, 4, 1)
+        with pytest.raises(IndexError):
+            runs.getint(3)
+
+class TestMatchSpans:
+    def _getspans(self, textlen, spans):
+        ret = _gappedbuf.MatchSpans()
+        ret.inserted(0, textlen)
+        for b, e in spans:
+            ret.add(b, e)
+        return ret
+
+    def test_add(self):
+        spans = self._getspans(100, [(20, 25), (0, 2), (30, 30), (10, 12)])
+        assert len(spans) == 4
+        assert list(spans.iter_spans(0, 100)) == [(0, 2), (10, 12), 
+                                                  (20, 25), (30, 30)]
+        assert list(spans.iter_spans(11, 21)) == [(10, 12), (20, 25)]
+
+        with pytest.raises(ValueError):
+            spans.add(24, 26)
+        with pytest.raises(ValueError):
+            spans.add(1, 10)
+
+    def test_find(self):
+        spans = self._getspans(100, [(0, 2), (10, 12), (20, 25), (30, 30)])
+        assert spans.next(11) == (20, 25)
+        assert spans.next(30) == (30, 30)
+        assert spans.next(31) is None
+        assert spans.prev(24) == (10, 12)
+        assert spans.prev(30) == (30, 30)
+        assert spans.prev(1) is None
+        assert spans.index(20) == 2
+        assert spans.index(21) == 3
+
+    def test_edit(self):
+        spans = self._getspans(100, [(0, 2), (10, 12), (20, 25), (30, 30)])
+
+        # spans adjacent to deleted range are removed
+        assert spans.deleted(12, 13) == (10, 12)
+        assert list(spans.iter_spans(0, 99)) == [(0, 2), (19, 24), (29, 29)]
+        assert spans.deleted(40, 50) is None
+
+        # span contains inserted position is removed
+        spans.inserted(21, 3)
+        assert list(spans.iter_spans(0, 92)) == [(0, 2), (32, 32)]
+        assert spans.textlen == 92
+
+        assert spans.remove(0, 32) == 1
+        assert list(spans.iter_spans(0, 92)) == [(32, 32)]
+
+    def test_range(self):
+        spans = self._getspans(3, [])
+        with pytest.raises(ValueError):
+            spans.inserted(4, 1)
+        with pytest.raises(ValueError):
+            spans.deleted(0, 4)
+        with pytest.raises(ValueError):
+            spans.add(2, 4)
+
+class TestMarkIndex:
+    def test_add(self):
+        marks = _gappedbuf.MarkIndex()
+        ids = [marks.add(p) for p in [10, 0, 5, 10]]
+        assert len(marks) == 4
+        assert [marks.get(i) for i in ids] == [10, 0, 5, 10]
+        assert [p for p, i in marks.iter_marks(0, 10)] == [0, 5, 10, 10]
+        assert list(marks.iter_marks(1, 5)) == [(5, ids[2])]
+
+        marks.remove(ids[2])
+        assert len(marks) == 3
+        with pytest.raises(KeyError):
+            marks.get(ids[2])
+
+        # ids are reused
+        assert marks.add(3) == ids[2]
+
+    def test_edit(self):
+        marks = _gappedbuf.MarkIndex()
+        m1, m2, m3 = marks.add(5), marks.add(5, sticky=True), marks.add(10)
+
+        # sticky mark is moved by insertion at the mark
+        marks.inserted(5, 2)
+        assert [marks.get(i) for i in (m1, m2, m3)] == [5, 7, 12]
+
+        # marks in deleted range are moved to the top of the range
+        marks.deleted(4, 8)
+        assert [marks.get(i) for i in (m1, m2, m3)] == [4, 4, 8]
+        assert [i for p, i in marks.iter_marks(0, 10)] == [m1, m2, m3]
+
+        marks.inserted(4, 1)
+        assert [marks.get(i) for i in (m1, m2, m3)] == [4, 5, 9]
+
+    def test_expand(self):
+        marks = _gappedbuf.MarkIndex()
+        ids = [marks.add(p) for p in range(0, 1000, 2)]
+        marks.inserted(500, 10)
+        assert [marks.get(i) for i in ids[::100]] == [0, 200, 400, 
+                                                      610, 810]
+
+class TestIntBuffer:
+    def test_getints_into(self):
+        from array import array
+
+        buf = _gappedbuf.GappedBuffer()
+        buf.insert(0, 'abcdef')
+        buf.insert(3, 'xyz')
+
+        dest = array('I', [0]) * 9
+        assert buf.getints_into(0, 9, dest) == 9
+        assert list(dest) == buf.getints(0, 9)
+
+        dest = array('B', [0]) * 4
+        assert buf.getints_into(2, 6, dest) == 4
+        assert list(dest) == buf.getints(2, 6)
+
+        with pytest.raises(ValueError):
+            buf.getints_into(0, 9, array('I', [0]) * 8)
+        with pytest.raises(TypeError):
+            buf.getints_into(0, 1, array('i', [0]))
+        with pytest.raises(BufferError):
+            buf.getints_into(0, 1, b'\0')
+
+    def test_setints_from(self):
+        from array import array
+
+        buf = _gappedbuf.GappedBuffer()
+        buf.insertints(0, array('I', [1, 2, 3, 4, 5]))
+        assert buf.getints(0, 5) == [1, 2, 3, 4, 5]
+
+        buf.insert(2, 'ab')
+        buf.setints_from(1, array('H', [10, 11, 0x1000, 12]))
+        assert buf.kind == 2
+        assert buf.getints(0, 7) == [1, 10, 11, 0x1000, 12, 4, 5]
+
+        buf.replaceints(0, 7, array('I', [0x10000]))
+        assert buf.kind == 4
+        assert buf.getints(0, 1) == [0x10000]
+
+        with pytest.raises(ValueError):
+            buf.setints_from(0, array('I', [1, 2]))
+
+    def test_fill(self):
+        for c in ['a', 'ā', '\U00010001']:
+            buf = _gappedbuf.GappedBuffer()
+            buf.insert(0, c*10)
+            buf.insert(5, c)
+            buf.setints(3, 9, 7)
+            assert buf.getints(0, 11) == [ord(c)]*3 + [7]*6 + [ord(c)]*2
+
+    def test_styleruns(self):
+        from array import array
+
+        runs = _gappedbuf.StyleRuns()
+        runs.inserted(0, 5)
+        runs.setints(1, 3, 7)
+        dest = array('I', [9]) * 4
+        assert runs.getints_into(1, 5, dest) == 4
+        assert list(dest) == [7, 7, 0, 0]
@@ -1,3 +1,4 @@
+import time
 import pytest
 import _gappedbuf
 import gappedbuf.re
@@ -38,3 +39,279 @@ class TestGappedBuf:
 
         assert ''.join(m.group() for m in RE_SPLITWORD.finditer(buf, 0)) == '0123 abc あいうえお'
 
+
+    def test_rsearch(self):
+        buf = _gappedbuf.GappedBuffer()
+        buf.insert(0, 'hello world ' * 20000)
+        buf.insert(100000, 'x')
+
+        regex = gappedbuf.re.compile(r'\w+')
+        assert regex.rsearch(buf, 16).span() == (6, 11)
+        assert regex.rsearch(buf, 11).span() == (6, 11)
+        assert regex.rsearch(buf, 4) is None
+        assert regex.rsearch(buf).span() == (len(buf)-6, len(buf)-1)
+
+        # match spans window boundaries
+        for end in (100010, 65536*2+3, 65536*3):
+            expected = None
+            for m in regex.finditer(buf):
+                if m.end() > end:
+                    break
+                expected = m.span()
+            assert regex.rsearch(buf, end).span() == expected
+
+        # match doesn't depend on where windows start
+        buf2 = _gappedbuf.GappedBuffer()
+        buf2.insert(0, ('c' + 'a' * 9) * 20000)
+        regex = gappedbuf.re.compile('c[^c]*c')
+        spans = [m.span() for m in regex.finditer(buf2)]
+        for end in (50005, 100005, 65536*2+7, len(buf2)):
+            expected = [span for span in spans if span[1] <= end][-1]
+            assert regex.rsearch(buf2, end).span() == expected
+        assert regex.syncpos(buf2, 100005) == 0
+        assert regex.rsearch(buf2, 100005, 10).span() == (99990, 100001)
+
+        regex = gappedbuf.re.compile(r'\w+')
+        assert regex.syncpos(buf, 100005) == 100003
+        assert regex.syncpos(buf, 100002) == 99996
+        assert regex.syncpos(buf, 100002, 99998) == 99998
+
+        regex = gappedbuf.re.compile(r'(h)ello')
+        assert regex.rsearch(buf, len(buf), 12).span() == (len(buf)-12,
+                                                            len(buf)-7)
+        assert regex.rsearch(buf, 10, 1) is None
+        assert regex.rsearch(buf, 20, 1).group(1) == 'h'
+
+    def test_rsearch_linear(self):
+        # windows without a match don't scan the text after them
+        regex = gappedbuf.re.compile('(?i)needle')
+
+        def elapsed(n):
+            buf = _gappedbuf.GappedBuffer()
+            buf.insert(0, 'needle' + 'a' * n)
+            times = []
+            for i in range(3):
+                start = time.perf_counter()
+                assert regex.rsearch(buf).span() == (0, 6)
+                times.append(time.perf_counter() - start)
+            return min(times)
+
+        assert elapsed(2000000) < elapsed(200000) * 30
+
+    def test_search_short_range(self):
+        buf = _gappedbuf.GappedBuffer()
+        buf.insert(0, 'bbb c')
+        regex = gappedbuf.re.compile(r'b+ ?c')
+        assert regex.search(buf, 0, 0) is None
+        assert regex.search(buf, 0, 1) is None
+        assert regex.search(buf, 0, 5).span() == (0, 5)
+
+    def test_maxsteps(self):
+        buf = _gappedbuf.GappedBuffer()
+        buf.insert(0, 'a' * 30 + 'b')
+        regex = gappedbuf.re.compile(r'(a+)+c')
+        with pytest.raises(gappedbuf.re.StepLimitError):
+            regex.search(buf, maxsteps=1000)
+        with pytest.raises(gappedbuf.re.StepLimitError):
+            regex.match(buf, maxsteps=1000)
+        with pytest.raises(gappedbuf.re.StepLimitError):
+            list(regex.finditer(buf, maxsteps=1000))
+        with pytest.raises(gappedbuf.re.StepLimitError):
+            regex.rsearch(buf, maxsteps=1000)
+
+        # limit applies to each position
+        regex = gappedbuf.re.compile(r'a+b')
+        assert regex.search(buf, maxsteps=10).span() == (0, 31)
+        assert len(list(regex.finditer(buf, maxsteps=10))) == 1
+
+    def test_possessive(self):
+        buf = _gappedbuf.GappedBuffer()
+        buf.insert(0, '#aaab "x\\"y" z')
+
+        # possessive repeats never give back characters
+        assert gappedbuf.re.compile('a*+a').search(buf) is None
+        assert gappedbuf.re.compile('a++b').search(buf).span() == (1, 5)
+        assert gappedbuf.re.compile('(?:aa)++').search(buf).span() == (1, 3)
+        assert gappedbuf.re.compile('a?+a').search(buf).span() == (1, 3)
+        assert gappedbuf.re.compile('a{1,2}+b').search(buf).span() == (2, 5)
+        assert gappedbuf.re.compile(
+            r'"(?:\\.|[^"\\])*+"').search(buf).span() == (6, 12)
+
+        # atomic groups don't backtrack into once matched
+        assert gappedbuf.re.compile('(?>a+)a').search(buf) is None
+        assert gappedbuf.re.compile('(?>a|aa)b').search(buf).span() == (3, 5)
+        m = gappedbuf.re.compile('(?>(a+))(b)').search(buf)
+        assert m.span(1) == (1, 4)
+        assert m.span(2) == (4, 5)
+
+        # groups of failed attempts don't leak into later matches
+        buf = _gappedbuf.GappedBuffer()
+        buf.insert(0, '"b\n"ba"aab baxx cb\ncxcb  ""\n')
+        for pattern in (r'(a|b)*+c', r'(?>(a|b)*)c', r'(a|b)*c'):
+            regex = gappedbuf.re.compile(pattern)
+            assert [(m.span(), m.groups()) for m in regex.finditer(buf)] == [
+                ((16, 17), (None,)), ((19, 20), (None,)), ((21, 22), (None,))]
+
+        buf = _gappedbuf.GappedBuffer()
+        buf.insert(0, '#ab ac')
+        m = gappedbuf.re.compile(r'(?>(a)|(b))c').search(buf)
+        assert m.span() == (4, 6)
+        assert m.groups() == ('a', None)
+        m = gappedbuf.re.compile(r'(?:(?>(a)b)d|(a)c)').search(buf)
+        assert m.groups() == (None, 'a')
+        m = gappedbuf.re.compile(r'(?:(?>(a)+)b)d|(a)c').search(buf)
+        assert m.groups() == (None, 'a')
+        m = gappedbuf.re.compile(r'(?:((a)|b)++ )?a(c)').search(buf)
+        assert m.span() == (1, 6)
+        assert m.groups() == ('b', 'a', 'c')
+
+        # nested repeats run in linear time
+        buf = _gappedbuf.GappedBuffer()
+        buf.insert(0, '#' + 'a' * 5000)
+        for pattern in (r'(?>a+)+b', r'(?:a++)+b', r'(?>a|aa)*b'):
+            regex = gappedbuf.re.compile(pattern)
+            assert regex.match(buf, 1, maxsteps=100000) is None
+        with pytest.raises(gappedbuf.re.StepLimitError):
+            gappedbuf.re.compile(r'(?:a+)+b').match(buf, 1, maxsteps=100000)
+
+    def test_kind(self):
+        regex = gappedbuf.re.compile('c.+e')
+        for c in ('\xff', 'あ', '\U00100000'):
+            buf = _gappedbuf.GappedBuffer()
+            buf.insert(0, 'abdefg')
+            buf.insert(2, 'c'+c)
+            assert regex.search(buf).group() == 'c'+c+'de'
+            assert regex.search(buf, 2).span() == (2, 6)
+
+    def test_gap(self):
+        regex = gappedbuf.re.compile('a.c')
+
+        # searches don't move the gap
+        buf = _gappedbuf.GappedBuffer()
+        buf.insert(0, '0123456789' * 10)
+        buf.insert(50, 'abc')
+        assert buf.gap == 53
+        assert regex.search(buf).span() == (50, 53)
+        assert regex.search(buf, 51) is None
+        assert buf.gap == 53
+
+        # match across the gap
+        buf.insert(51, 'x')
+        buf.delete(51, 52)
+        assert buf.gap == 51
+        assert regex.search(buf).span() == (50, 53)
+        assert regex.rsearch(buf).span() == (50, 53)
+        assert buf.gap == 51
+
+        # literal prefix on either side of the gap
+        for c in ('a', 'あ', '\U00100000'):
+            buf = _gappedbuf.GappedBuffer()
+            buf.insert(0, 'x' * 100 + c + 'bc' + 'x' * 100)
+            for gap in (0, 50, 100, 101, 102, 150, len(buf)):
+                buf.insert(gap, 'y')
+                buf.delete(gap, gap+1)
+                assert gappedbuf.re.compile(c+'bc').search(buf).span() == (
+                    100, 103)
+                assert gappedbuf.re.compile(c).search(buf).start() == 100
+                assert buf.gap == gap
+
+    def test_nogil(self):
+        import threading
+
+        # buffer is locked while the matcher runs without GIL
+        buf = _gappedbuf.GappedBuffer()
+        buf.insert(0, 'a' * 10000000)
+        regex = gappedbuf.re.compile('[bc]')
+
+        result = []
+        t = threading.Thread(target=lambda: result.append(regex.search(buf)))
+        locked = 0
+        t.start()
+        while t.is_alive():
+            try:
+                buf.insert(0, 'a')
+                buf.delete(0, 1)
+            except BufferError:
+                locked += 1
+        t.join()
+
+        assert result == [None]
+        assert locked
+        assert buf.exports == 0
+        buf.insert(0, 'b')
+        assert regex.search(buf).start() == 0
+
+
+class TestMultiMatcher:
+
+    def test_search(self):
+        matcher = _gappedbuf.MultiMatcher(['he', 'she', 'his', 'hers'])
+        buf = _gappedbuf.GappedBuffer()
+        buf.insert(0, 'ushers his')
+        buf.insert(3, '')
+
+        # the leftmost and then the longest word
+        m = matcher.search(buf)
+        assert m.span() == (1, 4)
+        assert m.group() == 'she'
+        assert matcher.words[m.index] == 'she'
+
+        assert matcher.search(buf, 2).span() == (2, 6)
+        assert matcher.search(buf, 2, 5).span() == (2, 4)
+        assert matcher.match(buf, 3) is None
+        assert [m.span() for m in matcher.finditer(buf)] == [
+            (1, 4), (7, 10)]
+        assert matcher.rsearch(buf).span() == (7, 10)
+        assert matcher.rsearch(buf, 9).span() == (1, 4)
+
+    def test_wordboundary(self):
+        matcher = _gappedbuf.MultiMatcher(['if', 'is', 'isinstance', '+'],
+                                          wordboundary=True)
+        buf = _gappedbuf.GappedBuffer()
+        buf.insert(0, 'if isinstance(x) elif this+is')
+        assert [m.group() for m in matcher.finditer(buf)] == [
+            'if', 'isinstance', '+', 'is']
+
+        # text after endpos is not a word
+        assert matcher.search(buf, 3, 5).span() == (3, 5)
+
+    def test_ignorecase(self):
+        matcher = _gappedbuf.MultiMatcher(['Spam', 'HAM'], ignorecase=True)
+        buf = _gappedbuf.GappedBuffer()
+        buf.insert(0, 'sPAM ham \u0130')
+        assert [m.group() for m in matcher.finditer(buf)] == ['sPAM', 'ham']
+
+    def test_kind(self):
+        matcher = _gappedbuf.MultiMatcher(['\u3042\u3044', '\U00100000'])
+        for s in ('abc', '\u3042\u3044', '\U00100000'):
+            buf = _gappedbuf.GappedBuffer()
+            buf.insert(0, 'xx')
+            buf.insert(1, s)
+            m = matcher.search(buf)
+            assert (m and m.group()) == (s if s != 'abc' else None)
+
+    def test_rope(self):
+        matcher = _gappedbuf.MultiMatcher(['ab', 'b'], wordboundary=True)
+        buf = _gappedbuf.RopeBuffer()
+        buf.insert(0, 'xab ab b')
+        assert [m.span() for m in matcher.finditer(buf, 1)] == [
+            (4, 6), (7, 8)]
+        assert matcher.rsearch(buf).span() == (7, 8)
+
+    def test_rsearch(self):
+        matcher = _gappedbuf.MultiMatcher(['aa', 'ab'])
+        buf = _gappedbuf.GappedBuffer()
+        buf.insert(0, 'a' * 10001 + 'b ' + 'a' * 20000)
+        spans = [m.span() for m in matcher.finditer(buf)]
+        for end in (4097, 10003, 14000, 14001, len(buf)):
+            expected = [span for span in spans if span[1] <= end][-1]
+            assert matcher.rsearch(buf, end).span() == expected
+        assert matcher.syncpos(buf, 8193) == 0
+        assert matcher.syncpos(buf, 10004) == 10003
+
+    def test_many_words(self):
+        words = ['w{}'.format(i) for i in range(10000)]
+        matcher = _gappedbuf.MultiMatcher(words, wordboundary=True)
+        buf = _gappedbuf.GappedBuffer()
+        buf.insert(0, 'w1 w99999 w9999 x w')
+        assert [m.group() for m in matcher.finditer(buf)] == ['w1', 'w9999']
@@ -0,0 +1,244 @@
+import random
+import tracemalloc
+import pytest
+import _gappedbuf
+import gappedbuf.re
+
+class TestRopeBuffer:
+    def test_insert(self):
+        buf = _gappedbuf.RopeBuffer()
+        buf.insert(0, 'abc')
+        assert len(buf) == 3
+        assert buf[:] == 'abc'
+
+        buf.insert(0, '123')
+        assert buf[:] == '123abc'
+
+        with pytest.raises(ValueError):
+            buf.insert(-1, '1')
+        with pytest.raises(ValueError):
+            buf.insert(7, '1')
+
+    def test_large(self):
+        buf = _gappedbuf.RopeBuffer()
+        s = ''.join(chr(ord('a')+i%26) for i in range(20000))
+        buf.insert(0, s)
+        buf.insert(10000, 'あいう')
+        s = s[:10000]+'あいう'+s[10000:]
+        assert buf[:] == s
+        assert buf[9999:10004] == s[9999:10004]
+        assert buf[10001] == 'い'
+        assert buf[-1] == s[-1]
+
+        buf.delete(4000, 15000)
+        s = s[:4000]+s[15000:]
+        assert buf[:] == s
+        assert len(buf) == len(s)
+
+    def test_random_edit(self):
+        rnd = random.Random(0)
+        buf = _gappedbuf.RopeBuffer()
+        s = ''
+        for i in range(1000):
+            pos = rnd.randint(0, len(s))
+            if rnd.random() < 0.6 or not s:
+                t = 'x\n' * rnd.randint(1, 3000)
+                buf.insert(pos, t)
+                s = s[:pos]+t+s[pos:]
+            else:
+                end = rnd.randint(pos, len(s))
+                buf.delete(pos, end)
+                s = s[:pos]+s[end:]
+        assert buf[:] == s
+
+    def test_setitem(self):
+        buf = _gappedbuf.RopeBuffer()
+        buf[:] = 'abcdefg'
+        buf[-1] = 'x'
+        buf[1] = 'x'
+        assert buf[:] == 'axcdefx'
+
+        with pytest.raises(IndexError):
+            buf[7] = 'a'
+        with pytest.raises(ValueError):
+            buf[0] = '12'
+
+        del buf[1:-1]
+        assert buf[:] == 'ax'
+
+    def test_iterchunks(self):
+        buf = _gappedbuf.RopeBuffer()
+        s = '0123456789' * 1000
+        buf.insert(0, s)
+        chunks = list(buf.iterchunks(0, len(s)))
+        assert ''.join(c for p, c in chunks) == s
+
+        chunks = list(buf.riterchunks(0, len(s)))
+        assert ''.join(c for p, c in reversed(chunks)) == s
+
+        for p, c in buf.iterchunks(5000, 5001):
+            assert p <= 5000 < p+len(c)
+
+    def test_apply_edits(self):
+        buf = _gappedbuf.RopeBuffer()
+        buf.insert(0, '0123456789abc')
+        buf.apply_edits([(0, 1, 'xyz'), (2, 5, ''), (6, 6, 'あ'), 
+                         (13, 13, '!')])
+        assert buf[:] == 'xyz15あ6789abc!'
+
+        with pytest.raises(ValueError):
+            buf.apply_edits([(3, 5, ''), (4, 6, '')])
+
+    def test_findchr(self):
+        buf = _gappedbuf.RopeBuffer()
+        s = 'a'*10000+'b'+'a'*10000+'c'
+        buf.insert(0, s)
+
+        assert buf.findchr('b', 0, len(s)) == 10000
+        assert buf.findchr('cb', 0, len(s)) == 10000
+        assert buf.findchr('c', 0, len(s)) == 20001
+        assert buf.findchr('b', 10001, len(s)) == -1
+        assert buf.rfindchr('ab', 0, len(s)) == 20000
+        assert buf.rfindchr('b', 0, len(s)) == 10000
+        assert buf.rfindchr('b', 0, 10000) == -1
+        assert buf.count('b', 0, len(s)) == 1
+        assert buf.count('abc', 0, len(s)) == len(s)
+        assert buf.count('b', 10001, len(s)) == 0
+
+    def test_find(self):
+        buf = _gappedbuf.RopeBuffer()
+        s = 'a'*10000+'bcd'+'a'*10000+'BCD'
+        buf.insert(0, s)
+
+        assert buf.find('bcd', 0, len(s)) == 10000
+        assert buf.find('bcd', 10001, len(s)) == -1
+        assert buf.find('bcd', 10001, len(s), True) == 20003
+        assert buf.rfind('bcd', 0, len(s), True) == 20003
+        assert buf.rfind('abc', 0, len(s)) == 9999
+        assert buf.rfind('abc', 0, 10001) == -1
+
+    def test_find_chunks(self):
+        buf = _gappedbuf.RopeBuffer()
+        buf.insert(0, 'a' * 1000000 + 'bcd')
+
+        # the range is searched without a copy of it
+        tracemalloc.start()
+        try:
+            assert buf.find('abc', 0, len(buf)) == 999999
+            assert buf.rfind('aab', 0, len(buf)) == 999998
+            assert tracemalloc.get_traced_memory()[1] < 100000
+        finally:
+            tracemalloc.stop()
+
+    def test_ints(self):
+        buf = _gappedbuf.RopeBuffer()
+        buf.appendints((0,1,2,3,4,5,6,7,8,9))
+        buf.setints(1, 9, 255)
+        assert buf.getints(0, 10) == [0,255,255,255,255,255,255,255,255,9]
+
+        assert buf.findint([255], 0, 10, False) == 1
+        assert buf.findint([0], 0, 10, True) == 1
+        assert buf.rfindint([255], 0, 10, False) == 8
+        assert buf.rfindint([9], 0, 10, True) == 8
+
+    def test_regex(self):
+        buf = _gappedbuf.RopeBuffer()
+        buf.insert(0, 'a'*10000+'abcあいうdef'+'a'*10000)
+        regex = gappedbuf.re.compile('b.+e')
+        assert regex.search(buf).span() == (10001, 10008)
+        assert regex.search(buf).group() == 'bcあいうde'
+        assert [m.start() for m in gappedbuf.re.finditer('d', buf)] == [10006]
+
+
+class _Pages(_gappedbuf.PagedBuffer):
+    def __init__(self, pages):
+        self.pages = pages
+        self.loaded = []
+        for page in pages:
+            self.addpage(len(page))
+
+    def loadpage(self, n):
+        self.loaded.append(n)
+        return self.pages[n]
+
+
+class TestPagedBuffer:
+    def test_get(self):
+        pages = ['abc', 'de\nf', '', 'ghij']
+        s = ''.join(pages)
+        buf = _Pages(pages)
+        assert len(buf) == len(s)
+        assert buf.pagepos == [0, 3, 7, 7, 11]
+        assert buf.pageno(3) == 1
+        assert buf.pageno(7) == 3
+
+        for i in range(len(s)+1):
+            for j in range(i, len(s)+1):
+                assert buf[i:j] == s[i:j]
+        assert buf[-1] == 'j'
+
+        assert [p for p, c in buf.iterchunks(3, 8)] == [3, 7]
+        assert [p for p, c in buf.riterchunks(3, 8)] == [7, 3]
+        assert buf.findchr('\n', 0, len(s)) == 5
+        assert buf.rfind('fg', 0, len(s)) == 6
+
+        # matches across pages
+        for needle in ('cde', 'bcde\nfg', 'fghij', 'ab', 'ij', 'x'):
+            for begin in range(len(s)+1):
+                for end in range(begin, len(s)+1):
+                    assert buf.find(needle, begin, end) == s.find(
+                        needle, begin, end)
+                    assert buf.rfind(needle, begin, end) == s.rfind(
+                        needle, begin, end)
+
+    def test_cache(self):
+        buf = _Pages(['abc', 'def', 'ghi'])
+        buf.cachesize = 2
+        buf[:]
+        assert buf.loaded == [0, 1, 2]
+
+        # page 0 was evicted
+        buf[4]
+        buf[0]
+        assert buf.loaded == [0, 1, 2, 0]
+
+        # length of page is not changed
+        buf = _Pages(['abc'])
+        buf.pages[0] = 'ab'
+        with pytest.raises(ValueError):
+            buf[0]
+
+    def test_readonly(self):
+        buf = _Pages(['abc'])
+        with pytest.raises(BufferError):
+            buf.insert(0, 'x')
+        with pytest.raises(BufferError):
+            buf.delete(0, 1)
+        with pytest.raises(BufferError):
+            buf[0] = 'x'
+        assert buf[:] == 'abc'
+
+    def test_regex(self):
+        buf = _Pages(['a'*100, 'abcあ', 'いうdef', 'a'*100])
+        buf.cachesize = 1
+        regex = gappedbuf.re.compile('b.+e')
+        assert regex.search(buf).span() == (101, 108)
+        assert regex.search(buf).group() == 'bcあいうde'
+        assert regex.rsearch(buf, len(buf)).span() == (101, 108)
+
+        # errors reading pages are raised by the regex engine
+        class Broken(_Pages):
+            def loadpage(self, n):
+                if n == 2:
+                    raise OSError('broken page')
+                return super().loadpage(n)
+
+        buf = Broken(['a'*100, 'abcあ', 'いうdef', 'a'*100])
+        regex = gappedbuf.re.compile('b.+e')
+        for f in (lambda: regex.search(buf), lambda: regex.rsearch(buf),
+                  lambda: list(regex.finditer(buf)),
+                  lambda: regex.syncpos(buf, len(buf)),
+                  lambda: regex.findall(buf)):
+            with pytest.raises(OSError):
+                f()
+        assert regex.match(buf) is None